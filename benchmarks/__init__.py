@@ -0,0 +1,4 @@
+"""Synthetic IATI corpora and a benchmark harness for iatisplit.
+
+License: Public Domain
+"""
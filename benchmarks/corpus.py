@@ -0,0 +1,153 @@
+"""Deterministic generator for synthetic IATI activity files.
+
+The same parameters and seed always produce byte-for-byte the same
+file, so benchmark runs on different days (or machines) read exactly
+the same input. The knobs are the number of activities, the average
+number of transactions per activity, the share of humanitarian
+activities, and the approximate size of each activity (padded out with
+description text).
+
+Usage:
+
+    python -m benchmarks.corpus [options] output.xml
+
+License: Public Domain
+"""
+
+import argparse, random, sys
+from xml.sax.saxutils import escape
+
+
+COUNTRIES = ('AF', 'HT', 'KE', 'ML', 'NP', 'PK', 'SO', 'SS', 'SY', 'YE',)
+"""Recipient-country codes to draw from."""
+
+CURRENCIES = ('USD', 'USD', 'USD', 'EUR', 'GBP', 'CAD',)
+"""Default currencies to draw from (weighted towards USD)."""
+
+WORDS = (
+    'water', 'sanitation', 'health', 'education', 'food', 'security', 'shelter', 'protection',
+    'livelihoods', 'nutrition', 'emergency', 'response', 'capacity', 'district', 'support', 'programme',
+)
+"""Words for titles and padding text."""
+
+MIN_YEAR = 2008
+"""Earliest activity start year."""
+
+MAX_YEAR = 2022
+"""Latest activity start year."""
+
+
+def generate(output, activities=1000, transactions=5, humanitarian_ratio=0.1, activity_size=None, seed=0, version="2.03"):
+    """Write a synthetic IATI activity file.
+    @param output: a binary output stream.
+    @param activities: the number of activities.
+    @param transactions: the average number of transactions per activity (each activity gets 0 to 2x this many).
+    @param humanitarian_ratio: the share of activities flagged as humanitarian (0.0-1.0); half of them are flagged on the activity, and half on one of their transactions.
+    @param activity_size: if present, the approximate size of each activity in bytes (padded with description text).
+    @param seed: the random seed.
+    @param version: the IATI version for the root element.
+    @returns: the number of bytes written.
+    """
+    rng = random.Random(seed)
+    size = output.write(
+        '<?xml version="1.0" encoding="UTF-8"?>\n<iati-activities version="{}" generated-datetime="2019-01-01T00:00:00Z">\n'.format(version).encode('utf-8')
+    )
+    for n in range(activities):
+        size += output.write(make_activity(rng, n, transactions, humanitarian_ratio, activity_size).encode('utf-8'))
+    size += output.write(b'</iati-activities>\n')
+    return size
+
+
+def generate_file(filename, **kwargs):
+    """Write a synthetic IATI activity file to disk.
+    @param filename: the output path.
+    @param kwargs: parameters for generate().
+    @returns: the number of bytes written.
+    """
+    with open(filename, 'wb') as output:
+        return generate(output, **kwargs)
+
+
+def make_activity(rng, n, transactions, humanitarian_ratio, activity_size=None):
+    """Make the XML for one activity.
+    @param rng: the random.Random to draw from.
+    @param n: the activity number (for the identifier).
+    @param transactions: the average number of transactions.
+    @param humanitarian_ratio: the share of humanitarian activities.
+    @param activity_size: the approximate size in bytes, or None for no padding.
+    @returns: the XML as a string.
+    """
+    humanitarian = rng.random() < humanitarian_ratio
+    flag_activity = humanitarian and rng.random() < 0.5
+    start_year = rng.randint(MIN_YEAR, MAX_YEAR)
+    end_year = start_year + rng.randint(0, 5)
+    org = rng.randint(1, 200)
+    transaction_count = rng.randint(0, 2 * transactions) if transactions else 0
+    flagged_transaction = rng.randrange(transaction_count) if humanitarian and not flag_activity and transaction_count else None
+    if humanitarian and not flag_activity and flagged_transaction is None:
+        # no transactions to carry the flag
+        flag_activity = True
+
+    parts = [
+        '  <iati-activity last-updated-datetime="{}-{:02d}-{:02d}T00:00:00Z" default-currency="{}"{}>\n'.format(
+            rng.randint(2015, 2019), rng.randint(1, 12), rng.randint(1, 28), rng.choice(CURRENCIES),
+            ' humanitarian="1"' if flag_activity else ''
+        ),
+        '    <iati-identifier>XM-ORG-{:04d}-{:08d}</iati-identifier>\n'.format(org, n),
+        '    <reporting-org ref="XM-ORG-{:04d}" type="10"><narrative>Organisation {} &amp; partners</narrative></reporting-org>\n'.format(org, org),
+        '    <title><narrative xml:lang="en">{}</narrative></title>\n'.format(escape(_words(rng, 6).capitalize())),
+        '    <activity-status code="{}"/>\n'.format(rng.randint(1, 4)),
+        '    <activity-date type="1" iso-date="{}-01-01"/>\n'.format(start_year),
+    ]
+    if rng.random() < 0.7:
+        parts.append('    <activity-date type="2" iso-date="{}-{:02d}-01"/>\n'.format(start_year, rng.randint(1, 12)))
+    parts.append('    <activity-date type="3" iso-date="{}-12-31"/>\n'.format(end_year))
+    parts.append('    <recipient-country code="{}" percentage="100"/>\n'.format(rng.choice(COUNTRIES)))
+    parts.append('    <sector vocabulary="1" code="{}"/>\n'.format(rng.randint(11110, 99810)))
+    for i in range(transaction_count):
+        year = rng.randint(start_year, end_year)
+        parts.append(
+            '    <transaction{}><transaction-type code="{}"/><transaction-date iso-date="{}-{:02d}-15"/>'
+            '<value value-date="{}-01-01">{}</value></transaction>\n'.format(
+                ' humanitarian="1"' if i == flagged_transaction else '',
+                rng.randint(1, 4), year, rng.randint(1, 12), year, rng.randint(100, 1000000)
+            )
+        )
+
+    if activity_size is not None:
+        padding = activity_size - sum(len(part) for part in parts) - 100
+        if padding > 0:
+            text = _words(rng, padding // 8 + 1)[:padding]
+            parts.append('    <description><narrative xml:lang="en">{}</narrative></description>\n'.format(escape(text)))
+    parts.append('  </iati-activity>\n')
+    return ''.join(parts)
+
+
+def _words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def main(args):
+    """Command-line entry point.
+    @param args: the command-line arguments (without the program name).
+    @returns: the exit status.
+    """
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic IATI activity file.")
+    parser.add_argument('--activities', '-n', type=int, default=1000, help="Number of activities (default 1000).")
+    parser.add_argument('--transactions', '-t', type=int, default=5, help="Average transactions per activity (default 5).")
+    parser.add_argument('--humanitarian-ratio', '-H', type=float, default=0.1, help="Share of humanitarian activities (default 0.1).")
+    parser.add_argument('--activity-size', '-s', type=int, default=None, help="Approximate size of each activity in bytes.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default 0).")
+    parser.add_argument('output', help="Output filename.")
+    result = parser.parse_args(args)
+    generate_file(
+        result.output, activities=result.activities, transactions=result.transactions,
+        humanitarian_ratio=result.humanitarian_ratio, activity_size=result.activity_size, seed=result.seed
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
+
+# end of module
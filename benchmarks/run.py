@@ -0,0 +1,252 @@
+"""Benchmark harness for iatisplit.split.split().
+
+Runs split() over synthetic corpora (see benchmarks.corpus) with a
+range of filter combinations, and records throughput, peak resident
+memory, output size and per-stage times for each case. Each run happens
+in a fresh process, so that peak memory belongs to that case alone, and
+the fastest of several repeats is kept. CPU time is recorded too, but
+the comparison uses wall-clock throughput, which is what a user waits
+for.
+
+The results are compared against a stored baseline (by default
+benchmarks/baseline.json). A case is flagged if its throughput drops or
+its peak memory grows by more than the tolerance, or if it writes a
+different number of activities, files or bytes. The report also
+includes the startup time of the command (see benchmarks.startup),
+flagged if it grows by more than the tolerance or if startup imports a
+module that should be deferred. Throughput and memory
+depend on the machine, so record a new baseline (--save-baseline) on
+the machine that runs the comparisons before relying on it.
+
+Usage:
+
+    python -m benchmarks.run [options]
+
+License: Public Domain
+"""
+
+import argparse, concurrent.futures, fnmatch, hashlib, json, logging, multiprocessing, os, platform, shutil, sys, tempfile, time
+from benchmarks.corpus import generate_file
+from benchmarks.startup import compare_startup, log_startup, measure_startup
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+CORPORA = {
+    'typical': dict(activities=5000, transactions=5, humanitarian_ratio=0.1),
+    'humanitarian': dict(activities=5000, transactions=2, humanitarian_ratio=0.5),
+    'transaction-heavy': dict(activities=1000, transactions=50, humanitarian_ratio=0.1),
+    'large-activities': dict(activities=200, transactions=5, humanitarian_ratio=0.1, activity_size=100000),
+}
+"""Generator parameters for each corpus (see benchmarks.corpus.generate())."""
+
+SCENARIOS = {
+    'all': dict(max=1000),
+    'humanitarian': dict(max=1000, humanitarian_only=True),
+    'activity-dates': dict(max=1000, start_date='2012-01-01', end_date='2016-12-31'),
+    'transactions': dict(max=1000, transaction_type='3', transaction_start_date='2015-01-01'),
+    'expression': dict(max=1000, filters=('recipient-country/@code in (SO, YE) and not @humanitarian = 1',)),
+    'max-bytes': dict(max_bytes=1000000),
+    'gzip': dict(max=1000, compression='gzip', compression_level=1),
+}
+"""split() keyword arguments for each scenario."""
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+"""The stored baseline."""
+
+DEFAULT_CORPUS_DIR = os.path.join(tempfile.gettempdir(), "iatisplit-benchmarks")
+"""Where generated corpora are kept between runs."""
+
+DEFAULT_TOLERANCE = 0.25
+"""Default allowed slowdown (or memory growth) before a case is flagged."""
+
+DEFAULT_REPEAT = 5
+"""Default number of runs per case (the fastest is kept)."""
+
+
+def make_corpus(corpus_dir, name, scale=1):
+    """Generate a corpus, unless it's already there.
+    The filename includes a hash of the parameters, so a changed definition gets a new file.
+    @param corpus_dir: the directory for corpora.
+    @param name: the key in CORPORA.
+    @param scale: a multiplier for the number of activities.
+    @returns: the path to the corpus file.
+    """
+    params = dict(CORPORA[name])
+    params['activities'] = max(1, int(params['activities'] * scale))
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+    filename = os.path.join(corpus_dir, "{}-{}.xml".format(name, digest))
+    if not os.path.exists(filename):
+        os.makedirs(corpus_dir, exist_ok=True)
+        logger.info("Generating corpus %s", filename)
+        temp_filename = filename + ".tmp"
+        generate_file(temp_filename, **params)
+        os.replace(temp_filename, filename)
+    return filename
+
+
+def run_case(filename, options):
+    """Split a corpus once (meant to run in a fresh process).
+    @param filename: the corpus file.
+    @param options: keyword arguments for split().
+    @returns: a dict of measurements.
+    """
+    # imported here, so that the import isn't part of the parent's memory or the timing
+    from iatisplit.split import split
+    from iatisplit.stats import Stats
+
+    output_dir = tempfile.mkdtemp(prefix="iatisplit-benchmark-")
+    try:
+        options = dict(options)
+        max = options.pop('max', None)
+        stats = Stats()
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        summary = split(filename, max, output_dir=output_dir, output_stub="out", use_index=False, stats=stats, **options)
+        cpu = time.process_time() - cpu_started
+        elapsed = time.perf_counter() - started
+        output_bytes = sum(os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir))
+    finally:
+        shutil.rmtree(output_dir)
+    input_bytes = os.path.getsize(filename)
+    statistics = stats.to_dict()
+    return {
+        "elapsed": round(elapsed, 4),
+        "cpu": round(cpu, 4),
+        "mb_per_second": round(input_bytes / elapsed / 1e6, 2),
+        "cpu_mb_per_second": round(input_bytes / cpu / 1e6, 2) if cpu else None,
+        "peak_rss_kb": statistics["peak_rss_kb"],
+        "activities": summary["activities"],
+        "files": summary["files"],
+        "output_bytes": output_bytes,
+        "times": statistics["times"],
+    }
+
+
+def measure(filename, options, repeat=DEFAULT_REPEAT):
+    """Run a case several times, each in a fresh process.
+    @param filename: the corpus file.
+    @param options: keyword arguments for split().
+    @param repeat: the number of runs.
+    @returns: the measurements from the fastest run, with the lowest peak memory of all the runs.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for _ in range(max(1, repeat)):
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as executor:
+            results.append(executor.submit(run_case, filename, options).result())
+    best = min(results, key=lambda result: result["elapsed"])
+    rss = [result["peak_rss_kb"] for result in results if result["peak_rss_kb"] is not None]
+    best["peak_rss_kb"] = min(rss) if rss else None
+    return best
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compare results against a baseline.
+    @param results: a dict of measurements, keyed by "corpus/scenario".
+    @param baseline: a baseline dict, as saved by main() (with a "results" key).
+    @param tolerance: the allowed fractional slowdown or memory growth.
+    @returns: a list of (case, message) tuples for the flagged cases.
+    """
+    problems = []
+    for case, result in sorted(results.items()):
+        old = baseline["results"].get(case)
+        if old is None:
+            continue
+        if result["mb_per_second"] < old["mb_per_second"] * (1 - tolerance):
+            problems.append((case, "throughput {:.2f} MB/s, baseline {:.2f} MB/s ({:+.0%})".format(
+                result["mb_per_second"], old["mb_per_second"], result["mb_per_second"] / old["mb_per_second"] - 1
+            )))
+        if result["peak_rss_kb"] and old.get("peak_rss_kb") and result["peak_rss_kb"] > old["peak_rss_kb"] * (1 + tolerance):
+            problems.append((case, "peak RSS {:,} KB, baseline {:,} KB".format(result["peak_rss_kb"], old["peak_rss_kb"])))
+        for key in ("activities", "files", "output_bytes",):
+            if result[key] != old[key]:
+                problems.append((case, "{} {}, baseline {}".format(key, result[key], old[key])))
+    return problems
+
+
+def main(args):
+    """Command-line entry point.
+    @param args: the command-line arguments (without the program name).
+    @returns: the exit status (1 if any case was flagged).
+    """
+    parser = argparse.ArgumentParser(description="Benchmark iatisplit over synthetic IATI corpora.")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, metavar="FILENAME", help="The baseline to compare against (or save).")
+    parser.add_argument('--save-baseline', action='store_true', help="Save the results as the new baseline instead of comparing.")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="Allowed slowdown or memory growth (default 0.25).")
+    parser.add_argument('--repeat', '-r', type=int, default=DEFAULT_REPEAT, help="Runs per case; the fastest is kept (default 5).")
+    parser.add_argument('--scale', type=float, default=1, help="Multiply the number of activities in each corpus.")
+    parser.add_argument('--corpus-dir', default=DEFAULT_CORPUS_DIR, metavar="DIRECTORY", help="Where to keep generated corpora.")
+    parser.add_argument('--only', default='*', metavar="PATTERN", help="Run only the cases (corpus/scenario, or startup) matching this glob pattern.")
+    parser.add_argument('--output', '-o', default=None, metavar="FILENAME", help="Also save the results to this JSON file.")
+    result = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    baseline = None
+    if not result.save_baseline and os.path.exists(result.baseline):
+        with open(result.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != result.scale:
+            parser.error("The baseline was recorded with --scale {}".format(baseline.get("scale")))
+
+    results = {}
+    for corpus in CORPORA:
+        filename = None
+        for scenario, options in SCENARIOS.items():
+            case = "{}/{}".format(corpus, scenario)
+            if not fnmatch.fnmatchcase(case, result.only):
+                continue
+            if filename is None:
+                filename = make_corpus(result.corpus_dir, corpus, result.scale)
+            results[case] = measurement = measure(filename, options, result.repeat)
+            old = baseline["results"].get(case) if baseline else None
+            logger.info(
+                "%-34s %8.2f MB/s %10s KB %6d activities %4d files%s",
+                case, measurement["mb_per_second"], "{:,}".format(measurement["peak_rss_kb"] or 0),
+                measurement["activities"], measurement["files"],
+                " ({:+.0%})".format(measurement["mb_per_second"] / old["mb_per_second"] - 1) if old else ""
+            )
+
+    startup = None
+    if fnmatch.fnmatchcase("startup", result.only):
+        startup = measure_startup(result.repeat * 2)
+        log_startup(startup, baseline.get("startup") if baseline else None)
+
+    report = {
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "scale": result.scale,
+        "results": results,
+        "startup": startup,
+    }
+    if result.output:
+        with open(result.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if result.save_baseline:
+        with open(result.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write("\n")
+        logger.info("Saved baseline to %s", result.baseline)
+        return 0
+
+    if baseline is None:
+        logger.warning("No baseline at %s (use --save-baseline to record one)", result.baseline)
+        return 0
+    if baseline.get("machine") != report["machine"]:
+        logger.warning("The baseline was recorded on a different machine (%s); throughput and memory may not be comparable", baseline.get("machine"))
+    problems = compare(results, baseline, result.tolerance)
+    if startup is not None:
+        problems += compare_startup(startup, baseline.get("startup"), result.tolerance)
+    for case, message in problems:
+        logger.error("REGRESSION %s: %s", case, message)
+    if not problems:
+        logger.info("No regressions against %s", result.baseline)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
+
+# end of module
@@ -0,0 +1,157 @@
+"""Startup-time benchmark for the iatisplit command.
+
+Every run of the command pays for importing iatisplit and its
+dependencies before it reads a byte of input, which adds up when a
+shell loop splits thousands of small files. This benchmark imports
+iatisplit.__main__ in fresh interpreters with "python -X importtime",
+and records the total import time (the fastest of several runs), the
+modules with the most import time of their own, and the wall-clock time
+of "python -m iatisplit --version".
+
+It also lists any of DEFERRED_MODULES that got imported at startup:
+those are needed only for optional features (URLs, indexes, worker
+pools, compression, and so on), so iatisplit imports them only when a
+feature needs them.
+
+benchmarks.run includes these measurements in its report and baseline.
+
+Usage:
+
+    python -m benchmarks.startup [--repeat N]
+
+License: Public Domain
+"""
+
+import argparse, compileall, logging, os, re, subprocess, sys, time
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+STARTUP_MODULE = 'iatisplit.__main__'
+"""The module imported by the command."""
+
+DEFERRED_MODULES = (
+    'requests', 'urllib3', 'sqlite3', 'concurrent.futures', 'gzip', 'lzma', 'bz2', 'cProfile', 'tempfile',
+    'xml.parsers.expat', 'iatisplit.cache', 'iatisplit.dedup', 'iatisplit.download', 'iatisplit.manifest', 'iatisplit.merge', 'iatisplit.parallel', 'iatisplit.sort',
+)
+"""Modules that shouldn't be imported just to start the command."""
+
+DEFAULT_REPEAT = 10
+"""Default number of interpreters to start (the fastest is kept)."""
+
+IMPORTTIME_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)\s*$')
+"""Match a line of "python -X importtime" output (self and cumulative microseconds, and module name)."""
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+"""The source tree to benchmark."""
+
+
+def parse_importtime(text):
+    """Parse the output of "python -X importtime".
+    @param text: the standard error of the interpreter.
+    @returns: a dict of (self microseconds, cumulative microseconds) tuples, keyed by module name.
+    """
+    timings = {}
+    for line in text.splitlines():
+        result = IMPORTTIME_PATTERN.match(line)
+        if result:
+            timings[result.group(3)] = (int(result.group(1)), int(result.group(2)))
+    return timings
+
+
+def import_timings(code, python=sys.executable):
+    """Run some code in a fresh interpreter with "-X importtime".
+    @param code: the Python code to run.
+    @param python: the interpreter.
+    @returns: the timings, from parse_importtime().
+    """
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", code], cwd=ROOT_DIRECTORY, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True
+    )
+    return parse_importtime(result.stderr.decode('utf-8', 'replace'))
+
+
+def measure_startup(repeat=DEFAULT_REPEAT, python=sys.executable):
+    """Measure the startup time of the command.
+    The package is byte-compiled first, so that the runs don't include compiling changed sources.
+    @param repeat: the number of interpreters to start for each measurement.
+    @param python: the interpreter.
+    @returns: a dict with the fastest import time of STARTUP_MODULE (import_ms), the fastest "--version" run (version_ms),
+    the number of modules imported beyond a bare interpreter (modules), the ten of them with the most import time of
+    their own ([name, ms] in slowest), and the DEFERRED_MODULES that were imported (deferred).
+    """
+    compileall.compile_dir(os.path.join(ROOT_DIRECTORY, "iatisplit"), quiet=1)
+    bare = import_timings("pass", python)
+    runs = [import_timings("import {}".format(STARTUP_MODULE), python) for _ in range(max(1, repeat))]
+    fastest = min(runs, key=lambda timings: timings[STARTUP_MODULE][1])
+    added = {name: timing for name, timing in fastest.items() if name not in bare}
+
+    version_times = []
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        subprocess.run([python, "-m", "iatisplit", "--version"], cwd=ROOT_DIRECTORY, stdout=subprocess.DEVNULL, check=True)
+        version_times.append(time.perf_counter() - started)
+
+    slowest = sorted(added.items(), key=lambda item: item[1][0], reverse=True)[:10]
+    return {
+        "import_ms": round(fastest[STARTUP_MODULE][1] / 1000, 2),
+        "version_ms": round(min(version_times) * 1000, 2),
+        "modules": len(added),
+        "slowest": [[name, round(timing[0] / 1000, 2)] for name, timing in slowest],
+        "deferred": sorted(name for name in DEFERRED_MODULES if name in added),
+    }
+
+
+def compare_startup(startup, baseline, tolerance):
+    """Compare startup measurements against a baseline.
+    @param startup: the measurements, from measure_startup().
+    @param baseline: the baseline measurements, or None.
+    @param tolerance: the allowed fractional slowdown.
+    @returns: a list of ("startup", message) tuples for the problems found.
+    """
+    problems = []
+    if startup["deferred"]:
+        problems.append(("startup", "imports {} at startup".format(", ".join(startup["deferred"]))))
+    if baseline and startup["import_ms"] > baseline["import_ms"] * (1 + tolerance):
+        problems.append(("startup", "import time {:.1f} ms, baseline {:.1f} ms ({:+.0%})".format(
+            startup["import_ms"], baseline["import_ms"], startup["import_ms"] / baseline["import_ms"] - 1
+        )))
+    return problems
+
+
+def log_startup(startup, baseline=None):
+    """Log startup measurements.
+    @param startup: the measurements, from measure_startup().
+    @param baseline: the baseline measurements, or None.
+    """
+    logger.info(
+        "%-34s %8.1f ms import %6.1f ms --version %4d modules%s",
+        "startup", startup["import_ms"], startup["version_ms"], startup["modules"],
+        " ({:+.0%})".format(startup["import_ms"] / baseline["import_ms"] - 1) if baseline else ""
+    )
+    logger.info("  slowest: %s", ", ".join("{} {:.1f} ms".format(name, ms) for name, ms in startup["slowest"]))
+
+
+def main(args):
+    """Command-line entry point.
+    @param args: the command-line arguments (without the program name).
+    @returns: the exit status (1 if a deferred module is imported at startup).
+    """
+    parser = argparse.ArgumentParser(description="Measure the startup time of the iatisplit command.")
+    parser.add_argument('--repeat', '-r', type=int, default=DEFAULT_REPEAT, help="Interpreters to start; the fastest is kept (default 10).")
+    result = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    startup = measure_startup(result.repeat)
+    log_startup(startup)
+    problems = compare_startup(startup, None, 0)
+    for case, message in problems:
+        logger.error("REGRESSION %s: %s", case, message)
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
+
+# end of module
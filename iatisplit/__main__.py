@@ -1,6 +1,14 @@
-from iatisplit.split import split
+from iatisplit.batch import expand_inputs, split_many
+from iatisplit.expressions import compile_expression, parse_path
+from iatisplit.index import build_index
+from iatisplit.partition import MAX_OPEN_FILES, PartitionKey
+from iatisplit.compression import CompressingWriter
+from iatisplit.output import FSYNC_POLICIES
+from iatisplit.scanner import LARGE_ACTIVITY_SIZE
+from iatisplit.split import filter_document, split
+from iatisplit.stats import Stats, log_progress
 from iatisplit.version import __version__
-import re, sys, argparse, logging
+import json, re, sys, argparse, logging
 
 logger = logging.getLogger(__name__)
 """Logger for this module"""
@@ -11,8 +19,13 @@ def main(args):
     Note that argparse expects the script name (sys.args[0]) to be removed,
     so provide only the args themselves, not the traditional ARGV[0].
     @args: a list of command-line arguments
+    @returns: the exit status (0 if every input was split successfully)
     """
-    
+
+    # "iatisplit index FILE..." builds sidecar indexes instead of splitting
+    if args and args[0] == 'index':
+        return main_index(args[1:])
+
     def parse_date(s):
         """Make sure we have an ISO YYYY-MM-DD date"""
         if re.match('^\d{4}-\d{2}-\d{2}$', s):
@@ -20,6 +33,39 @@ def main(args):
         else:
             raise Exception("Bad date format: {}".format(s))
 
+    def parse_size(s):
+        """Parse a byte size, with an optional K, M or G suffix (powers of 1024)"""
+        result = re.match(r'^(\d+)([KMG]?)B?$', s.strip(), flags=re.IGNORECASE)
+        if result:
+            return int(result.group(1)) * 1024 ** " KMG".index(result.group(2).upper() or " ")
+        else:
+            raise argparse.ArgumentTypeError("Bad byte size: {}".format(s))
+
+    def parse_sort_key(s):
+        """Make sure that a sort key is valid"""
+        from iatisplit.sort import SortKey # only when sorting, to keep startup fast
+        try:
+            SortKey(s)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+        return s
+
+    def parse_filter(s):
+        """Make sure that a filter expression compiles"""
+        try:
+            compile_expression(s)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+        return s
+
+    def parse_partition(s):
+        """Make sure that a partition key is valid"""
+        try:
+            PartitionKey(s)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+        return s
+
     parser = argparse.ArgumentParser(description="Split IATI activity files.")
     parser.add_argument(
         '--version',
@@ -28,11 +74,26 @@ def main(args):
     )
     parser.add_argument(
         '--max-activities', '-n',
-        required=True,
+        required=False,
+        default=None,
         type=int,
         metavar="NUMBER",
         help="Maximum number of IATI activities to include in each output file."
     )
+    parser.add_argument(
+        '--max-bytes', '-b',
+        required=False,
+        default=None,
+        type=parse_size,
+        metavar="SIZE",
+        help="Maximum size of each (uncompressed) output file, e.g. 500M."
+    )
+    parser.add_argument(
+        '--stdout',
+        action='store_const',
+        const=True,
+        help="Write all of the activities that pass the filters to standard output, as a single document."
+    )
     parser.add_argument(
         '--output-directory', '-d',
         required=False,
@@ -92,6 +153,177 @@ def main(args):
         const=True,
         help="Include only activities with the IATI humanitarian marker."
     )
+    parser.add_argument(
+        '--filter', '-f',
+        action='append',
+        default=[],
+        dest='filters',
+        type=parse_filter,
+        metavar="EXPRESSION",
+        help="Include only activities that match this expression, e.g. \"recipient-country/@code in (AF, SO)\" (repeatable)."
+    )
+    parser.add_argument(
+        '--partition-by', '-P',
+        required=False,
+        default=None,
+        type=parse_partition,
+        metavar="PATH|start-year",
+        help="Put each activity in a subdirectory for its value at this path (e.g. recipient-country/@code), or for its start year."
+    )
+    parser.add_argument(
+        '--max-open-files',
+        required=False,
+        default=MAX_OPEN_FILES,
+        type=int,
+        metavar="NUMBER",
+        help="With --partition-by, keep at most this many output files open at once (counting the --flatten files)."
+    )
+    parser.add_argument(
+        '--sort-by', '-S',
+        required=False,
+        default=None,
+        type=parse_sort_key,
+        metavar="identifier|last-updated|start-date|PATH",
+        help="Write the activities in order of this key instead of input order, spilling sorted runs to temporary files if they don't fit in memory."
+    )
+    parser.add_argument(
+        '--sort-memory',
+        required=False,
+        default=None,
+        type=parse_size,
+        metavar="SIZE",
+        help="Memory budget for --sort-by, e.g. 1G (default 256M)."
+    )
+    parser.add_argument(
+        '--flatten', '-F',
+        action='store_const',
+        const=True,
+        help="Also write a JSON Lines file of activity summaries and a CSV file of transactions for each output file."
+    )
+    parser.add_argument(
+        '--dedup', '-D',
+        action='store_const',
+        const=True,
+        help="Drop duplicate iati-identifiers across all inputs, keeping the copy with the newest last-updated-datetime."
+    )
+    parser.add_argument(
+        '--no-index',
+        action='store_const',
+        const=True,
+        help="Parse the input even if there's an up-to-date index for it (see \"iatisplit index\")."
+    )
+    parser.add_argument(
+        '--workers', '-w',
+        required=False,
+        default=1,
+        type=int,
+        metavar="NUMBER",
+        help="Parse and filter a local file with this many processes."
+    )
+    parser.add_argument(
+        '--connections',
+        required=False,
+        default=1,
+        type=int,
+        metavar="NUMBER",
+        help="Download a URL over this many concurrent HTTP Range requests, if the server supports them."
+    )
+    parser.add_argument(
+        '--large-activity-size',
+        required=False,
+        default=LARGE_ACTIVITY_SIZE,
+        type=parse_size,
+        metavar="SIZE",
+        help="Stream activities bigger than this (e.g. 64M) through a temporary file instead of holding them in memory (default 16M)."
+    )
+    parser.add_argument(
+        '--jobs', '-j',
+        required=False,
+        default=1,
+        type=int,
+        metavar="NUMBER",
+        help="When splitting many inputs, process this many at the same time."
+    )
+    parser.add_argument(
+        '--input-list', '-l',
+        required=False,
+        default=None,
+        metavar="filename",
+        help="Read more inputs (files, URLs, or glob patterns) from this file, one per line."
+    )
+    parser.add_argument(
+        '--merge', '-m',
+        action='store_const',
+        const=True,
+        help="Merge the activities from all inputs into one series of output files (one series for each IATI version)."
+    )
+    parser.add_argument(
+        '--cache-directory', '-c',
+        required=False,
+        default=None,
+        metavar="path/to/cache/directory",
+        help="Cache URL downloads here, and skip inputs that haven't changed since the last split."
+    )
+    parser.add_argument(
+        '--incremental', '-i',
+        action='store_const',
+        const=True,
+        help="Keep a manifest next to the output files, and rewrite only the files whose activities (or root start tag) changed."
+    )
+    parser.add_argument(
+        '--compress', '-z',
+        required=False,
+        default=None,
+        choices=('gzip', 'xz', 'bz2'),
+        help="Compress the output files (compressed input is detected automatically)."
+    )
+    parser.add_argument(
+        '--compress-level',
+        required=False,
+        default=None,
+        type=int,
+        metavar="LEVEL",
+        help="Compression level for --compress."
+    )
+    parser.add_argument(
+        '--fsync',
+        required=False,
+        default='none',
+        choices=FSYNC_POLICIES,
+        help="Flush each output file to disk before renaming it into place (file), and also its directory afterwards (full)."
+    )
+    parser.add_argument(
+        '--checkpoint',
+        action='store_const',
+        const=True,
+        help="Save a checkpoint next to the output files every 64 MB of input, so that an interrupted split can be resumed."
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_const',
+        const=True,
+        help="Carry on from the checkpoint of an interrupted split with the same input and options (implies --checkpoint)."
+    )
+    parser.add_argument(
+        '--stats',
+        required=False,
+        default=None,
+        metavar="FILENAME",
+        help="Save throughput, filter counts and stage times for each input to this JSON file."
+    )
+    parser.add_argument(
+        '--progress',
+        action='store_const',
+        const=True,
+        help="Log progress every 10,000 activities."
+    )
+    parser.add_argument(
+        '--profile',
+        required=False,
+        default=None,
+        metavar="path/to/profile/directory",
+        help="Save a cProfile profile for each stage (read, parse, filter, sort, write) in this directory."
+    )
     parser.add_argument(
         '--verbose', '-v',
         action='store_const',
@@ -106,7 +338,8 @@ def main(args):
     )
     parser.add_argument(
         'file_or_url',
-        help="URL or local filename of an IATI activity file."
+        nargs='*',
+        help="URLs, local filenames, or glob patterns for IATI activity files (\"-\" for standard input)."
     )
 
     # Parse the command-line arguments
@@ -120,24 +353,173 @@ def main(args):
     else:
         logging.basicConfig(level=logging.INFO)
 
-    # run the application
-    split(
-        result.file_or_url,
-        result.max_activities,
-        output_dir=result.output_directory,
-        output_stub=result.output_stub,
+    # figure out what we're splitting
+    inputs = expand_inputs(result.file_or_url, result.input_list)
+    if not inputs:
+        parser.error("No input files or URLs")
+
+    filter_options = dict(
         start_date=result.start_date,
         end_date=result.end_date,
         humanitarian_only=result.humanitarian_only,
         transaction_type=result.transaction_type,
         transaction_start_date=result.transaction_start_date,
-        transaction_end_date=result.transaction_end_date
+        transaction_end_date=result.transaction_end_date,
+        filters=result.filters,
+        workers=result.workers,
+        cache_dir=result.cache_directory,
+        use_index=not result.no_index,
+        connections=result.connections,
+        large_activity_size=result.large_activity_size
     )
 
+    # write a single filtered document to standard output
+    if result.stdout:
+        if len(inputs) > 1:
+            parser.error("--stdout works only with a single input")
+        if result.max_activities is not None or result.max_bytes is not None or result.output_stub or result.partition_by or \
+           result.incremental or result.dedup or result.flatten or result.fsync != 'none' or \
+           result.checkpoint or result.resume or result.sort_by or result.merge:
+            parser.error("--stdout writes a single document, so it can't be combined with options for output files")
+        if result.stats or result.progress or result.profile:
+            parser.error("--stdout doesn't collect statistics, so it can't be combined with --stats, --progress or --profile")
+        output = open(sys.stdout.fileno(), 'wb', closefd=False)
+        if result.compress:
+            output = CompressingWriter(output, result.compress, result.compress_level)
+        try:
+            filter_document(inputs[0], output, **filter_options)
+        finally:
+            output.close()
+        return 0
+
+    if result.max_activities is None and result.max_bytes is None:
+        parser.error("At least one of --max-activities or --max-bytes is required (or --stdout)")
+    if result.merge:
+        if result.incremental or result.partition_by or result.checkpoint or result.resume:
+            parser.error("--merge can't be combined with --incremental, --partition-by, --checkpoint or --resume")
+        if "-" in inputs:
+            parser.error("--merge can't read standard input")
+    elif len(inputs) > 1 and result.output_stub:
+        parser.error("--output-stub works only with a single input")
+
+    options = dict(
+        output_dir=result.output_directory,
+        incremental=result.incremental,
+        compression=result.compress,
+        compression_level=result.compress_level,
+        max_bytes=result.max_bytes,
+        partition_by=result.partition_by,
+        max_open_files=result.max_open_files,
+        flatten=bool(result.flatten),
+        fsync=result.fsync,
+        checkpoint=bool(result.checkpoint),
+        resume=bool(result.resume),
+        sort_by=result.sort_by,
+        sort_memory=result.sort_memory,
+        **filter_options
+    )
+
+    # collect statistics only if they're wanted
+    stats = None
+    if result.stats or result.progress or result.profile:
+        stats = Stats(callback=log_progress if result.progress else None, profile=bool(result.profile))
+
+    # run the application
+    dedup = None
+    if result.dedup:
+        from iatisplit.dedup import Deduplicator
+        dedup = Deduplicator(compression_level=result.compress_level)
+    try:
+        if result.merge:
+            from iatisplit.merge import merge
+            options = {name: value for name, value in options.items() if name not in ('incremental', 'partition_by', 'max_open_files', 'checkpoint', 'resume')}
+            summary = merge(inputs, result.max_activities, output_stub=result.output_stub or "merged", dedup=dedup, stats=stats, **options)
+            summaries = [summary]
+            status = 1 if summary["errors"] else 0
+        elif len(inputs) == 1:
+            summaries = [split(inputs[0], result.max_activities, output_stub=result.output_stub, dedup=dedup, stats=stats, **options)]
+            status = 0
+        else:
+            summaries = split_many(inputs, result.max_activities, jobs=result.jobs, dedup=dedup, stats=stats, **options)
+            status = 1 if any("error" in summary for summary in summaries) else 0
+        if dedup is not None:
+            dedup.finish()
+            logger.info("Dropped %d duplicate activities", dedup.duplicates)
+    finally:
+        if dedup is not None:
+            dedup.close()
+
+    if result.stats:
+        with open(result.stats, 'w') as f:
+            json.dump([summary.get("stats", summary) for summary in summaries], f, indent=2)
+    if result.profile:
+        stats.save_profiles(result.profile)
+    return status
+
+
+def main_index(args):
+    """Entry point for the "index" command.
+    @args: a list of command-line arguments (after "index")
+    @returns: the exit status (0 if every file was indexed successfully)
+    """
+
+    def check_path(s):
+        """Make sure that a filter-expression path is valid"""
+        try:
+            parse_path(s)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+        return s
+
+    parser = argparse.ArgumentParser(prog="iatisplit index", description="Build sidecar indexes for local IATI activity files, so that later splits can skip parsing.")
+    parser.add_argument(
+        '--path', '-p',
+        action='append',
+        default=[],
+        dest='paths',
+        type=check_path,
+        metavar="PATH",
+        help="Also store the values at this filter-expression path, for later --filter options (repeatable)."
+    )
+    parser.add_argument(
+        '--verbose', '-v',
+        action='store_const',
+        const=True,
+        help="Print verbose debugging information to the console."
+    )
+    parser.add_argument(
+        '--quiet', '-q',
+        action='store_const',
+        const=True,
+        help="No console output except error messages."
+    )
+    parser.add_argument(
+        'filename',
+        nargs='+',
+        help="Local (uncompressed) IATI activity files."
+    )
+    result = parser.parse_args(args)
+
+    if result.verbose: # -v
+        logging.basicConfig(level=logging.DEBUG)
+    elif result.quiet: # -q
+        logging.basicConfig(level=logging.ERROR)
+    else:
+        logging.basicConfig(level=logging.INFO)
+
+    status = 0
+    for filename in result.filename:
+        try:
+            build_index(filename, result.paths)
+        except (OSError, ValueError) as e:
+            logger.error("Can't index %s: %s", filename, e)
+            status = 1
+    return status
+
 
 def exec():
     """Entry function for setup.py script installation."""
-    main(sys.argv[1:])
+    sys.exit(main(sys.argv[1:]))
 
 
 if __name__ == '__main__':
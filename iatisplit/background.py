@@ -0,0 +1,93 @@
+"""Write a binary file from a background thread.
+
+Writes are collected into large batches and handed over through a
+bounded queue, so that the parser only blocks if the disk (or the
+compressor) falls well behind, and disk I/O overlaps with parsing
+(file writes, like zlib, lzma and bz2, release the GIL).
+
+License: Public Domain
+"""
+
+import logging, os, queue, threading
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+BATCH_SIZE = 0x100000
+"""Collect this many bytes before handing them to the background thread."""
+
+QUEUE_SIZE = 8
+"""Maximum number of batches waiting for the background thread."""
+
+
+class BackgroundWriter:
+    """Write data to a binary file in a background thread."""
+
+    def __init__(self, output, target=None, sync=False):
+        """Start the background thread.
+        @param output: the binary file to write to (closed by close()).
+        @param target: if present, a file-like object wrapping output for the thread to write to instead (e.g. a compressor), closed before output.
+        @param sync: if True, flush output to disk (fsync) before closing it.
+        """
+        self.output = output
+        self.target = target
+        self.sync = sync
+        self.batch = []
+        self.batch_size = 0
+        self.error = None
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        """Queue data for writing.
+        @param data: the bytes to write.
+        """
+        self.batch.append(data)
+        self.batch_size += len(data)
+        if self.batch_size >= BATCH_SIZE:
+            self._send_batch()
+
+    def close(self):
+        """Finish writing, and close the output file.
+        Raises any exception from the background thread.
+        """
+        self._send_batch()
+        self.queue.put(None)
+        self.thread.join()
+        try:
+            if self.error is None:
+                if self.target is not None:
+                    self.target.close()
+                if self.sync:
+                    self.output.flush()
+                    os.fsync(self.output.fileno())
+        finally:
+            self.output.close()
+        if self.error is not None:
+            raise self.error
+
+    def _send_batch(self):
+        if self.error is not None:
+            raise self.error
+        if self.batch:
+            self.queue.put(b''.join(self.batch))
+            self.batch = []
+            self.batch_size = 0
+
+    def _run(self):
+        target = self.target if self.target is not None else self.output
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            if self.error is None:
+                try:
+                    target.write(data)
+                except Exception as e:
+                    self.error = e
+
+
+# end of module
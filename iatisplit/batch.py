@@ -0,0 +1,115 @@
+"""Split many IATI activity files in one invocation.
+
+Inputs can come from a list of files or URLs, shell-style glob
+patterns, or a list file with one input per line. They are processed
+by a bounded pool of worker processes, so that a nightly run over the
+whole registry pays the Python startup cost only once.
+
+License: Public Domain
+"""
+
+import glob, logging
+from iatisplit.split import is_url, make_stub, split
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+def expand_inputs(inputs=[], input_list=None):
+    """Expand glob patterns and list files into a flat list of inputs.
+    @param inputs: a list of local filenames, glob patterns, or URLs.
+    @param input_list: the path to a file with one input per line (blank lines and lines starting with "#" are ignored), or None.
+    @returns: a list of filenames and URLs, in order.
+    """
+    result = []
+
+    def add(input):
+        if not is_url(input) and glob.has_magic(input):
+            matches = sorted(glob.glob(input))
+            if not matches:
+                logger.warning("No files match %s", input)
+            result.extend(matches)
+        else:
+            result.append(input)
+
+    for input in inputs:
+        add(input)
+
+    if input_list is not None:
+        with open(input_list, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    add(line)
+
+    return result
+
+
+def split_many(inputs, max, jobs=1, **kwargs):
+    """Split many IATI activity reports, each into its own series of output documents.
+    Each input gets its own output stub from make_stub(). A failure on one input is
+    logged and recorded in its summary, and does not stop the others.
+    @param inputs: a list of file paths or web URLs (see expand_inputs()).
+    @param max: the maximum number of IATI activities to include in each output document.
+    @param jobs: the maximum number of inputs to split at the same time (defaults to 1).
+    @param kwargs: other parameters for iatisplit.split.split() (except output_stub).
+    @returns: a list of summary dicts, in input order (see split()); failed inputs have an "error" key instead of counts.
+    """
+    if kwargs.get('output_stub'):
+        raise ValueError("Cannot use a single output stub for many inputs")
+
+    # make sure that no two inputs will overwrite each other's output
+    stubs = {}
+    for input in inputs:
+        stub = make_stub(None, input)
+        if stub in stubs:
+            raise ValueError("Inputs {} and {} would both use the output stub {}".format(stubs[stub], input, stub))
+        stubs[stub] = input
+
+    # duplicates are tracked in this process, so the inputs can't run at the same time
+    if jobs > 1 and kwargs.get('dedup') is not None:
+        logger.warning("Deduplication needs the inputs to be split one at a time; ignoring --jobs")
+        jobs = 1
+
+    if jobs > 1:
+        import concurrent.futures # only for a pool, to keep startup fast
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            futures = [executor.submit(split, input, max, **kwargs) for input in inputs]
+            summaries = [_get_summary(input, lambda: future.result()) for input, future in zip(inputs, futures)]
+    else:
+        summaries = [_get_summary(input, lambda: split(input, max, **kwargs)) for input in inputs]
+
+    log_summary(summaries)
+    return summaries
+
+
+def log_summary(summaries):
+    """Log an aggregate summary of a batch run.
+    @param summaries: the list of summary dicts returned by split_many().
+    """
+    for summary in summaries:
+        if "error" in summary:
+            logger.info("%s: FAILED (%s)", summary["input"], summary["error"])
+        else:
+            logger.info("%s: %d activities in %d files", summary["input"], summary["activities"], summary["files"])
+    succeeded = [summary for summary in summaries if "error" not in summary]
+    logger.info(
+        "Total: %d activities in %d files from %d inputs (%d failed)",
+        sum(summary["activities"] for summary in succeeded),
+        sum(summary["files"] for summary in succeeded),
+        len(summaries),
+        len(summaries) - len(succeeded)
+    )
+
+
+def _get_summary(input, f):
+    """Run a split and turn any exception into an error summary."""
+    try:
+        return f()
+    except Exception as e:
+        logger.exception("Failed to split %s", input)
+        return {"input": input, "stub": make_stub(None, input), "error": str(e)}
+
+
+# end of module
@@ -0,0 +1,161 @@
+"""On-disk cache for IATI activity files downloaded from URLs.
+
+Each cached URL has a body file and a small JSON metadata file, keyed
+by a hash of the URL. The metadata holds the ETag and Last-Modified
+validators from the last download, which are sent back as a
+conditional GET; a 304 Not Modified response streams from the local
+copy instead. The metadata also remembers the options used for the
+last successful split, so that an unchanged input with unchanged
+options can be skipped entirely.
+
+License: Public Domain
+"""
+
+import hashlib, io, json, logging, os, requests, tempfile
+from iatisplit.requests_wrapper import RequestsResponseIOWrapper
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+class HTTPCache:
+    """A cache directory for downloaded IATI activity files."""
+
+    def __init__(self, directory):
+        """Set up a cache.
+        @param directory: the cache directory (created if it doesn't exist).
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, url):
+        """Open a URL through the cache, revalidating any cached copy.
+        The body is saved to the cache as it is read, and committed only
+        once the whole response has been read.
+        @param url: the web URL of the IATI activity report.
+        @returns: a tuple of a binary stream, and True if the cached copy was still valid.
+        """
+        metadata = self.get_metadata(url)
+        body_path = self._path(url, "body")
+
+        headers = {}
+        if metadata and os.path.exists(body_path):
+            if metadata.get("etag"):
+                headers["If-None-Match"] = metadata["etag"]
+            if metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+
+        response = requests.get(url, stream=True, headers=headers)
+
+        if response.status_code == 304 and headers:
+            logger.info("Using cached copy of %s", url)
+            response.close()
+            return open(body_path, 'rb'), True
+
+        input = RequestsResponseIOWrapper(response)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if response.status_code != 200 or not (etag or last_modified):
+            # nothing we can revalidate later, so don't bother caching
+            return input, False
+
+        metadata = {
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+        return _CachingReader(input, self, url, metadata), False
+
+    def get_metadata(self, url):
+        """Get the cache metadata for a URL.
+        @param url: the web URL.
+        @returns: the metadata dict, or None if the URL isn't cached.
+        """
+        try:
+            with open(self._path(url, "json"), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save_metadata(self, url, metadata):
+        """Atomically replace the cache metadata for a URL.
+        @param url: the web URL.
+        @param metadata: the metadata dict.
+        """
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(temp_path, self._path(url, "json"))
+
+    def get_split(self, url):
+        """Get the record of the last successful split from the cached copy of a URL.
+        @param url: the web URL.
+        @returns: a dict with "options" and "summary" keys, or None.
+        """
+        metadata = self.get_metadata(url)
+        return metadata.get("split") if metadata else None
+
+    def record_split(self, url, options, summary):
+        """Remember a successful split of the cached copy of a URL.
+        @param url: the web URL.
+        @param options: a JSON-compatible description of the split options.
+        @param summary: the summary dict returned by split().
+        """
+        metadata = self.get_metadata(url)
+        if metadata is not None:
+            metadata["split"] = {"options": options, "summary": summary}
+            self.save_metadata(url, metadata)
+
+    def _path(self, url, extension):
+        """Construct the path to a cache file for a URL."""
+        return os.path.join(self.directory, "{}.{}".format(hashlib.sha256(url.encode('utf-8')).hexdigest(), extension))
+
+
+class _CachingReader(io.RawIOBase):
+    """Copy a download into the cache while it's being read."""
+
+    def __init__(self, input, cache, url, metadata):
+        self.input = input
+        self.cache = cache
+        self.url = url
+        self.metadata = metadata
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.directory, suffix=".tmp")
+        self.output = os.fdopen(fd, 'wb')
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.input.read(size)
+        if self.output is not None:
+            if data:
+                self.output.write(data)
+            else:
+                self._commit()
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def _commit(self):
+        """The whole body has been read, so move it into the cache."""
+        self.output.close()
+        self.output = None
+        os.replace(self.temp_path, self.cache._path(self.url, "body"))
+        self.cache.save_metadata(self.url, self.metadata)
+        logger.debug("Saved %s to the cache", self.url)
+
+    def close(self):
+        if self.output is not None:
+            # incomplete download: throw it away
+            self.output.close()
+            self.output = None
+            os.remove(self.temp_path)
+        self.input.close()
+        super().close()
+
+
+# end of module
@@ -0,0 +1,184 @@
+"""Checkpoints for resuming an interrupted split.
+
+While a split runs with checkpoints on, it saves its position every so
+often to STUB.checkpoint.json in the output directory: the input byte
+offset just past the last activity it handled, the raw root start tag
+(and document type declaration, if any), the output document counters, and the sizes of the output document in
+progress (which stays under its temporary name until it's finished).
+
+A resumed split checks that the input and the split options haven't
+changed, truncates the document in progress back to its size at the
+checkpoint, and carries on from the checkpoint's input offset: a local
+file is read from that offset directly, a URL with an HTTP Range
+request (falling back to reading and discarding the skipped bytes if
+the server ignores the range), and a compressed input by decompressing
+and discarding. The finished output documents before the checkpoint
+are left as they are.
+
+License: Public Domain
+"""
+
+import base64, json, logging, os, re
+from iatisplit.output import sync_directory
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+CHECKPOINT_VERSION = 2
+"""Format version of the checkpoint file (older or newer checkpoints are ignored)."""
+
+CHECKPOINT_BYTES = 0x4000000
+"""Default number of input bytes (64 MiB) between checkpoints."""
+
+
+def make_checkpoint_filename(output_dir, output_stub):
+    """Construct the filename for the checkpoint of a split.
+    @param output_dir: path to the output directory
+    @param output_stub: the filename stub for each file (e.g. "iatiout")
+    @returns: the path to the checkpoint file
+    """
+    return os.path.join(output_dir, "{}.checkpoint.json".format(output_stub))
+
+
+def get_validators(file_or_url):
+    """Get the values that show whether an input has changed.
+    For a local file, these are its size and modification time; for a URL, the
+    ETag, Last-Modified and Content-Length headers from a HEAD request.
+    @param file_or_url: the file path or web URL of the input.
+    @returns: a dict of validators.
+    """
+    if re.match(r'^https?://', file_or_url, flags=re.IGNORECASE):
+        import requests # only needed for URLs (see iatisplit.split.open_cache)
+        # ask for the unencoded resource, as the resumed Range request does (see iatisplit.split.open_input_at)
+        response = requests.head(file_or_url, allow_redirects=True, headers={"Accept-Encoding": "identity"})
+        response.close()
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "length": response.headers.get("Content-Length"),
+        }
+    else:
+        stat = os.stat(file_or_url)
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+
+class Checkpointer:
+    """Save the checkpoints for one split."""
+
+    def __init__(self, path, file_or_url, options, validators, interval=CHECKPOINT_BYTES, sync=False):
+        """Set up checkpoints (nothing is saved until the first call to save()).
+        @param path: the path to the checkpoint file.
+        @param file_or_url: the file path or web URL of the input.
+        @param options: a dict of the split options that affect the output (a resumed split must use the same ones).
+        @param validators: the input's validators, from get_validators().
+        @param interval: the number of input bytes between checkpoints.
+        @param sync: if True, flush each checkpoint to disk (fsync).
+        """
+        self.path = path
+        self.file_or_url = file_or_url
+        self.options = options
+        self.validators = validators
+        self.interval = interval
+        self.sync = sync
+        self.offset = 0
+        """Input offset of the last checkpoint."""
+
+    def due(self, offset):
+        """Check whether it's time for another checkpoint.
+        @param offset: the current input offset.
+        @returns: True if at least interval bytes have passed since the last checkpoint.
+        """
+        return offset - self.offset >= self.interval
+
+    def save(self, offset, root_tag, encoding, compression, writer_state, doctype=None):
+        """Save a checkpoint (replacing the previous one atomically).
+        @param offset: the input offset just past the last activity handled.
+        @param root_tag: the raw start tag of the iati-activities element.
+        @param encoding: the input encoding, or None.
+        @param compression: the compression type of the input, or None.
+        @param writer_state: the state of the output writer, from iatisplit.split.ChunkWriter.checkpoint().
+        @param doctype: the raw document type declaration of the input, or None.
+        """
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "input": self.file_or_url,
+            "validators": self.validators,
+            "options": self.options,
+            "offset": offset,
+            "root_tag": base64.b64encode(root_tag).decode('ascii'),
+            "encoding": encoding,
+            "doctype": base64.b64encode(doctype).decode('ascii') if doctype is not None else None,
+            "compression": compression,
+            "writer": writer_state,
+        }
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, indent=1)
+            if self.sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        if self.sync:
+            sync_directory(os.path.dirname(self.path))
+        self.offset = offset
+        logger.debug("Checkpoint at input offset %d", offset)
+
+    def remove(self):
+        """Remove the checkpoint file at the end of a successful split."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def load_checkpoint(path, file_or_url, options, validators):
+    """Load a checkpoint to resume from, if it matches the split.
+    @param path: the path to the checkpoint file.
+    @param file_or_url: the file path or web URL of the input.
+    @param options: the split options (see Checkpointer).
+    @param validators: the input's current validators, from get_validators().
+    @returns: the checkpoint state dict (with root_tag and doctype decoded to bytes), or None if there's no usable checkpoint.
+    """
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        logger.warning("No checkpoint at %s; starting from the beginning", path)
+        return None
+    except (OSError, ValueError):
+        logger.warning("Ignoring unreadable checkpoint %s; starting from the beginning", path)
+        return None
+    if state.get("version") != CHECKPOINT_VERSION or state.get("input") != file_or_url or state.get("options") != options:
+        logger.warning("Checkpoint %s is for a different input or different options; starting from the beginning", path)
+        return None
+    if not any(validators.values()) or state.get("validators") != validators:
+        logger.warning("%s may have changed since checkpoint %s; starting from the beginning", file_or_url, path)
+        return None
+    state["root_tag"] = base64.b64decode(state["root_tag"])
+    if state["doctype"] is not None:
+        state["doctype"] = base64.b64decode(state["doctype"])
+    logger.info("Resuming %s from input offset %d", file_or_url, state["offset"])
+    return state
+
+
+def truncate_output(filename, size):
+    """Cut an output file in progress back to its size at a checkpoint.
+    The file is expected under its temporary name (FILENAME.tmp); if it was
+    finished and renamed after the checkpoint, it's moved back first.
+    @param filename: the final path of the output file.
+    @param size: the size of the file (as stored on disk) at the checkpoint.
+    @raises ValueError: if the file is missing or shorter than the checkpoint says.
+    """
+    temp_filename = filename + ".tmp"
+    if not os.path.exists(temp_filename) and os.path.exists(filename):
+        os.replace(filename, temp_filename)
+    if not os.path.exists(temp_filename) or os.path.getsize(temp_filename) < size:
+        raise ValueError("Output file {} doesn't match the checkpoint".format(filename))
+    with open(temp_filename, 'r+b') as f:
+        f.truncate(size)
+
+
+# end of module
@@ -0,0 +1,132 @@
+"""Transparent compression for input documents and output chunks.
+
+Compressed input is recognised by its extension or its magic bytes,
+and decompressed on the fly. Compressed output is written by a
+background thread, so that compression runs alongside the parser
+instead of on its thread (zlib, lzma and bz2 all release the GIL while
+they work).
+
+License: Public Domain
+"""
+
+import io, logging, re
+from iatisplit.background import BackgroundWriter
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+COMPRESSION_TYPES = ('gzip', 'xz', 'bz2',)
+"""Supported compression types."""
+
+EXTENSIONS = {
+    'gzip': '.gz',
+    'xz': '.xz',
+    'bz2': '.bz2',
+}
+"""Filename extension for each compression type."""
+
+MAGIC_BYTES = {
+    'gzip': b'\x1f\x8b',
+    'xz': b'\xfd7zXZ\x00',
+    'bz2': b'BZh',
+}
+"""Leading bytes for each compression type."""
+
+def detect_compression(file_or_url, head=b''):
+    """Figure out how an input is compressed.
+    @param file_or_url: the file path or web URL of the input.
+    @param head: the first few bytes of the input, if available.
+    @returns: one of COMPRESSION_TYPES, or None if uncompressed.
+    """
+    path = re.sub(r'\?.*$', '', file_or_url).lower()
+    for compression, extension in EXTENSIONS.items():
+        if path.endswith(extension):
+            return compression
+    for compression, magic in MAGIC_BYTES.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def is_compressed_file(filename):
+    """Check whether a local file is compressed.
+    @param filename: the path to the file.
+    @returns: True if it's compressed.
+    """
+    with open(filename, 'rb') as input:
+        return detect_compression(filename, input.read(8)) is not None
+
+
+def decompress_input(input, file_or_url):
+    """Wrap an input stream with a decompressor, if needed.
+    @param input: a binary stream.
+    @param file_or_url: the file path or web URL of the input (for the extension).
+    @returns: a binary stream of uncompressed data (closing it also closes input).
+    """
+    if not hasattr(input, 'peek'):
+        input = io.BufferedReader(input)
+    compression = detect_compression(file_or_url, input.peek(8)[:8])
+    if compression is None:
+        return input
+    logger.debug("Decompressing %s input from %s", compression, file_or_url)
+    # the compression libraries are imported only when they're needed, to keep startup fast
+    if compression == 'gzip':
+        import gzip
+        decompressor = gzip.GzipFile(fileobj=input, mode='rb')
+    elif compression == 'xz':
+        import lzma
+        decompressor = lzma.LZMAFile(input, 'rb')
+    else:
+        import bz2
+        decompressor = bz2.BZ2File(input, 'rb')
+    return _DecompressedInput(decompressor, input, compression)
+
+
+class _DecompressedInput:
+    """Read from a decompressor, and close both it and the underlying stream."""
+
+    def __init__(self, decompressor, input, compression):
+        self.decompressor = decompressor
+        self.input = input
+        self.compression = compression
+
+    def read(self, size=-1):
+        return self.decompressor.read(size)
+
+    def close(self):
+        self.decompressor.close()
+        self.input.close()
+
+
+class CompressingWriter(BackgroundWriter):
+    """Compress data in a background thread and write it to a binary file.
+    Writes are batched and handed over through a bounded queue, so the
+    caller only blocks if compression falls well behind.
+    """
+
+    def __init__(self, output, compression, level=None, sync=False):
+        """Start the compression thread.
+        @param output: the binary file to write the compressed data to (closed by close()).
+        @param compression: one of COMPRESSION_TYPES.
+        @param level: the compression level, or None for the default.
+        @param sync: if True, flush the file to disk (fsync) before closing it.
+        """
+        if compression == 'gzip':
+            import gzip
+            # a fixed mtime and no filename make the output reproducible
+            compressor = gzip.GzipFile(filename='', mode='wb', compresslevel=9 if level is None else level, fileobj=output, mtime=0)
+        elif compression == 'xz':
+            import lzma
+            compressor = lzma.LZMAFile(output, 'wb', preset=level)
+        elif compression == 'bz2':
+            import bz2
+            compressor = bz2.BZ2File(output, 'wb', compresslevel=9 if level is None else level)
+        else:
+            raise ValueError("Unsupported compression type: {}".format(compression))
+        self.compressor = compressor
+        super().__init__(output, compressor, sync)
+
+
+# end of module
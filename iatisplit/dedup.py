@@ -0,0 +1,226 @@
+"""Drop duplicate activities (by iati-identifier) across one or more splits.
+
+When the same iati-identifier turns up more than once (in one input,
+or in several overlapping inputs), only the copy with the newest
+last-updated-datetime is kept; on a tie, the first copy wins. Copies
+are compared only after they pass the filters.
+
+Every identifier written goes into an exact on-disk store (SQLite),
+along with its last-updated-datetime and where it was written. A
+fixed-size Bloom filter sits in front of the store, so that the store
+is only searched for identifiers that might have been seen before;
+memory use stays the same however many identifiers there are.
+
+An older copy is skipped on arrival. When a newer copy turns up after
+an older one was already written, the new copy is written as usual and
+the old one is remembered; finish() then rewrites only the output files
+that hold superseded copies, dropping them. If duplicates are rare,
+nearly all of the work happens in the normal single pass.
+
+Note that finish() changes output files that were already published
+(renamed to their final names) during the splits, so a downstream job
+that picks up each file as soon as it appears should wait for the
+whole run to end when deduplicating.
+
+License: Public Domain
+"""
+
+import hashlib, logging, os, shutil, sqlite3, tempfile
+from iatisplit.compression import CompressingWriter, decompress_input, detect_compression
+from iatisplit.expressions import LAST_UPDATED_PATH
+from iatisplit.scanner import READ_SIZE
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+BLOOM_BITS = 0x8000000
+"""Default size of the Bloom filter in bits (16 MiB, about 0.2% false positives at 10 million identifiers)."""
+
+BLOOM_HASHES = 7
+"""Number of bit positions set for each identifier."""
+
+COMMIT_INTERVAL = 10000
+"""Commit the store after this many changes."""
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter for strings."""
+
+    def __init__(self, bits=BLOOM_BITS, hashes=BLOOM_HASHES):
+        """Set up an empty filter.
+        @param bits: the size of the filter in bits.
+        @param hashes: the number of bit positions for each value.
+        """
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray((bits + 7) // 8)
+
+    def _positions(self, value):
+        # double hashing: derive all the positions from two 64-bit hashes
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, value):
+        """Add a value to the filter.
+        @param value: the string to add.
+        """
+        for position in self._positions(value):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        """Check whether a value might have been added (False means definitely not)."""
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class Deduplicator:
+    """Track the identifiers written across one or more splits.
+    Pass the same Deduplicator to every iatisplit.split.split() call that
+    should share identifiers, then call finish() once they're all done.
+    """
+
+    def __init__(self, path=None, bloom_bits=BLOOM_BITS, compression_level=None):
+        """Open the store.
+        @param path: the path to the SQLite store, or None for a temporary one (removed by close()).
+        @param bloom_bits: the size of the Bloom filter in bits.
+        @param compression_level: the compression level for rewritten output files (use the same one as the splits), or None for the default.
+        """
+        self.compression_level = compression_level
+        self.temp_dir = None
+        if path is None:
+            self.temp_dir = tempfile.mkdtemp(prefix="iatisplit-dedup-")
+            path = os.path.join(self.temp_dir, "dedup.sqlite")
+        self.connection = sqlite3.connect(path)
+        # the store is scratch data, so don't pay for durability
+        self.connection.execute("pragma journal_mode = off")
+        self.connection.execute("pragma synchronous = off")
+        self.connection.executescript("""
+            create table if not exists seen (identifier text primary key, last_updated text, filename text, offset integer, length integer) without rowid;
+            create table if not exists superseded (filename text, offset integer, length integer);
+        """)
+        self.bloom = BloomFilter(bloom_bits)
+        for (identifier,) in self.connection.execute("select identifier from seen"):
+            self.bloom.add(identifier)
+        self.duplicates = 0
+        """Number of copies skipped or superseded so far."""
+        self._previous = None # the stored row for the identifier last checked, if any
+        self._changes = 0
+
+    def check(self, identifier, last_updated):
+        """Check whether a copy of an activity should be written.
+        @param identifier: the iati-identifier.
+        @param last_updated: the last-updated-datetime, or None if missing (oldest).
+        @returns: True if the identifier is new, or this copy is newer than the one already written.
+        """
+        self._previous = None
+        if identifier not in self.bloom:
+            return True
+        row = self.connection.execute("select last_updated, filename, offset, length from seen where identifier = ?", (identifier,)).fetchone()
+        if row is None:
+            # Bloom filter false positive
+            return True
+        if (last_updated or '') > row[0]:
+            self._previous = row
+            return True
+        logger.debug("Skipping duplicate activity %s", identifier)
+        self.duplicates += 1
+        return False
+
+    def add(self, identifier, last_updated, filename, offset, length):
+        """Record where an activity was written, after check() returned True.
+        @param identifier: the iati-identifier.
+        @param last_updated: the last-updated-datetime, or None if missing.
+        @param filename: the output file.
+        @param offset: the (uncompressed) byte offset of the activity in the output file.
+        @param length: the length of the activity in bytes.
+        """
+        if self._previous is not None:
+            logger.debug("Activity %s supersedes an older copy in %s", identifier, self._previous[1])
+            self.connection.execute("insert into superseded values (?, ?, ?)", self._previous[1:])
+            self.duplicates += 1
+            self._previous = None
+        self.connection.execute("insert or replace into seen values (?, ?, ?, ?, ?)", (identifier, last_updated or '', filename, offset, length))
+        self.bloom.add(identifier)
+        self._changes += 1
+        if self._changes >= COMMIT_INTERVAL:
+            self.connection.commit()
+            self._changes = 0
+
+    def finish(self):
+        """Rewrite the output files that hold superseded copies, without those copies.
+        The files are replaced in place, after the splits already published them under
+        their final names. The stored offsets of the activities left in them are updated
+        to match, so the store stays usable for further splits.
+        @returns: the list of output files rewritten.
+        """
+        self.connection.commit()
+        filenames = [row[0] for row in self.connection.execute("select distinct filename from superseded order by filename")]
+        for filename in filenames:
+            ranges = self.connection.execute("select offset, length from superseded where filename = ? order by offset", (filename,)).fetchall()
+            logger.info("Removing %d superseded activities from %s", len(ranges), filename)
+            _remove_ranges(filename, ranges, self.compression_level)
+            # shift the activities after each removed range back (last range first, so each offset is still the original)
+            for offset, length in reversed(ranges):
+                self.connection.execute("update seen set offset = offset - ? where filename = ? and offset > ?", (length, filename, offset))
+        self.connection.execute("delete from superseded")
+        self.connection.commit()
+        return filenames
+
+    def close(self):
+        """Close the store (and remove it, if it's temporary)."""
+        self.connection.close()
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir)
+
+
+def _remove_ranges(filename, ranges, compression_level=None):
+    """Rewrite an output file without some byte ranges (of its uncompressed content).
+    The content is streamed through in READ_SIZE pieces, so memory use doesn't depend on the size of the file.
+    @param filename: the output file.
+    @param ranges: a sorted list of (offset, length) tuples.
+    @param compression_level: the compression level for a compressed file, or None for the default.
+    """
+    input = decompress_input(open(filename, 'rb'), filename)
+    try:
+        temp_filename = filename + ".tmp"
+        output = open(temp_filename, 'wb')
+        compression = detect_compression(filename)
+        if compression is not None:
+            output = CompressingWriter(output, compression, compression_level)
+        try:
+            pos = 0
+            for offset, length in ranges:
+                _copy_bytes(input, offset - pos, output)
+                _copy_bytes(input, length, None)
+                pos = offset + length
+            _copy_bytes(input, None, output)
+        finally:
+            output.close()
+    finally:
+        input.close()
+    os.replace(temp_filename, filename)
+
+
+def _copy_bytes(input, count, output):
+    """Copy bytes from one stream to another in READ_SIZE pieces.
+    @param input: the binary input stream.
+    @param count: the number of bytes to copy, or None for the rest of the input.
+    @param output: the binary output stream, or None to skip the bytes.
+    @raises IOError: if the input ends before count bytes.
+    """
+    while count is None or count > 0:
+        data = input.read(READ_SIZE if count is None else min(READ_SIZE, count))
+        if not data:
+            if count is not None:
+                raise IOError("Output file is shorter than the recorded activity offsets")
+            return
+        if output is not None:
+            output.write(data)
+        if count is not None:
+            count -= len(data)
+
+
+# end of module
@@ -0,0 +1,199 @@
+"""Download a URL in concurrent HTTP Range segments.
+
+Many publishers' servers cap the bandwidth of each connection, so a
+big file downloads faster over several connections at once. A HEAD
+request checks that the server accepts byte ranges (and reports the
+length); the file is then fetched in fixed-size segments by a small
+pool of threads sharing one pooled requests.Session, and handed to the
+parser in order as a single stream, starting as soon as the first
+segment arrives.
+
+Only a bounded window of segments is requested ahead of the reader, so
+segments that arrive out of order wait in memory only until the ones
+before them are read (at most window x segment_size bytes). Every
+segment request carries an If-Range header, so a file that changes
+partway through is detected instead of being stitched together from
+two versions.
+
+If the server doesn't accept ranges, doesn't report a length, sends a
+content encoding, or the file is small, open_url() falls back to a
+single streaming request.
+
+License: Public Domain
+"""
+
+import collections, concurrent.futures, io, logging, requests, requests.adapters
+from iatisplit.requests_wrapper import RequestsResponseIOWrapper
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+SEGMENT_SIZE = 0x800000
+"""Default segment size in bytes (8 MiB)."""
+
+WINDOW_PER_CONNECTION = 2
+"""Segments requested ahead of the reader for each connection."""
+
+SEGMENT_ATTEMPTS = 3
+"""Number of times to try each segment before giving up."""
+
+
+def open_url(url, connections=1, segment_size=SEGMENT_SIZE, session=None):
+    """Open a URL for streaming, in concurrent Range segments if possible.
+    @param url: the web URL.
+    @param connections: the maximum number of concurrent connections (1 for a single streaming request).
+    @param segment_size: the segment size in bytes.
+    @param session: a requests.Session to use (defaults to a new pooled session, closed with the stream).
+    @returns: a binary file-like object.
+    """
+    own_session = session is None
+    if own_session:
+        session = make_session(connections)
+    try:
+        if connections > 1:
+            response = session.head(url, allow_redirects=True, headers={"Accept-Encoding": "identity"})
+            response.close()
+            length = response.headers.get("Content-Length")
+            if response.status_code != 200 or response.headers.get("Accept-Ranges", "").lower() != "bytes" or not (length or "").isdigit():
+                logger.info("%s doesn't support Range requests; downloading it in a single stream", url)
+            elif response.headers.get("Content-Encoding", "identity").lower() != "identity":
+                logger.info("%s has a content encoding; downloading it in a single stream", url)
+            elif int(length) <= segment_size:
+                logger.debug("%s is small enough for a single stream", url)
+            else:
+                logger.info("Downloading %s in %d-byte segments over %d connections", url, segment_size, connections)
+                validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+                return SegmentedDownload(response.url, int(length), connections, segment_size, session, own_session, validator)
+        response = session.get(url, stream=True)
+        response.raise_for_status()
+        return _SessionResponse(response, session if own_session else None)
+    except:
+        if own_session:
+            session.close()
+        raise
+
+
+def make_session(connections=1):
+    """Make a requests.Session with a connection pool big enough for concurrent segments.
+    @param connections: the number of concurrent connections.
+    @returns: a requests.Session.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, connections))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class SegmentedDownload(io.RawIOBase):
+    """A URL downloaded in concurrent Range segments, read back in order (use open_url() to open one)."""
+
+    def __init__(self, url, length, connections, segment_size, session, own_session=False, validator=None):
+        """Start downloading the first window of segments.
+        @param url: the web URL (after redirects).
+        @param length: the length of the resource in bytes.
+        @param connections: the number of concurrent connections.
+        @param segment_size: the segment size in bytes.
+        @param session: the requests.Session to use.
+        @param own_session: if True, close the session with the stream.
+        @param validator: the ETag or Last-Modified value from the HEAD request, for If-Range (or None).
+        """
+        self.url = url
+        self.length = length
+        self.segment_size = segment_size
+        self.session = session
+        self.own_session = own_session
+        self.validator = validator
+        self.window = connections * WINDOW_PER_CONNECTION
+        self.executor = concurrent.futures.ThreadPoolExecutor(connections, thread_name_prefix="iatisplit-download")
+        self.pending = collections.deque() # futures for the requested segments, in order
+        self.next_start = 0 # offset of the next segment to request
+        self.buffer = memoryview(b'') # the unread part of the current segment
+        self._fill_window()
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        """Read the next bytes, in order.
+        @param size: the maximum number of bytes to read, or -1 for the rest of the current segment.
+        @returns: the bytes (empty at the end of the resource).
+        """
+        if not self.buffer:
+            if not self.pending:
+                return b''
+            self.buffer = memoryview(self.pending.popleft().result())
+            self._fill_window()
+        if size is None or size < 0 or size >= len(self.buffer):
+            result = self.buffer.tobytes() if self.buffer.obj is None or len(self.buffer) != len(self.buffer.obj) else self.buffer.obj
+            self.buffer = memoryview(b'')
+        else:
+            result = self.buffer[:size].tobytes()
+            self.buffer = self.buffer[size:]
+        return result
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        """Stop downloading, and discard any segments not yet read."""
+        if not self.closed:
+            for future in self.pending:
+                future.cancel()
+            self.pending.clear()
+            self.executor.shutdown(wait=True)
+            if self.own_session:
+                self.session.close()
+        super().close()
+
+    def _fill_window(self):
+        while len(self.pending) < self.window and self.next_start < self.length:
+            end = min(self.next_start + self.segment_size, self.length)
+            self.pending.append(self.executor.submit(self._fetch, self.next_start, end))
+            self.next_start = end
+
+    def _fetch(self, start, end):
+        """Download one segment (runs in a worker thread).
+        @param start: the offset of the first byte.
+        @param end: the offset just past the last byte.
+        @returns: the bytes.
+        @raises IOError: if the server doesn't send exactly that range.
+        """
+        headers = {"Range": "bytes={}-{}".format(start, end - 1), "Accept-Encoding": "identity"}
+        if self.validator:
+            headers["If-Range"] = self.validator
+        for attempt in range(1, SEGMENT_ATTEMPTS + 1):
+            try:
+                response = self.session.get(self.url, headers=headers)
+                if response.status_code == 206 and response.headers.get("Content-Range", "").startswith("bytes {}-{}/".format(start, end - 1)):
+                    if len(response.content) == end - start:
+                        return response.content
+                elif response.status_code == 200:
+                    raise IOError("{} changed during the download (or stopped accepting Range requests)".format(self.url))
+                else:
+                    response.raise_for_status()
+                logger.warning("Bad response for bytes %d-%d of %s (attempt %d)", start, end - 1, self.url, attempt)
+            except requests.exceptions.RequestException as e:
+                logger.warning("Error downloading bytes %d-%d of %s (attempt %d): %s", start, end - 1, self.url, attempt, e)
+        raise IOError("Failed to download bytes {}-{} of {}".format(start, end - 1, self.url))
+
+
+class _SessionResponse(RequestsResponseIOWrapper):
+    """A single streaming response that also closes its session."""
+
+    def __init__(self, response, session=None):
+        super().__init__(response)
+        self.session = session
+
+    def close(self):
+        result = super().close()
+        if self.session is not None:
+            self.session.close()
+        return result
+
+
+# end of module
@@ -0,0 +1,278 @@
+"""Filter expressions over the elements and attributes of an activity.
+
+An expression compares the values found at paths inside an
+iati-activity, for example
+
+    reporting-org/@ref = XM-DAC-41114
+    recipient-country/@code in (AF, SO) and not @humanitarian = 1
+    budget/value >= 1000000 or sector/@vocabulary = "1"
+
+A path is a list of element names relative to iati-activity, separated
+by "/", optionally ending in an attribute ("@ref"); "@attr" on its own
+is an attribute of the iati-activity element itself. A path without an
+attribute refers to the text of the element. A path on its own tests
+that at least one value exists.
+
+A comparison is true if any value at the path matches. The operators
+are =, !=, <, <=, >, >= (numeric if both sides are numbers, otherwise
+string), ~ (regular-expression search) and "in" with a list of values.
+Comparisons combine with "and", "or", "not" and parentheses.
+
+Each compiled expression lists the paths it references, so that the
+scanner can collect only those values while it streams.
+
+License: Public Domain
+"""
+
+import logging, operator, re
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+LAST_UPDATED_PATH = '@last-updated-datetime'
+"""Path for the last-updated-datetime of an activity (used for deduplication and flattening)."""
+
+BUILTIN_EXPRESSIONS = {
+    'humanitarian': '@humanitarian = 1 or transaction/@humanitarian = 1',
+}
+"""Expressions behind the older command-line filter options."""
+
+TOKEN_PATTERN = re.compile(r'''\s*(?:(?P<punct>[(),])|(?P<op>!=|<=|>=|=|<|>|~)|"(?P<dq>[^"]*)"|'(?P<sq>[^']*)'|(?P<word>[^\s(),=!<>~'"]+))''')
+"""Split an expression into tokens."""
+
+PATH_PATTERN = re.compile(r'^(?:@[\w:.-]+|[\w:.-]+(?:/[\w:.-]+)*(?:/@[\w:.-]+)?)$')
+"""Match a valid path."""
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+"""Comparison operators (apart from ~ and in)."""
+
+
+def parse_path(path):
+    """Split a path into its element names and attribute.
+    @param path: a path string, e.g. "reporting-org/@ref".
+    @returns: a tuple of a tuple of element names, and the attribute name (or None for the element text).
+    """
+    if not PATH_PATTERN.match(path):
+        raise ValueError("Bad path in filter expression: {}".format(path))
+    steps = path.split('/')
+    if steps[-1].startswith('@'):
+        return tuple(steps[:-1]), steps[-1][1:]
+    else:
+        return tuple(steps), None
+
+
+class Expression:
+    """Base class for compiled expressions."""
+
+    paths = frozenset()
+    """The paths that the expression references."""
+
+    def evaluate(self, values):
+        """Evaluate the expression.
+        @param values: a dict of lists of values, keyed by path.
+        @returns: True or False.
+        """
+        raise NotImplementedError()
+
+
+class Exists(Expression):
+
+    def __init__(self, path):
+        self.path = path
+        self.paths = frozenset([path])
+
+    def evaluate(self, values):
+        return bool(values.get(self.path))
+
+
+class Compare(Expression):
+
+    def __init__(self, path, op, value):
+        self.path = path
+        self.paths = frozenset([path])
+        self.op = op
+        self.value = value
+        try:
+            self.number = float(value)
+        except ValueError:
+            self.number = None
+        if op == '~':
+            try:
+                self.pattern = re.compile(value)
+            except re.error as e:
+                raise ValueError("Bad regular expression {!r} at position {}: {}".format(value, e.pos, e.msg))
+
+    def evaluate(self, values):
+        for value in values.get(self.path, ()):
+            if self.op == '~':
+                if self.pattern.search(value):
+                    return True
+                continue
+            compare = OPERATORS[self.op]
+            if self.number is not None:
+                try:
+                    if compare(float(value), self.number):
+                        return True
+                    continue
+                except ValueError:
+                    pass
+            if compare(value, self.value):
+                return True
+        return False
+
+
+class In(Expression):
+
+    def __init__(self, path, choices):
+        self.path = path
+        self.paths = frozenset([path])
+        self.choices = frozenset(choices)
+
+    def evaluate(self, values):
+        return any(value in self.choices for value in values.get(self.path, ()))
+
+
+class Not(Expression):
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.paths = expression.paths
+
+    def evaluate(self, values):
+        return not self.expression.evaluate(values)
+
+
+class And(Expression):
+
+    def __init__(self, expressions):
+        self.expressions = expressions
+        self.paths = frozenset().union(*(expression.paths for expression in expressions))
+
+    def evaluate(self, values):
+        return all(expression.evaluate(values) for expression in self.expressions)
+
+
+class Or(Expression):
+
+    def __init__(self, expressions):
+        self.expressions = expressions
+        self.paths = frozenset().union(*(expression.paths for expression in expressions))
+
+    def evaluate(self, values):
+        return any(expression.evaluate(values) for expression in self.expressions)
+
+
+def compile_expression(text):
+    """Compile a filter expression.
+    @param text: the expression source (see the module documentation).
+    @returns: an Expression.
+    @raises ValueError: if the expression is malformed.
+    """
+    return _Parser(text).parse()
+
+
+class _Parser:
+    """Recursive-descent parser for filter expressions."""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            result = TOKEN_PATTERN.match(text, pos)
+            if result is None:
+                self.error("unexpected character at position {}".format(pos))
+            kind = result.lastgroup
+            value = result.group(kind)
+            if kind in ('dq', 'sq'):
+                kind = 'string'
+            self.tokens.append((kind, value))
+            pos = result.end()
+        self.pos = 0
+
+    def parse(self):
+        expression = self.parse_or()
+        if self.peek() is not None:
+            self.error("unexpected {}".format(self.peek()[1]))
+        return expression
+
+    def parse_or(self):
+        expressions = [self.parse_and()]
+        while self.peek_keyword('or'):
+            self.pos += 1
+            expressions.append(self.parse_and())
+        return expressions[0] if len(expressions) == 1 else Or(expressions)
+
+    def parse_and(self):
+        expressions = [self.parse_not()]
+        while self.peek_keyword('and'):
+            self.pos += 1
+            expressions.append(self.parse_not())
+        return expressions[0] if len(expressions) == 1 else And(expressions)
+
+    def parse_not(self):
+        if self.peek_keyword('not'):
+            self.pos += 1
+            return Not(self.parse_not())
+        if self.peek() == ('punct', '('):
+            self.pos += 1
+            expression = self.parse_or()
+            self.expect('punct', ')')
+            return expression
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        path = self.expect('word')[1]
+        parse_path(path)
+        token = self.peek()
+        if token is not None and token[0] == 'op':
+            self.pos += 1
+            return Compare(path, token[1], self.parse_value())
+        elif self.peek_keyword('in'):
+            self.pos += 1
+            self.expect('punct', '(')
+            choices = [self.parse_value()]
+            while self.peek() == ('punct', ','):
+                self.pos += 1
+                choices.append(self.parse_value())
+            self.expect('punct', ')')
+            return In(path, choices)
+        else:
+            return Exists(path)
+
+    def parse_value(self):
+        token = self.peek()
+        if token is None or token[0] not in ('word', 'string'):
+            self.error("expected a value")
+        self.pos += 1
+        return token[1]
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def peek_keyword(self, keyword):
+        token = self.peek()
+        return token is not None and token[0] == 'word' and token[1].lower() == keyword
+
+    def expect(self, kind, value=None):
+        token = self.peek()
+        if token is None or token[0] != kind or (value is not None and token[1] != value):
+            self.error("expected {}".format(value or "a path"))
+        self.pos += 1
+        return token
+
+    def error(self, message):
+        raise ValueError("Bad filter expression {!r}: {}".format(self.text, message))
+
+
+# end of module
@@ -0,0 +1,215 @@
+"""Compile the split() filter options into a single-pass filter plan.
+
+A FilterPlan holds only the stages for the filters that are actually
+active, ordered from cheapest to most expensive, and stops at the
+first stage that rejects an activity. It also knows which
+ActivityRecord fields and filter-expression paths its stages need, so
+that the scanner can skip extracting the rest, and it counts the
+rejections at each stage.
+
+Filter expressions (see iatisplit.expressions) become stages of their
+own; the humanitarian-only option is a built-in expression.
+
+License: Public Domain
+"""
+
+import logging
+from iatisplit.expressions import BUILTIN_EXPRESSIONS, compile_expression
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+FIELDS = ('identifier', 'humanitarian', 'activity_dates', 'transactions', 'transaction_values', 'values',)
+"""All of the ActivityRecord fields that the scanner can extract (transaction_values fills in the values in transactions)."""
+
+
+class FilterStage:
+    """One stage of a filter plan."""
+
+    def __init__(self, name, cost, fields, reason):
+        """Set up a stage.
+        @param name: a short name for the stage (used for the rejection counts).
+        @param cost: relative cost of the stage (lower costs run first).
+        @param fields: the ActivityRecord fields that the stage needs.
+        @param reason: the explanation to log when an activity is rejected.
+        """
+        self.name = name
+        self.cost = cost
+        self.fields = set(fields)
+        self.reason = reason
+
+    def test(self, record):
+        """Test an activity.
+        @param record: the ActivityRecord.
+        @returns: True if the activity passes this stage.
+        """
+        raise NotImplementedError()
+
+
+class ExpressionStage(FilterStage):
+    """Include only activities that match a filter expression."""
+
+    def __init__(self, name, expression):
+        """Set up a stage.
+        @param name: a short name for the stage.
+        @param expression: the compiled iatisplit.expressions.Expression.
+        """
+        # expressions on the iati-activity attributes alone are cheapest
+        cost = 1 if all(path.startswith('@') for path in expression.paths) else 3
+        super().__init__(name, cost, ('values',), "doesn't match {}".format(name))
+        self.expression = expression
+        self.paths = expression.paths
+
+    def test(self, record):
+        return self.expression.evaluate(record.values)
+
+
+class ActivityDatesStage(FilterStage):
+    """Include only activities in progress during a date range."""
+
+    def __init__(self, start_date, end_date):
+        super().__init__('activity-dates', 2, ('activity_dates',), "dates out of range")
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def test(self, record):
+        return check_dates_in_range(record.activity_dates, self.start_date, self.end_date)
+
+
+class TransactionStage(FilterStage):
+    """Include only activities with a matching transaction."""
+
+    def __init__(self, transaction_type, start_date, end_date):
+        super().__init__('transactions', 4, ('transactions',), "no matching transactions")
+        self.transaction_type = transaction_type
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def test(self, record):
+        for transaction_type, date, value, currency in record.transactions:
+            if (self.transaction_type is None or transaction_type == self.transaction_type) and \
+               (self.start_date is None or date >= self.start_date) and \
+               (self.end_date is None or date <= self.end_date):
+                return True
+        return False
+
+
+class FilterPlan:
+    """Callable that applies the active filter stages to an ActivityRecord, cheapest first."""
+
+    def __init__(self, stages):
+        """Set up a plan.
+        @param stages: a list of FilterStage objects, in any order.
+        """
+        self.stages = sorted(stages, key=lambda stage: stage.cost)
+        self.fields = set(['identifier'])
+        """The ActivityRecord fields that the plan needs."""
+        self.paths = set()
+        """The filter-expression paths that the plan needs."""
+        for stage in self.stages:
+            self.fields.update(stage.fields)
+            self.paths.update(getattr(stage, 'paths', ()))
+        self.seen = 0
+        """Number of activities checked."""
+        self.kept = 0
+        """Number of activities that passed every stage."""
+        self.rejections = {'identifier': 0}
+        """Number of activities rejected at each stage, keyed by stage name."""
+        for stage in self.stages:
+            self.rejections[stage.name] = 0
+
+    def __call__(self, record):
+        """Check whether an activity passes all of the filters.
+        @param record: the ActivityRecord for the activity.
+        @returns: True if the activity should be included in the output.
+        """
+        self.seen += 1
+
+        # get the iati-identifier (for logging)
+        iati_id = record.identifier
+        if iati_id is None:
+            logger.error("Skipping activity with no iati-identifier")
+            self.rejections['identifier'] += 1
+            return False
+        logger.debug("Checking activity %s", iati_id)
+
+        # stop at the first stage that rejects the activity
+        for stage in self.stages:
+            if not stage.test(record):
+                logger.debug("Skipping activity %s (%s)", iati_id, stage.reason)
+                self.rejections[stage.name] += 1
+                return False
+
+        self.kept += 1
+        return True
+
+    def merge_counts(self, seen, kept, rejections):
+        """Add counts from a copy of this plan (e.g. in a worker process).
+        @param seen: the other copy's seen count.
+        @param kept: the other copy's kept count.
+        @param rejections: the other copy's rejection counts.
+        """
+        self.seen += seen
+        self.kept += kept
+        for name, count in rejections.items():
+            self.rejections[name] = self.rejections.get(name, 0) + count
+
+    def log_counts(self):
+        """Log the number of activities checked, kept, and rejected at each stage."""
+        logger.info("Checked %d activities, kept %d", self.seen, self.kept)
+        for name, count in self.rejections.items():
+            if count:
+                logger.info("Rejected %d activities at stage %s", count, name)
+
+
+def check_dates_in_range(activity_dates, start_date=None, end_date=None):
+    """Check that an activity's dates fall into the allowed range.
+    Prefers the planned date over the actual date when available.
+    If the activity dates are missing, returns True
+    @param activity_dates: the parsed activity dates.
+    @param start_date: the start date in ISO 8601 format (YYYY-MM-DD), or None for no start limit.
+    @param end_date: the end date in ISO 8601 format (YYYY-MM-DD), or None for no end limit.
+    @returns: True if the activity is in range (or can't be determined).
+    """
+    if start_date:
+        if "end_actual" in activity_dates:
+            if start_date is None or activity_dates["end_actual"] <= start_date:
+                return False
+        elif "end_planned" in activity_dates:
+            if start_date is None or activity_dates["end_planned"] <= start_date:
+                return False
+    if end_date:
+        if "start_actual" in activity_dates:
+            if end_date is None or activity_dates["start_actual"] >= end_date:
+                return False
+        elif "start_planned" in activity_dates:
+            if end_date is None or activity_dates["start_planned"] >= end_date:
+                return False
+    return True
+
+
+def compile_filters(
+        start_date=None, end_date=None, humanitarian_only=False,
+        transaction_type=None, transaction_start_date=None, transaction_end_date=None,
+        expressions=()
+):
+    """Compile the split() filter options into a plan.
+    See iatisplit.split.split() for the meaning of the parameters.
+    @returns: a FilterPlan
+    @raises ValueError: if a filter expression is malformed.
+    """
+    stages = []
+    if humanitarian_only:
+        stages.append(ExpressionStage('humanitarian', compile_expression(BUILTIN_EXPRESSIONS['humanitarian'])))
+    for expression in expressions:
+        stages.append(ExpressionStage(expression, compile_expression(expression)))
+    if start_date or end_date:
+        stages.append(ActivityDatesStage(start_date, end_date))
+    if transaction_type is not None or transaction_start_date is not None or transaction_end_date is not None:
+        stages.append(TransactionStage(transaction_type, transaction_start_date, transaction_end_date))
+    return FilterPlan(stages)
+
+
+# end of module
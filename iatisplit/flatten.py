@@ -0,0 +1,125 @@
+"""Flattened outputs written alongside the XML output documents.
+
+For each output document STUB.NNNN.xml, a FlatWriter writes
+STUB.NNNN.jsonl, with one JSON summary per activity, and
+STUB.NNNN.transactions.csv, with one row per transaction. Both are
+built from the ActivityRecord that the scanner fills in during the same
+pass, so the XML is never parsed a second time, and each line is
+written as soon as its activity arrives.
+
+License: Public Domain
+"""
+
+import csv, io, json, logging
+from iatisplit.expressions import LAST_UPDATED_PATH
+from iatisplit.output import OutputFile
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+DEFAULT_CURRENCY_PATH = '@default-currency'
+"""Filter-expression path for the default currency of an activity."""
+
+FLAT_FIELDS = frozenset(('humanitarian', 'activity_dates', 'transactions', 'transaction_values', 'values',))
+"""The ActivityRecord fields that the flattened outputs need."""
+
+FLAT_PATHS = frozenset((LAST_UPDATED_PATH, DEFAULT_CURRENCY_PATH,))
+"""The filter-expression paths that the flattened outputs need."""
+
+TRANSACTION_COLUMNS = ('iati-identifier', 'transaction-type', 'transaction-date', 'value', 'currency',)
+"""Header row for the transactions CSV."""
+
+
+def make_summary(record):
+    """Make the JSON summary for an activity.
+    @param record: the ActivityRecord (with FLAT_FIELDS and FLAT_PATHS).
+    @returns: a dict.
+    """
+    return {
+        "iati-identifier": record.identifier,
+        "last-updated-datetime": _first(record.values.get(LAST_UPDATED_PATH)),
+        "default-currency": _first(record.values.get(DEFAULT_CURRENCY_PATH)),
+        "humanitarian": record.humanitarian,
+        "activity-dates": {key.replace('_', '-'): value for key, value in sorted(record.activity_dates.items())},
+        "transactions": len(record.transactions),
+    }
+
+
+def make_transaction_rows(record):
+    """Make the CSV rows for an activity's transactions.
+    A transaction without its own currency gets the activity's default currency.
+    @param record: the ActivityRecord (with FLAT_FIELDS and FLAT_PATHS).
+    @returns: a list of rows (lists of strings).
+    """
+    default_currency = _first(record.values.get(DEFAULT_CURRENCY_PATH))
+    return [
+        [record.identifier, transaction_type, date, value or '', currency or default_currency or '']
+        for transaction_type, date, value, currency in record.transactions
+    ]
+
+
+class FlatWriter:
+    """The flattened outputs for one output document."""
+
+    def __init__(self, summary_filename, transaction_filename, compression=None, compression_level=None, append_at=None, fsync='none'):
+        """Open the outputs.
+        @param summary_filename: the path for the JSON Lines activity summaries.
+        @param transaction_filename: the path for the transactions CSV.
+        @param compression: compress the outputs like the XML ("gzip", "xz" or "bz2"), or None.
+        @param compression_level: the compression level, or None for the default.
+        @param append_at: if present, a tuple of the (uncompressed) sizes of the existing summary and transaction files, to reopen them in append mode.
+        @param fsync: one of iatisplit.output.FSYNC_POLICIES.
+        """
+        self.summaries = OutputFile(
+            summary_filename, compression=compression, compression_level=compression_level,
+            append_at=append_at[0] if append_at else None, fsync=fsync
+        )
+        self.transactions = OutputFile(
+            transaction_filename, compression=compression, compression_level=compression_level,
+            append_at=append_at[1] if append_at else None, fsync=fsync
+        )
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer, lineterminator='\n')
+        if append_at is None:
+            self._write_rows([TRANSACTION_COLUMNS])
+
+    open_files = 2
+    """Number of files a FlatWriter keeps open (each with its own background writer thread)."""
+
+    @property
+    def sizes(self):
+        """The (uncompressed) sizes of the summary and transaction files so far (for append_at)."""
+        return self.summaries.bytes_written, self.transactions.bytes_written
+
+    def write(self, record):
+        """Write the summary and transactions for an activity.
+        @param record: the ActivityRecord.
+        """
+        self.summaries.write(json.dumps(make_summary(record), ensure_ascii=False).encode('utf-8') + b"\n")
+        rows = make_transaction_rows(record)
+        if rows:
+            self._write_rows(rows)
+
+    def close(self, publish=True):
+        """Close the outputs.
+        @param publish: if False, leave them under their temporary names (see iatisplit.output.OutputFile.close()).
+        """
+        try:
+            self.summaries.close(publish)
+        finally:
+            self.transactions.close(publish)
+
+    def _write_rows(self, rows):
+        self._csv.writerows(rows)
+        self.transactions.write(self._buffer.getvalue().encode('utf-8'))
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+
+def _first(values):
+    return values[0] if values else None
+
+
+# end of module
@@ -0,0 +1,190 @@
+"""Sidecar activity index for repeated splits of the same local file.
+
+The index is a small SQLite database next to the input file
+(FILE.iatisplit-index), with one row per activity: its byte offset and
+length, and the ActivityRecord fields that the filters use (the
+iati-identifier, activity dates, transactions, the humanitarian flag,
+and the values for a set of filter-expression paths). A later split
+with filters that the index covers evaluates them from the index
+alone, without parsing, and reads only the matching byte ranges.
+
+The index remembers the size and modification time of the input, and
+is ignored once either changes.
+
+License: Public Domain
+"""
+
+import json, logging, os
+from iatisplit.compression import is_compressed_file
+from iatisplit.flatten import DEFAULT_CURRENCY_PATH
+from iatisplit.expressions import BUILTIN_EXPRESSIONS, LAST_UPDATED_PATH, compile_expression
+from iatisplit.scanner import LARGE_ACTIVITY_SIZE, Activity, ActivityRecord, ActivityScanner, read_activity_data
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+INDEX_VERSION = 3
+"""Format version of the index (older or newer indexes are ignored)."""
+
+INDEX_EXTENSION = ".iatisplit-index"
+"""Added to the input filename to make the index filename."""
+
+INDEXED_FIELDS = frozenset(('identifier', 'humanitarian', 'activity_dates', 'transactions', 'transaction_values', 'values',))
+"""The ActivityRecord fields stored in the index."""
+
+DEFAULT_PATHS = frozenset([LAST_UPDATED_PATH, DEFAULT_CURRENCY_PATH]).union(*(compile_expression(text).paths for text in BUILTIN_EXPRESSIONS.values()))
+"""Filter-expression paths always stored in the index."""
+
+BATCH_SIZE = 1000
+"""Number of rows to insert at a time."""
+
+
+def make_index_filename(filename):
+    """Construct the filename for the index of an input file.
+    @param filename: the path to the input file.
+    @returns: the path to the index.
+    """
+    return filename + INDEX_EXTENSION
+
+
+def build_index(filename, paths=()):
+    """Build (or rebuild) the index for a local file.
+    The index is written to a temporary file first, then moved into place.
+    @param filename: the path to an uncompressed local IATI activity file.
+    @param paths: extra filter-expression paths to store, for later --filter options.
+    @returns: the number of activities indexed.
+    @raises ValueError: if the file is compressed (byte offsets into it can't be read back directly).
+    """
+    if is_compressed_file(filename):
+        raise ValueError("Can't index a compressed file: {}".format(filename))
+    paths = sorted(DEFAULT_PATHS.union(paths))
+    index_filename = make_index_filename(filename)
+    temp_filename = index_filename + ".tmp"
+    if os.path.exists(temp_filename):
+        os.remove(temp_filename)
+
+    logger.info("Indexing %s", filename)
+    count = 0
+    import sqlite3 # only for indexed files, to keep startup fast
+    connection = sqlite3.connect(temp_filename)
+    try:
+        connection.executescript("""
+            create table source (version integer, size integer, mtime_ns integer, root_tag blob, encoding text, doctype blob, paths text);
+            create table activities (offset integer, length integer, identifier text, humanitarian integer, activity_dates text, transactions text, path_values text);
+        """)
+        with open(filename, 'rb') as input:
+            stat = os.fstat(input.fileno())
+            scanner = ActivityScanner(input, paths=paths)
+            rows = []
+            for activity in scanner:
+                record = activity.record
+                rows.append((
+                    activity.offset,
+                    len(activity.data),
+                    record.identifier,
+                    1 if record.humanitarian else 0,
+                    json.dumps(record.activity_dates),
+                    json.dumps(record.transactions),
+                    json.dumps(record.values),
+                ))
+                if len(rows) >= BATCH_SIZE:
+                    connection.executemany("insert into activities values (?, ?, ?, ?, ?, ?, ?)", rows)
+                    count += len(rows)
+                    rows = []
+            connection.executemany("insert into activities values (?, ?, ?, ?, ?, ?, ?)", rows)
+            count += len(rows)
+            connection.execute(
+                "insert into source values (?, ?, ?, ?, ?, ?, ?)",
+                (INDEX_VERSION, stat.st_size, stat.st_mtime_ns, scanner.root_tag, scanner.encoding, scanner.doctype, json.dumps(paths))
+            )
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temp_filename, index_filename)
+    logger.info("Indexed %d activities from %s in %s", count, filename, index_filename)
+    return count
+
+
+def load_index(filename):
+    """Open the index for a local file, if there's an up-to-date one.
+    @param filename: the path to the input file.
+    @returns: an ActivityIndex, or None if there's no index or the input changed since it was built.
+    """
+    index_filename = make_index_filename(filename)
+    if not os.path.exists(index_filename):
+        return None
+    import sqlite3 # only for indexed files, to keep startup fast
+    try:
+        connection = sqlite3.connect(index_filename)
+    except sqlite3.Error:
+        logger.warning("Ignoring unreadable index %s", index_filename)
+        return None
+    try:
+        version, size, mtime_ns, root_tag, encoding, doctype, paths = connection.execute("select * from source").fetchone()
+        paths = json.loads(paths)
+    except (sqlite3.Error, TypeError, ValueError):
+        # a corrupt or old-format index: fall back to parsing
+        logger.warning("Ignoring unreadable index %s (run \"iatisplit index\" to rebuild it)", index_filename)
+        connection.close()
+        return None
+    stat = os.stat(filename)
+    if version != INDEX_VERSION or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+        logger.warning("Ignoring out-of-date index %s (run \"iatisplit index\" to rebuild it)", index_filename)
+        connection.close()
+        return None
+    return ActivityIndex(filename, connection, root_tag, encoding, doctype, paths)
+
+
+class ActivityIndex:
+    """An up-to-date index for a local file (use load_index() to open one).
+    Has the same root_tag, encoding and doctype properties as iatisplit.scanner.ActivityScanner.
+    """
+
+    def __init__(self, filename, connection, root_tag, encoding, doctype, paths):
+        self.filename = filename
+        self.connection = connection
+        self.root_tag = root_tag
+        self.encoding = encoding
+        self.doctype = doctype
+        self.paths = frozenset(paths)
+        """The filter-expression paths stored in the index."""
+
+    def covers(self, keep):
+        """Check whether the index holds everything a filter plan needs.
+        @param keep: an iatisplit.filters.FilterPlan.
+        @returns: True if the plan can run on the index alone.
+        """
+        return keep.fields <= INDEXED_FIELDS and set(keep.paths) <= self.paths
+
+    def scan(self, keep, large_activity_size=LARGE_ACTIVITY_SIZE):
+        """Iterate through the activities that pass a filter plan, reading only their bytes.
+        Decodes only the fields that the plan needs.
+        @param keep: an iatisplit.filters.FilterPlan that the index covers.
+        @param large_activity_size: leave an activity bigger than this in the input file (see iatisplit.scanner.SpooledData) instead of reading it into memory, or None for no limit.
+        @returns: an iterator of iatisplit.scanner.Activity objects.
+        """
+        fields = keep.fields
+        with open(self.filename, 'rb') as input:
+            for offset, length, identifier, humanitarian, activity_dates, transactions, path_values in self.connection.execute(
+                    "select * from activities order by rowid"
+            ):
+                record = ActivityRecord()
+                record.identifier = identifier
+                record.humanitarian = bool(humanitarian)
+                if 'activity_dates' in fields:
+                    record.activity_dates = json.loads(activity_dates)
+                if 'transactions' in fields:
+                    record.transactions = [tuple(transaction) for transaction in json.loads(transactions)]
+                if 'values' in fields:
+                    record.values = json.loads(path_values)
+                if keep(record):
+                    yield Activity(read_activity_data(input, offset, length, large_activity_size), offset, record)
+
+    def close(self):
+        """Close the index database."""
+        self.connection.close()
+
+
+# end of module
@@ -0,0 +1,117 @@
+"""Manifest for incremental re-splits.
+
+The manifest sits next to the output files, and maps each
+iati-identifier to a content hash and the chunk that holds it, along
+with a digest of each chunk's activities. On a re-run, each chunk is
+written to a temporary file first; if its digest matches the manifest,
+the temporary file is thrown away and the existing chunk is left alone
+(so its mtime doesn't change). Only chunks whose header (XML and
+document type declarations and iati-activities start tag), activity
+set or activity content changed are replaced; a new generated-datetime
+on the iati-activities element alone doesn't count, since it changes
+on every export.
+
+License: Public Domain
+"""
+
+import hashlib, json, logging, os, re
+from iatisplit.scanner import iter_chunks
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+GENERATED_DATETIME_PATTERN = re.compile(rb'\sgenerated-datetime\s*=\s*(?:"[^"]*"|\'[^\']*\')')
+"""Match the generated-datetime attribute in the root start tag (left out of the chunk digests)."""
+
+
+def hash_activity(data):
+    """Compute the content hash for an activity.
+    @param data: the raw bytes of the activity (or an iatisplit.scanner.SpooledData object).
+    @returns: a hex digest string.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter_chunks(data):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """The manifest for one series of output files."""
+
+    def __init__(self, path):
+        """Load the previous manifest (if any) and start a new one.
+        @param path: the path to the manifest file.
+        """
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                self.previous = json.load(f)
+        except (OSError, ValueError):
+            self.previous = {"chunks": {}, "activities": {}}
+        self.chunks = {}
+        """Chunk digests and filenames for this run, keyed by chunk number (as a string)."""
+        self.activities = {}
+        """Activity hashes and chunk numbers for this run, keyed by iati-identifier."""
+        self.changed = []
+        """Filenames of the chunks that were created or replaced in this run."""
+        self.removed = []
+        """Filenames of old chunks that were removed in this run."""
+        self._digests = {} # running digests of the activities in each chunk
+
+    def start_chunk(self, doc_counter, header):
+        """Record the header of a new chunk (before its activities).
+        @param doc_counter: the chunk number.
+        @param header: the bytes written before the first activity (see iatisplit.split.make_header()).
+        """
+        self._digests[doc_counter] = hashlib.blake2b(GENERATED_DATETIME_PATTERN.sub(b'', header), digest_size=16)
+
+    def add_activity(self, identifier, data, doc_counter):
+        """Record an activity written to a chunk.
+        @param identifier: the iati-identifier.
+        @param data: the raw bytes of the activity.
+        @param doc_counter: the chunk number.
+        """
+        activity_hash = hash_activity(data)
+        self.activities[identifier] = [activity_hash, doc_counter]
+        if doc_counter not in self._digests:
+            self._digests[doc_counter] = hashlib.blake2b(digest_size=16)
+        self._digests[doc_counter].update(activity_hash.encode('ascii'))
+
+    def publish(self, doc_counter, filename, temp_filename):
+        """Finish a chunk written to a temporary file.
+        Replaces the chunk only if it's new or its header or activities changed.
+        @param doc_counter: the chunk number.
+        @param filename: the final filename for the chunk.
+        @param temp_filename: the temporary file holding the new content.
+        """
+        key = str(doc_counter)
+        digest = self._digests.pop(doc_counter, hashlib.blake2b(digest_size=16)).hexdigest()
+        self.chunks[key] = {"filename": os.path.basename(filename), "digest": digest}
+        previous = self.previous["chunks"].get(key)
+        if previous and previous["digest"] == digest and previous["filename"] == os.path.basename(filename) and os.path.exists(filename):
+            logger.debug("Chunk %s is unchanged", filename)
+            os.remove(temp_filename)
+        else:
+            logger.info("Chunk %s changed", filename)
+            os.replace(temp_filename, filename)
+            self.changed.append(filename)
+
+    def save(self):
+        """Remove chunks left over from the previous run, and save the new manifest."""
+        directory = os.path.dirname(self.path)
+        for key, previous in self.previous["chunks"].items():
+            if key not in self.chunks or self.chunks[key]["filename"] != previous["filename"]:
+                filename = os.path.join(directory, previous["filename"])
+                if os.path.exists(filename):
+                    logger.info("Removing chunk %s", filename)
+                    os.remove(filename)
+                    self.removed.append(filename)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({"chunks": self.chunks, "activities": self.activities}, f)
+        os.replace(temp_path, self.path)
+
+
+# end of module
@@ -0,0 +1,343 @@
+"""Merge many IATI activity files into evenly-sized output documents.
+
+Publishers often spread their activities over hundreds of small files.
+merge() streams the activities from each input in turn through the
+same filter plan as iatisplit.split.split(), into one numbered series
+of output documents with the usual max and max_bytes limits, so the
+chunks come out even whatever the sizes of the inputs. Only one input
+is open, and one activity held, at a time, so memory doesn't grow with
+the number of inputs.
+
+Every output document has a single iati-activities start tag and XML
+declaration, so a prescan first reads just the start tag of each input.
+Inputs are grouped by IATI version and encoding (activities are copied
+byte for byte, so different encodings can't share a document), and each
+group gets its own series (STUB-VERSION.NNNN.xml, when there's more than
+one group). A group's start tag keeps the version, the latest
+generated-datetime, and every namespace declaration from its inputs, so
+that extension elements stay well-formed; an input that binds a prefix
+to a different namespace starts a separate group. Other attributes of
+the root element (e.g. linked-data-default) are dropped, since they
+can't be right for every input.
+
+With sort_by, each group's activities are sorted across all of its
+inputs with an external merge sort (see iatisplit.sort) before they're
+written, so memory stays within the sort budget instead.
+
+License: Public Domain
+"""
+
+import logging, re
+from iatisplit.compression import decompress_input
+from iatisplit.expressions import LAST_UPDATED_PATH
+from iatisplit.filters import compile_filters
+from iatisplit.output import FSYNC_POLICIES
+from iatisplit.scanner import LARGE_ACTIVITY_SIZE, ActivityScanner
+from iatisplit.split import STDIN, ActivityStream, ChunkWriter, open_cache, open_input
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+ROOT_READ_SIZE = 0x4000
+"""Number of bytes to read at a time while looking for the root start tag of an input."""
+
+ROOT_NAME_PATTERN = re.compile(rb'^<([^\s/>]+)')
+"""Match the element name in a start tag."""
+
+ATTRIBUTE_PATTERN = re.compile(rb'''([^\s=/>]+)\s*=\s*("[^"]*"|'[^']*')''')
+"""Match an attribute (name and quoted raw value) in a start tag."""
+
+
+def merge(
+        inputs, max=None, output_dir=".", output_stub="merged", start_date=None, end_date=None, humanitarian_only=False,
+        transaction_type=None, transaction_start_date=None, transaction_end_date=None, filters=(), workers=1,
+        cache_dir=None, use_index=True, compression=None, compression_level=None, max_bytes=None, dedup=None,
+        flatten=False, stats=None, fsync='none', connections=1, large_activity_size=LARGE_ACTIVITY_SIZE, sort_by=None, sort_memory=None
+):
+    """Merge the activities from many IATI activity reports into one series of output documents.
+    Inputs are read in order (or, with sort_by, each group is sorted across all of its inputs);
+    see the module description for how their root elements are combined.
+    A failure on one input is logged and recorded in the summary, and does not stop the others
+    (any activities already written from it stay in the output).
+    See iatisplit.split.split() for the filter, input and output parameters.
+    @param inputs: a list of file paths or web URLs (see iatisplit.batch.expand_inputs()); standard input isn't supported.
+    @param max: the maximum number of IATI activities to include in each output document, or None for no limit.
+    @param output_stub: the filename stub for the output documents (defaults to "merged").
+    @param sort_by: if present, the key to sort each group's activities by (see iatisplit.sort.SortKey), across all of its inputs.
+    @param sort_memory: the memory budget in bytes for sort_by, or None for iatisplit.sort.SORT_MEMORY.
+    @returns: a summary dict with the number of inputs, the output stub, the numbers of activities and files written, the rejections, a dict of groups (each with its output stub and numbers of inputs, activities and files), and a dict of error messages for the inputs that failed (with stats, also the statistics as a dict).
+    @raises ValueError: if an input is standard input, or an option is invalid.
+    """
+    if STDIN in inputs:
+        raise ValueError("Can't merge standard input")
+    if fsync not in FSYNC_POLICIES:
+        raise ValueError("Unknown fsync policy: {}".format(fsync))
+    plan = compile_filters(
+        start_date=start_date,
+        end_date=end_date,
+        humanitarian_only=humanitarian_only,
+        transaction_type=transaction_type,
+        transaction_start_date=transaction_start_date,
+        transaction_end_date=transaction_end_date,
+        expressions=list(filters)
+    )
+    if dedup is not None:
+        # the scanner also needs to collect the last-updated-datetime
+        plan.fields.add('values')
+        plan.paths.add(LAST_UPDATED_PATH)
+    if flatten:
+        if dedup is not None:
+            raise ValueError("Flattened outputs can't be combined with deduplication")
+        from iatisplit.flatten import FLAT_FIELDS, FLAT_PATHS
+        plan.fields.update(FLAT_FIELDS)
+        plan.paths.update(FLAT_PATHS)
+    sort_key = None
+    if sort_by:
+        from iatisplit.sort import SortKey
+        sort_key = SortKey(sort_by)
+        plan.fields.update(sort_key.fields)
+        plan.paths.update(sort_key.paths)
+    if stats is not None:
+        stats.reset("{} inputs".format(len(inputs)))
+        stats.plan = plan
+
+    # prescan the root start tags, and sort the inputs into groups
+    errors = {}
+    groups = []
+    input_groups = []
+    for input in inputs:
+        try:
+            root_tag, encoding, doctype = read_root(input)
+        except Exception as e:
+            logger.exception("Failed to read the root element of %s", input)
+            errors[input] = str(e)
+            input_groups.append(None)
+            continue
+        group = next((group for group in groups if group.accepts(root_tag, encoding, doctype)), None)
+        if group is None:
+            group = MergeGroup(
+                root_tag, encoding, len([group for group in groups if group.key == MergeGroup.make_key(root_tag, encoding)]), doctype
+            )
+            groups.append(group)
+        group.add(root_tag)
+        input_groups.append(group)
+    for group in groups:
+        group.output_stub = output_stub if len(groups) == 1 else "{}-{}".format(output_stub, group.name)
+        logger.info("Merging %d inputs with %s into %s", group.inputs, group.root_tag.decode('utf-8', 'replace'), group.output_stub)
+
+    def write_activity(group, data, record):
+
+        # skip the activity if a copy at least as new was already written
+        if dedup is not None:
+            last_updated = record.values.get(LAST_UPDATED_PATH, [None])[0]
+            if not dedup.check(record.identifier, last_updated):
+                return
+
+        if stats is not None:
+            stats.start('write')
+        if group.writer is None:
+            group.writer = ChunkWriter(
+                output_dir, group.output_stub, group.root_tag, group.encoding, max, max_bytes, None,
+                compression, compression_level, flatten, fsync, group.doctype
+            )
+        entry = b"  " + data + b"\n"
+        filename, offset = group.writer.write(entry, record)
+        if dedup is not None:
+            dedup.add(record.identifier, last_updated, filename, offset, len(entry))
+        if stats is not None:
+            stats.stop()
+
+    def sort_activity(group, data, record):
+        if stats is not None:
+            stats.start('sort')
+        sorter.add((group.name, sort_key(record)), data, record)
+        if stats is not None:
+            stats.stop()
+
+    # with sort_by, one external sorter holds every group, keyed by group name first
+    sorter = None
+    if sort_key is not None:
+        from iatisplit.sort import SORT_MEMORY, ExternalSorter
+        sorter = ExternalSorter(sort_memory or SORT_MEMORY)
+    add_activity = write_activity if sorter is None else sort_activity
+
+    # stream the activities from each input in turn to its group's writer (or to the sorter)
+    completed = False
+    try:
+        for input, group in zip(inputs, input_groups):
+            if group is None:
+                continue
+            try:
+                _merge_input(input, plan, lambda data, record: add_activity(group, data, record), workers, cache_dir, use_index, stats, connections, large_activity_size)
+            except Exception as e:
+                logger.exception("Failed to merge %s", input)
+                errors[input] = str(e)
+        if sorter is not None:
+            if stats is not None:
+                stats.start('sort')
+            groups_by_name = {group.name: group for group in groups}
+            for (name, key), data, record in sorter:
+                write_activity(groups_by_name[name], data, record)
+            if stats is not None:
+                stats.stop()
+        completed = True
+    finally:
+        # publish the documents in progress only if the merge got to the end (see iatisplit.split.ChunkWriter.close())
+        for group in groups:
+            if group.writer is not None:
+                group.writer.close(publish=completed)
+        if sorter is not None:
+            sorter.close()
+
+    plan.log_counts()
+    total_activities = sum(group.writer.total_activities for group in groups if group.writer is not None)
+    total_files = sum(group.writer.doc_counter for group in groups if group.writer is not None)
+    logger.info("Wrote %d activities to %d files from %d inputs (%d failed)", total_activities, total_files, len(inputs), len(errors))
+    summary = {
+        "inputs": len(inputs),
+        "stub": output_stub,
+        "activities": total_activities,
+        "files": total_files,
+        "rejected": plan.rejections,
+        "groups": {
+            group.name: {
+                "stub": group.output_stub,
+                "inputs": group.inputs,
+                "activities": group.writer.total_activities if group.writer is not None else 0,
+                "files": group.writer.doc_counter if group.writer is not None else 0,
+            } for group in groups
+        },
+        "errors": errors,
+    }
+    if stats is not None:
+        stats.activities = total_activities
+        stats.files = total_files
+        stats.finish()
+        summary["stats"] = stats.to_dict()
+    return summary
+
+
+def _merge_input(input, plan, write, workers, cache_dir, use_index, stats, connections, large_activity_size):
+    """Stream the activities that pass the filters from one input to a function (see merge()).
+    @param write: a function to call with the data and ActivityRecord of each activity.
+    """
+    stream = ActivityStream(
+        input, plan, workers, open_cache(cache_dir, input), use_index, stats, connections=connections, large_activity_size=large_activity_size
+    )
+    try:
+        for activity in stream:
+            write(activity.data, activity.record)
+    finally:
+        stream.close()
+
+
+def read_root(file_or_url):
+    """Read the root start tag of an IATI activity report, without reading the rest.
+    A URL is read with a single streaming request (not from the cache, or in Range segments),
+    which is closed after the first block or so.
+    @param file_or_url: the file path or web URL of the IATI activity report.
+    @returns: a tuple of the raw root start tag, the encoding from the XML declaration (or None), and the raw document type declaration (or None).
+    @raises ValueError: if the input has no root element.
+    """
+    input = open_input(file_or_url)
+    try:
+        scanner = ActivityScanner(decompress_input(input, file_or_url), ROOT_READ_SIZE, fields=())
+        scanner.read_root()
+    finally:
+        input.close()
+    if scanner.root_tag is None:
+        raise ValueError("No root element in {}".format(file_or_url))
+    return scanner.root_tag, scanner.encoding, scanner.doctype
+
+
+class MergeGroup:
+    """A set of inputs whose activities can share output documents."""
+
+    def __init__(self, root_tag, encoding, variant=0, doctype=None):
+        """Start a group with the root start tag of its first input.
+        @param root_tag: the raw root start tag.
+        @param encoding: the encoding from the XML declaration, or None.
+        @param variant: the number of earlier groups with the same key (with conflicting namespace prefixes or document type declarations).
+        @param doctype: the raw document type declaration, or None.
+        """
+        self.key = self.make_key(root_tag, encoding)
+        self.doctype = doctype
+        """The document type declaration that every input in the group has (it can declare entities that the activities use)."""
+        version, self.encoding = self.key
+        self.name = (version or "unknown") + ("" if self.encoding == "UTF-8" else "-" + self.encoding.lower())
+        if variant:
+            self.name += "-{}".format(variant + 1)
+        self.element = ROOT_NAME_PATTERN.match(root_tag).group(1)
+        self.version = None # raw version attribute
+        self.generated = None # raw generated-datetime attribute (the latest)
+        self.namespaces = {} # raw namespace declarations, keyed by attribute name (e.g. b"xmlns:usg")
+        self.inputs = 0
+        """Number of inputs in the group."""
+        self.output_stub = None
+        """The filename stub for the group's output documents."""
+        self.writer = None
+        """The group's iatisplit.split.ChunkWriter, once it has an activity."""
+
+    @staticmethod
+    def make_key(root_tag, encoding):
+        """Get the IATI version and (normalised) encoding of an input.
+        @param root_tag: the raw root start tag.
+        @param encoding: the encoding from the XML declaration, or None.
+        @returns: a tuple of the version (or None), and the upper-case encoding name.
+        """
+        version = get_attributes(root_tag).get(b'version')
+        return (
+            version[1:-1].strip().decode('ascii', 'replace') if version else None,
+            (encoding or "UTF-8").upper().replace("UTF8", "UTF-8"),
+        )
+
+    def accepts(self, root_tag, encoding, doctype=None):
+        """Check whether an input can join the group.
+        @param root_tag: the raw root start tag of the input.
+        @param encoding: the encoding from the XML declaration, or None.
+        @param doctype: the raw document type declaration of the input, or None.
+        @returns: True if the input has the same version, encoding and document type declaration, and no conflicting namespace prefixes.
+        """
+        if self.make_key(root_tag, encoding) != self.key or doctype != self.doctype:
+            return False
+        for name, value in get_attributes(root_tag).items():
+            if name.startswith(b'xmlns') and self.namespaces.get(name, value)[1:-1] != value[1:-1]:
+                return False
+        return True
+
+    def add(self, root_tag):
+        """Add an input to the group.
+        @param root_tag: the raw root start tag of the input.
+        """
+        self.inputs += 1
+        for name, value in get_attributes(root_tag).items():
+            if name == b'version' and self.version is None:
+                self.version = value
+            elif name == b'generated-datetime' and (self.generated is None or value[1:-1] > self.generated[1:-1]):
+                self.generated = value
+            elif name.startswith(b'xmlns') and name not in self.namespaces:
+                self.namespaces[name] = value
+
+    @property
+    def root_tag(self):
+        """The raw start tag for the group's output documents."""
+        attributes = []
+        if self.version is not None:
+            attributes.append(b'version=' + self.version)
+        if self.generated is not None:
+            attributes.append(b'generated-datetime=' + self.generated)
+        attributes += [name + b'=' + value for name, value in self.namespaces.items()]
+        return b'<' + b' '.join([self.element] + attributes) + b'>'
+
+
+def get_attributes(root_tag):
+    """Get the attributes of a raw start tag.
+    @param root_tag: the raw start tag.
+    @returns: a dict of raw attribute values (with their quotes), keyed by attribute name, in order.
+    """
+    return {name: value for name, value in ATTRIBUTE_PATTERN.findall(root_tag)}
+
+
+# end of module
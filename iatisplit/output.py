@@ -0,0 +1,98 @@
+"""Output files for split IATI documents.
+
+License: Public Domain
+"""
+
+import logging, os
+from iatisplit.background import BackgroundWriter
+from iatisplit.compression import CompressingWriter
+from iatisplit.scanner import iter_chunks
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+FSYNC_POLICIES = ('none', 'file', 'full',)
+"""When to flush output files to disk: never, each file before it's renamed into place, or also the directory after the rename."""
+
+
+class OutputFile:
+    """A binary output file in progress.
+    The content is written to a temporary file (FILENAME.tmp) by a
+    background thread, and renamed to its final name only on close, so
+    that nobody watching the output directory sees a half-written file.
+    When a manifest is supplied, the manifest decides on close whether
+    to replace the existing file.
+    When compression is requested, it happens in the background thread too.
+    """
+
+    def __init__(
+            self, filename, doc_counter=None, manifest=None, compression=None, compression_level=None, append_at=None, fsync='none'
+    ):
+        """Open an output file.
+        @param filename: the final path of the output file.
+        @param doc_counter: the chunk number (needed only with a manifest).
+        @param manifest: an iatisplit.manifest.Manifest for incremental re-splits, or None.
+        @param compression: one of iatisplit.compression.COMPRESSION_TYPES, or None for uncompressed output.
+        @param compression_level: the compression level, or None for the default.
+        @param append_at: if present, append to the existing temporary file (left by close(publish=False)), whose (uncompressed) content is this many bytes long; compressed files get a new compressed stream (defaults to None).
+        @param fsync: one of FSYNC_POLICIES (defaults to 'none').
+        @raises ValueError: if the fsync policy is unknown.
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy: {}".format(fsync))
+        self.filename = filename
+        self.doc_counter = doc_counter
+        self.manifest = manifest
+        self.fsync = fsync
+        self.bytes_written = append_at or 0
+        """Number of (uncompressed) bytes written so far."""
+        self.temp_filename = filename + ".tmp"
+        output = open(self.temp_filename, 'wb' if append_at is None else 'ab')
+        if compression is not None:
+            self.output = CompressingWriter(output, compression, compression_level, fsync != 'none')
+        else:
+            self.output = BackgroundWriter(output, sync=fsync != 'none')
+
+    def write(self, data):
+        """Write bytes to the file.
+        @param data: the bytes to write (or an iatisplit.scanner.SpooledData object, copied in pieces).
+        """
+        for chunk in iter_chunks(data):
+            self.output.write(chunk)
+        self.bytes_written += len(data)
+
+    def close(self, publish=True):
+        """Close the file, and rename it to its final name.
+        @param publish: if False, leave the content under the temporary name (to append to later).
+        """
+        self.output.close()
+        if not publish:
+            return
+        if self.manifest is not None:
+            self.manifest.publish(self.doc_counter, self.filename, self.temp_filename)
+        else:
+            os.replace(self.temp_filename, self.filename)
+        if self.fsync == 'full':
+            sync_directory(os.path.dirname(self.filename))
+
+
+def sync_directory(directory):
+    """Flush a directory to disk, so that renames in it survive a crash.
+    Does nothing on platforms that can't open a directory (e.g. Windows).
+    @param directory: the directory path ("" for the current directory).
+    """
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# end of module
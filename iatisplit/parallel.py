@@ -0,0 +1,236 @@
+"""Parse and filter a single large local file with several processes.
+
+The file is pre-scanned for iati-activity start tags, and cut into
+byte ranges on those boundaries. Each range is parsed and filtered in
+a worker process, with the original iati-activities start tag wrapped
+around it, and the worker sends back the offsets and records of the
+activities that passed. The results come back in input order, so the
+output is exactly the same as for a single-process run.
+
+The root element and the first activity are found with the expat
+scanner. Later boundaries come from a search for the literal text
+"<iati-activity", so each candidate is checked against the comments,
+CDATA sections and processing instructions before it, and skipped if
+it falls inside one. If the file can't be cut safely (other markup
+after the first activity, or no clear root end tag), it's parsed in a
+single process instead, so the output never changes.
+
+License: Public Domain
+"""
+
+import concurrent.futures, io, logging, mmap, os, re
+from iatisplit.scanner import LARGE_ACTIVITY_SIZE, Activity, ActivityScanner, read_activity_data
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+MIN_SEGMENT_SIZE = 0x400000
+"""Don't bother cutting the input into byte ranges smaller than this."""
+
+SEGMENTS_PER_WORKER = 4
+"""Number of byte ranges to queue for each worker, to even out the load."""
+
+HEADER_READ_SIZE = 0x4000
+"""Number of bytes to parse at a time while looking for the first activity."""
+
+ACTIVITY_START_PATTERN = re.compile(rb'<iati-activity[\s>/]')
+"""Match the start of an iati-activity start tag."""
+
+ROOT_NAME_PATTERN = re.compile(rb'<([A-Za-z_][^\s/>]*)')
+"""Match the element name in a start tag."""
+
+MARKUP_DELIMITERS = ((b'<!--', b'-->'), (b'<![CDATA[', b']]>'), (b'<?', b'?>'),)
+"""Start and end of the markup that can hide an iati-activity start tag."""
+
+
+class ParallelScanner:
+    """Iterate through the activities in a local file that pass a filter, parsing in parallel.
+    Has the same root_tag, encoding and doctype properties as iatisplit.scanner.ActivityScanner.
+    """
+
+    def __init__(self, filename, workers, keep, min_segment_size=None, large_activity_size=LARGE_ACTIVITY_SIZE):
+        """Set up a parallel scanner.
+        @param filename: the path to a local IATI activity file.
+        @param workers: the number of worker processes to use.
+        @param keep: a picklable iatisplit.filters.FilterPlan (or any picklable function that takes an ActivityRecord and returns True to include the activity).
+        @param min_segment_size: the smallest byte range to hand to a worker (defaults to MIN_SEGMENT_SIZE).
+        @param large_activity_size: leave an activity bigger than this in the input file (see iatisplit.scanner.SpooledData) instead of reading it into memory, or None for no limit.
+        """
+        self.filename = filename
+        self.workers = workers
+        self.keep = keep
+        self.min_segment_size = min_segment_size or MIN_SEGMENT_SIZE
+        self.large_activity_size = large_activity_size
+        self.root_tag = None
+        self.encoding = None
+        self.doctype = None
+
+    def __iter__(self):
+        try:
+            header, footer, segments = find_segments(self.filename, self.workers * SEGMENTS_PER_WORKER, self.min_segment_size)
+        except ValueError as e:
+            logger.warning("Can't cut %s into segments (%s); using a single process", self.filename, e)
+            yield from self._scan_serial()
+            return
+
+        # get the root tag and encoding from the header alone
+        scanner = ActivityScanner(io.BytesIO(header + footer))
+        for activity in scanner:
+            pass
+        self.root_tag = scanner.root_tag
+        self.encoding = scanner.encoding
+        self.doctype = scanner.doctype
+
+        logger.debug("Scanning %s in %d segments with %d workers", self.filename, len(segments), self.workers)
+        with open(self.filename, 'rb') as input, concurrent.futures.ProcessPoolExecutor(self.workers) as executor:
+            jobs = [(self.filename, header, footer, start, end, self.keep) for start, end in segments]
+            for results, counts in executor.map(scan_segment, jobs):
+                if counts is not None:
+                    self.keep.merge_counts(*counts)
+                for offset, length, record in results:
+                    yield Activity(read_activity_data(input, offset, length, self.large_activity_size), offset, record)
+
+    def _scan_serial(self):
+        """Iterate through the activities that pass the filter with a single streaming parser."""
+        with open(self.filename, 'rb') as input:
+            scanner = ActivityScanner(
+                input, fields=getattr(self.keep, 'fields', None), paths=getattr(self.keep, 'paths', ()), large_activity_size=self.large_activity_size
+            )
+            for activity in scanner:
+                self.root_tag, self.encoding, self.doctype = scanner.root_tag, scanner.encoding, scanner.doctype
+                if self.keep(activity.record):
+                    yield activity
+            self.root_tag, self.encoding, self.doctype = scanner.root_tag, scanner.encoding, scanner.doctype
+
+
+def find_segments(filename, count, min_segment_size=MIN_SEGMENT_SIZE):
+    """Cut a local IATI activity file into byte ranges on iati-activity boundaries.
+    @param filename: the path to a local IATI activity file.
+    @param count: the maximum number of byte ranges to produce.
+    @param min_segment_size: the smallest byte range to produce.
+    @returns: a tuple of the header bytes (up to the first activity), the root end tag, and a list of (start, end) offsets.
+    @raises ValueError: if the file can't be cut safely (so it has to be parsed in one piece).
+    """
+    with open(filename, 'rb') as input:
+        if os.fstat(input.fileno()).st_size == 0:
+            return b'', b'', []
+
+        # find the root element and the first activity with the parser; everything before the activity is the header
+        scanner = ActivityScanner(input, HEADER_READ_SIZE, fields=(), large_activity_size=None)
+        first = scanner.find_first_activity()
+
+        with mmap.mmap(input.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if first is None:
+                return data[:], b'', []
+            header = data[:first]
+
+            # find the root end tag (checked against the markup below)
+            footer = b'</' + ROOT_NAME_PATTERN.match(scanner.root_tag).group(1) + b'>'
+            last = data.rfind(footer[:-1], first)
+            if last < 0:
+                raise ValueError("no root end tag")
+
+            # pick activity boundaries close to evenly-spaced offsets, skipping any inside markup
+            size = max(min_segment_size, (last - first) // count + 1)
+            boundaries = [first]
+            outside = first # an offset known to be outside any markup
+            pos = first + size
+            while True:
+                result = ACTIVITY_START_PATTERN.search(data, pos, last)
+                if result is None:
+                    break
+                markup = _find_markup(data, outside, result.start())
+                if markup is None:
+                    boundaries.append(result.start())
+                    outside = result.start()
+                    pos = outside + size
+                elif markup[1] > last:
+                    # the end tag found is inside the same markup, so the root ends before it
+                    last = markup[0]
+                    break
+                else:
+                    outside = pos = markup[1]
+
+            # make sure the end tag isn't inside markup either
+            while True:
+                last = data.rfind(footer[:-1], outside, last + len(footer) - 1)
+                if last < 0:
+                    raise ValueError("no root end tag outside markup")
+                markup = _find_markup(data, outside, last)
+                if markup is None:
+                    break
+                last = markup[0]
+            if data[last + len(footer) - 1:last + len(footer)] not in (b'>', b' ', b'\t', b'\r', b'\n'):
+                raise ValueError("unrecognised root end tag at offset {}".format(last))
+            boundaries.append(last)
+
+            return header, footer, list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _find_markup(data, start, end):
+    """Find the comment, CDATA section or processing instruction (if any) that an offset falls inside.
+    @param data: the file contents.
+    @param start: an offset known to be outside any markup, at or before end.
+    @param end: the offset to check.
+    @returns: the (start, end) offsets of the markup around the offset, or None if it's not inside any.
+    @raises ValueError: for other "<!" markup (not allowed after the first activity), or markup that isn't closed.
+    """
+    found = {}
+    pos = start
+    while True:
+        # look for the rare second character, since "<" is everywhere
+        for char in (b'!', b'?',):
+            if char not in found or 0 <= found[char] < pos:
+                offset = data.find(char, pos + 1, end)
+                while offset >= 0 and data[offset - 1] != 0x3c: # "<"
+                    offset = data.find(char, offset + 1, end)
+                found[char] = offset - 1 if offset >= 0 else -1
+        opened = [offset for offset in found.values() if offset >= 0]
+        if not opened:
+            return None
+        markup_start = min(opened)
+        for opener, closer in MARKUP_DELIMITERS:
+            if data[markup_start:markup_start + len(opener)] == opener:
+                break
+        else:
+            raise ValueError("unexpected markup at offset {}".format(markup_start))
+        markup_end = data.find(closer, markup_start + len(opener))
+        if markup_end < 0:
+            raise ValueError("unclosed markup at offset {}".format(markup_start))
+        markup_end += len(closer)
+        if markup_end > end:
+            return markup_start, markup_end
+        pos = markup_end
+
+
+def scan_segment(job):
+    """Parse and filter one byte range of a file (runs in a worker process).
+    @param job: a tuple of filename, header bytes, root end tag, start offset, end offset, and filter function.
+    @returns: a list of (offset, length, ActivityRecord) tuples for the activities that passed the filter, and the filter plan's (seen, kept, rejections) counts for this segment alone (or None).
+    """
+    filename, header, footer, start, end, keep = job
+    with open(filename, 'rb') as input:
+        data = os.pread(input.fileno(), end - start, start)
+    adjust = start - len(header)
+    results = []
+    # the segment is in memory already, and only the offsets go back, so there's no point spooling large activities
+    scanner = ActivityScanner(
+        io.BytesIO(header + data + footer), fields=getattr(keep, 'fields', None), paths=getattr(keep, 'paths', ()), large_activity_size=None
+    )
+    # the plan arrives with the counts already merged from earlier segments, so return only this segment's
+    if hasattr(keep, 'merge_counts'):
+        seen, kept, rejections = keep.seen, keep.kept, dict(keep.rejections)
+    for activity in scanner:
+        if keep(activity.record):
+            results.append((activity.offset + adjust, len(activity.data), activity.record))
+    if hasattr(keep, 'merge_counts'):
+        return results, (
+            keep.seen - seen, keep.kept - kept, {name: count - rejections.get(name, 0) for name, count in keep.rejections.items()}
+        )
+    else:
+        return results, None
+
+
+# end of module
@@ -0,0 +1,143 @@
+"""Route activities to per-key output directories.
+
+The partition key is a filter-expression path (see
+iatisplit.expressions), such as recipient-country/@code or
+reporting-org/@ref, using the first value found, or "start-year" for
+the year of the actual (or else planned) start date. Each key gets its
+own directory under the output directory, with its own numbered series
+of output documents and its own max/max-bytes limits.
+
+With thousands of keys, there can't be an open file for each one, so
+the PartitionWriter keeps a bounded LRU pool of open files; a file that
+falls out of the pool is closed without ending its document, and
+reopened in append mode when its key turns up again.
+
+License: Public Domain
+"""
+
+import collections, logging, os, re
+from iatisplit.expressions import parse_path
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+START_YEAR = 'start-year'
+"""Partition key for the start year of an activity."""
+
+NO_KEY = 'none'
+"""Partition for activities without a value for the key."""
+
+MAX_OPEN_FILES = 64
+"""Default number of output files to keep open at the same time."""
+
+UNSAFE_PATTERN = re.compile(r'[^\w.-]+')
+"""Characters to replace in a key before using it as a directory name."""
+
+
+class PartitionKey:
+    """Callable that gets the partition key from an ActivityRecord."""
+
+    def __init__(self, spec):
+        """Set up a key.
+        @param spec: a filter-expression path, or START_YEAR.
+        @raises ValueError: if the path is malformed.
+        """
+        self.spec = spec
+        if spec == START_YEAR:
+            self.fields = {'activity_dates'}
+            self.paths = set()
+        else:
+            parse_path(spec)
+            self.fields = {'values'}
+            self.paths = {spec}
+        """The ActivityRecord fields and filter-expression paths the key needs."""
+
+    def __call__(self, record):
+        """Get the partition for an activity.
+        @param record: the ActivityRecord.
+        @returns: the key, made safe for use as a directory name (NO_KEY if missing).
+        """
+        if self.spec == START_YEAR:
+            date = record.activity_dates.get('start_actual') or record.activity_dates.get('start_planned')
+            value = date[:4] if date else None
+        else:
+            values = record.values.get(self.spec)
+            value = values[0] if values else None
+        if value is None:
+            return NO_KEY
+        key = UNSAFE_PATTERN.sub('_', value.strip())
+        return key if key.strip('.') else NO_KEY
+
+
+class PartitionWriter:
+    """Write activities to a separate iatisplit.split.ChunkWriter for each key,
+    keeping at most max_open of their files open at once.
+    """
+
+    def __init__(self, make_writer, output_dir, max_open=MAX_OPEN_FILES):
+        """Set up the writer.
+        @param make_writer: a function that takes a key and returns a new ChunkWriter for output_dir/key.
+        @param output_dir: the output directory (the key directories are created under it as needed).
+        @param max_open: the maximum number of open files, counting the flattened outputs (the most recent key keeps its files open even if it has more).
+        """
+        self.make_writer = make_writer
+        self.output_dir = output_dir
+        self.max_open = max(1, max_open)
+        self.writers = {}
+        """ChunkWriters for every key so far."""
+        self._open = collections.OrderedDict() # keys with open files, least recently used first
+
+    @property
+    def doc_counter(self):
+        """Total number of output documents started."""
+        return sum(writer.doc_counter for writer in self.writers.values())
+
+    @property
+    def total_activities(self):
+        """Total number of activities written."""
+        return sum(writer.total_activities for writer in self.writers.values())
+
+    def write(self, key, entry, record=None):
+        """Write an activity entry to the partition for a key.
+        @param key: the partition key (from PartitionKey).
+        @param entry: the bytes to write.
+        @param record: the ActivityRecord (for logging, and for flattened outputs).
+        @returns: a tuple of the output filename and the (uncompressed) byte offset of the entry in it.
+        """
+        writer = self.writers.get(key)
+        if writer is None:
+            os.makedirs(os.path.join(self.output_dir, key), exist_ok=True)
+            writer = self.writers[key] = self.make_writer(key)
+        if key in self._open:
+            self._open.move_to_end(key)
+        else:
+            self._open[key] = True
+        result = writer.write(entry, record)
+
+        # each key can have several files open (e.g. with flattened outputs), so count the files, not the keys
+        open_files = sum(self.writers[open_key].open_files for open_key in self._open)
+        while open_files > self.max_open and len(self._open) > 1:
+            old_key, _ = self._open.popitem(last=False)
+            logger.debug("Suspending output for partition %s", old_key)
+            open_files -= self.writers[old_key].open_files
+            self.writers[old_key].suspend()
+        return result
+
+    def partition_counts(self):
+        """Get the number of activities written for each key.
+        @returns: a dict of activity counts, keyed by partition key.
+        """
+        return {key: writer.total_activities for key, writer in sorted(self.writers.items())}
+
+    def close(self, publish=True):
+        """End the current output document for every key.
+        @param publish: if False, leave the documents in progress unpublished (see iatisplit.split.ChunkWriter.close()).
+        """
+        for writer in self.writers.values():
+            writer.close(publish)
+        self._open.clear()
+
+
+# end of module
@@ -19,63 +19,79 @@ class RequestsResponseIOWrapper(io.RawIOBase):
 
     Copied over from libhxl-python
 
-    """
+    Chunks from requests are never copied into an intermediate buffer:
+    read() hands back whole chunks (or memoryview slices of them) when
+    it can, and readinto() copies straight from the chunks into the
+    caller's buffer.
 
-    _seen_decode_exception = False
-    """Remember if the decode_content param failed for read()."""
+    """
 
-    BUFFER_SIZE = 0x1000
-    """Size of input chunk buffer from requests.raw.iter_content"""
+    BUFFER_SIZE = 0x100000
+    """Default size of input chunks from requests.iter_content"""
 
-    def __init__(self, response):
+    def __init__(self, response, chunk_size=None):
         """Construct a wrapper around a requests response object
         @param response: the HTTP response from the requests library
+        @param chunk_size: the size of chunks to request from iter_content (defaults to BUFFER_SIZE)
         """
         self.response = response
-        self.buffer = None
-        self.buffer_pos = -1
-        self.iter = response.iter_content(self.BUFFER_SIZE) # iterator through the input
+        self.chunk_size = chunk_size or self.BUFFER_SIZE
+        self.buffer = None # memoryview of the unread part of the current chunk
+        self.iter = response.iter_content(self.chunk_size) # iterator through the input
+
+    def _next_chunk(self):
+        """Make sure there's an unread chunk in self.buffer.
+        @returns: False if we've run out of input.
+        """
+        while not self.buffer:
+            try:
+                self.buffer = memoryview(next(self.iter))
+            except StopIteration:
+                self.buffer = None
+                return False
+        return True
 
     def read(self, size=-1):
-        """Read raw byte input from the requests raw.iter_content iterator
-        The function will unzip zipped content.
+        """Read raw byte input from the requests iter_content iterator
+        The function will unzip zipped content. Like any raw stream, it
+        may return fewer bytes than requested; an empty result means the
+        end of the input.
         @param size: the maximum number of bytes to read, or -1 for all available.
         """
-        result = bytearray()
-
-        if size == -1:
-            # Read all of the content at once
-            for chunk in self.iter:
-                result += chunk
-            self.buffer = None
+        if size is None or size < 0:
+            return self.readall()
+        if size == 0 or not self._next_chunk():
+            return b''
+        if len(self.buffer) <= size and self.buffer.obj is not None and len(self.buffer) == len(self.buffer.obj):
+            # the whole chunk is unread, so just hand it over
+            result = self.buffer.obj
         else:
-            # Read from chunks until we have enough content
-            while size > 0:
-                if not self.buffer:
-                    try:
-                        self.buffer = next(self.iter)
-                    except StopIteration:
-                         # stop if we've run out of input
-                        break
-                    self.buffer_pos = 0
-                avail = min(len(self.buffer)-self.buffer_pos, size) #actually read
-                result += self.buffer[self.buffer_pos:self.buffer_pos+avail]
-                size -= avail
-                self.buffer_pos += avail
-                if self.buffer_pos >= len(self.buffer):
-                    self.buffer = None
-
-        return bytes(result) # FIXME - how can we avoid a copy?
+            result = self.buffer[:size].tobytes()
+        self.buffer = self.buffer[len(result):]
+        return result
+
+    def readall(self):
+        """Read all of the remaining content at once."""
+        chunks = []
+        if self.buffer:
+            chunks.append(self.buffer)
+            self.buffer = None
+        chunks.extend(self.iter)
+        return b''.join(chunks)
 
     def readinto(self, b):
-        """Read content into a buffer of some kind.
-        This is not very efficient right now -- too much copying.
+        """Read content into a buffer of some kind, without intermediate copies.
         @param b: the buffer to read into (will read up to its length)
+        @returns: the number of bytes read (0 at the end of the input)
         """
-        result = self.read(len(b))[:len(b)]
-        size = len(result)
-        b[:size] = result[:size]
-        return size
+        target = memoryview(b).cast('B')
+        pos = 0
+        while pos < len(target) and self._next_chunk():
+            size = min(len(self.buffer), len(target) - pos)
+            target[pos:pos+size] = self.buffer[:size]
+            self.buffer = self.buffer[size:]
+            pos += size
+        return pos
 
     def readable(self):
         """Flag whether the content is readable."""
@@ -90,6 +106,7 @@ class RequestsResponseIOWrapper(io.RawIOBase):
 
     def close(self):
         """Close the streaming response."""
+        super().close()
         return self.response.close()
 
 # end of module
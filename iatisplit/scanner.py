@@ -0,0 +1,468 @@
+"""Locate IATI activities in a byte stream without re-serialising them.
+
+The scanner uses expat's byte-index tracking to find the exact start
+and end offsets of every top-level iati-activity element, so that the
+original bytes (attribute order, entities, whitespace) can be copied
+straight through to the output. In the same pass, it fills in a compact
+ActivityRecord with the fields that the filters need, and throws away
+everything else.
+
+Normally, the bytes of each activity are held in memory until it's
+finished. An activity that grows past large_activity_size bytes (some
+publishers put tens of thousands of transactions in one activity) is
+spooled to a temporary file as it streams in instead, and comes back
+with a SpooledData object in place of the bytes, which the writers copy
+to the output in READ_SIZE pieces; so memory stays bounded no matter
+how big a single activity gets.
+
+License: Public Domain
+"""
+
+import logging, os, re
+from iatisplit.expressions import parse_path
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+READ_SIZE = 0x100000
+"""Number of bytes to read from the input stream at a time."""
+
+LARGE_ACTIVITY_SIZE = 0x1000000
+"""Default size in bytes (16 MiB) past which an activity is spooled to a temporary file."""
+
+TAG_END_PATTERN = re.compile(rb'''(?:[^>"']|"[^"]*"|'[^']*')*>''')
+"""Match the rest of a markup tag, skipping over quoted attribute values."""
+
+
+ACTIVITY_DATE_TYPE_CODES = {
+    '1': 'start_planned',
+    '2': 'start_actual',
+    '3': 'end_planned',
+    '4': 'end_actual',
+}
+"""Embed this IATI codelist, since it's critical for operations."""
+
+
+class ActivityRecord:
+    """The fields of an activity needed for filtering."""
+
+    __slots__ = ('identifier', 'humanitarian', 'activity_dates', 'transactions', 'values',)
+
+    def __init__(self):
+        self.identifier = None
+        """The text of the iati-identifier element, or None if missing."""
+
+        self.humanitarian = False
+        """True if the activity or any of its transactions has the humanitarian marker."""
+
+        self.activity_dates = {}
+        """Activity dates, keyed by ACTIVITY_DATE_TYPE_CODES values."""
+
+        self.transactions = []
+        """List of (transaction type code, ISO date, value, currency) tuples; the value and currency are None unless the transaction_values field was requested (and the currency is None if the value has no currency attribute)."""
+
+        self.values = {}
+        """Lists of values collected for filter-expression paths, keyed by path."""
+
+
+class Activity:
+    """The raw bytes of a single iati-activity element."""
+
+    __slots__ = ('data', 'offset', 'record',)
+
+    def __init__(self, data, offset, record):
+        """Construct an activity.
+        @param data: the exact bytes of the iati-activity element, from its start tag to its end tag (or a SpooledData object for a large activity).
+        @param offset: the byte offset of the start tag in the input stream.
+        @param record: the ActivityRecord extracted from the activity.
+        """
+        self.data = data
+        self.offset = offset
+        self.record = record
+
+
+class SpooledData:
+    """The bytes of an activity too large to hold in memory, left in a file.
+    Supports len(), and adding bytes before or after (without copying the
+    content), so it can stand in for the bytes of an activity; use
+    iter_chunks() to get the content back.
+    """
+
+    __slots__ = ('file', 'offset', 'length', 'prefix', 'suffix',)
+
+    def __init__(self, file, offset, length, prefix=b'', suffix=b''):
+        """Construct spooled activity data.
+        @param file: the binary file holding the bytes (a temporary file, or the input file itself); it must stay open while the data is used.
+        @param offset: the file offset of the first byte.
+        @param length: the number of bytes in the file.
+        @param prefix: bytes to add before the content.
+        @param suffix: bytes to add after the content.
+        """
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def __len__(self):
+        return len(self.prefix) + self.length + len(self.suffix)
+
+    def __add__(self, other):
+        return SpooledData(self.file, self.offset, self.length, self.prefix, self.suffix + other)
+
+    def __radd__(self, other):
+        return SpooledData(self.file, self.offset, self.length, other + self.prefix, self.suffix)
+
+    def __bytes__(self):
+        return b''.join(self.chunks())
+
+    def chunks(self, size=READ_SIZE):
+        """Iterate through the bytes in pieces.
+        @param size: the maximum size of each piece read from the file.
+        @returns: an iterator of bytes objects.
+        """
+        if self.prefix:
+            yield self.prefix
+        fd = self.file.fileno()
+        pos = self.offset
+        end = self.offset + self.length
+        while pos < end:
+            data = os.pread(fd, min(size, end - pos), pos)
+            if not data:
+                raise IOError("Spooled activity data is truncated")
+            yield data
+            pos += len(data)
+        if self.suffix:
+            yield self.suffix
+
+
+def iter_chunks(data):
+    """Iterate through the bytes of an activity (or an entry made from one) in pieces.
+    @param data: bytes, or a SpooledData object.
+    @returns: an iterable of bytes objects.
+    """
+    return data.chunks() if isinstance(data, SpooledData) else (data,)
+
+
+def read_activity_data(file, offset, length, large_activity_size=LARGE_ACTIVITY_SIZE):
+    """Get the bytes of an activity at a known position in a file.
+    @param file: the open binary file.
+    @param offset: the file offset of the activity.
+    @param length: the length of the activity in bytes.
+    @param large_activity_size: leave an activity bigger than this in the file (as SpooledData) instead of reading it into memory, or None for no limit.
+    @returns: bytes, or a SpooledData object that reads from the file.
+    """
+    if large_activity_size is not None and length > large_activity_size:
+        return SpooledData(file, offset, length)
+    return os.pread(file.fileno(), length, offset)
+
+
+class ActivityScanner:
+    """Iterate through the iati-activity elements in an IATI activity file.
+    After the first activity is returned, root_tag holds the raw start
+    tag of the top-level iati-activities element, encoding holds the
+    encoding from the XML declaration (if any), and doctype holds the
+    raw document type declaration (if any).
+    """
+
+    def __init__(self, input, read_size=READ_SIZE, fields=None, paths=(), large_activity_size=LARGE_ACTIVITY_SIZE):
+        """Set up a scanner.
+        @param input: a binary file-like object containing the XML.
+        @param read_size: the number of bytes to read at a time.
+        @param fields: the set of ActivityRecord fields to extract (the identifier is always extracted), or None for all; "transaction_values" adds the values and currencies to the transactions.
+        @param paths: filter-expression paths (see iatisplit.expressions) to collect into ActivityRecord.values.
+        @param large_activity_size: spool an activity to a temporary file once it grows past this many bytes, or None to always hold activities in memory.
+        """
+        self.input = input
+        self.read_size = read_size
+        self.large_activity_size = large_activity_size
+        self._want_dates = fields is None or 'activity_dates' in fields
+        self._want_transactions = fields is None or 'transactions' in fields or 'transaction_values' in fields
+        self._want_transaction_values = fields is None or 'transaction_values' in fields
+        self._want_humanitarian = fields is None or 'humanitarian' in fields
+
+        # what to collect for each element path (relative to iati-activity)
+        self._paths = {}
+        for path in paths:
+            elements, attribute = parse_path(path)
+            self._paths.setdefault(elements, []).append((path, attribute))
+
+        self.root_tag = None
+        """The raw bytes of the root element's start tag (never an empty-element tag)."""
+
+        self.encoding = None
+        """The encoding from the XML declaration, or None if not declared."""
+
+        self.doctype = None
+        """The raw bytes of the document type declaration (with any internal subset, which can declare entities that the activities use), or None if there isn't one."""
+
+        # imported here, so that the XML parser is loaded only when something is parsed
+        import xml.parsers.expat
+        self._parser = xml.parsers.expat.ParserCreate()
+        self._parser.XmlDeclHandler = self._xml_decl
+        self._parser.StartDoctypeDeclHandler = self._start_doctype
+        self._parser.EndDoctypeDeclHandler = self._end_doctype
+        self._parser.StartElementHandler = self._start_element
+        self._parser.EndElementHandler = self._end_element
+
+        self._buffer = bytearray() # unconsumed input bytes
+        self._buffer_base = 0 # input offset of _buffer[0]
+        self._mark = 0 # no activity can start before this input offset
+        self._depth = 0 # current element depth
+        self._doctype_start = None # input offset of the document type declaration, while it's being parsed
+        self._activity_start = None # input offset of the current activity, if any
+        self._activity_empty = False # True if the current activity is an empty-element tag
+        self._activity_end = None # input offset just past the end of an empty activity tag
+        self._pending = [] # activities completed during the last parse
+        self._spool = None # temporary file holding the start of the current activity, if it's large
+        self._spooled = 0 # number of bytes in the spool
+
+        self._record = None # ActivityRecord for the current activity
+        self._text = None # text collected for the iati-identifier element
+        self._transaction = None # [type, date, value, currency] for the current transaction
+        self._value_text = None # text collected for the current transaction's value element
+        self._stack = [] # element names inside the current activity (only when collecting paths)
+        self._collectors = [] # [stack depth, path, text parts] for element text being collected
+
+    def __iter__(self):
+        while True:
+            data = self.input.read(self.read_size)
+            self._buffer += data
+            self._parser.Parse(data, not data)
+            yield from self._pending
+            self._pending.clear()
+            self._trim()
+            if not data:
+                break
+
+    def read_root(self):
+        """Read only as far as the root start tag, and stop (instead of iterating through the activities).
+        At most one read_size block past the start tag is read and parsed.
+        @returns: the raw root start tag (also in root_tag), or None if the input has no root element.
+        """
+        while self.root_tag is None:
+            data = self.input.read(self.read_size)
+            self._buffer += data
+            self._parser.Parse(data, not data)
+            self._pending.clear()
+            self._trim()
+            if not data:
+                break
+        return self.root_tag
+
+    def find_first_activity(self):
+        """Read only as far as the start tag of the first activity, and stop (instead of iterating through the activities).
+        At most one read_size block past the start tag is read and parsed; root_tag and encoding are set as usual.
+        @returns: the input offset of the first activity's start tag, or None if the input has no activities.
+        """
+        while True:
+            data = self.input.read(self.read_size)
+            self._buffer += data
+            self._parser.Parse(data, not data)
+            if self._pending:
+                return self._pending[0].offset
+            if self._activity_start is not None:
+                return self._activity_start
+            self._trim()
+            if not data:
+                return None
+
+    def _xml_decl(self, version, encoding, standalone):
+        self.encoding = encoding
+
+    def _start_doctype(self, name, system_id, public_id, has_internal_subset):
+        # expat reports a position past the name, so look back for the start (nothing before the root element is trimmed)
+        self._doctype_start = self._buffer.rfind(b'<!DOCTYPE', 0, self._parser.CurrentByteIndex - self._buffer_base) + self._buffer_base
+
+    def _end_doctype(self):
+        # expat reports the position of the closing ">"
+        end = self._parser.CurrentByteIndex + 1
+        self.doctype = bytes(self._buffer[self._doctype_start - self._buffer_base:end - self._buffer_base])
+        self._doctype_start = None
+
+    def _start_element(self, name, attributes):
+        pos = self._parser.CurrentByteIndex
+        self._mark = pos
+        if self._depth == 0:
+            end, empty = self._tag_end(pos)
+            tag = bytes(self._buffer[pos - self._buffer_base:end - self._buffer_base])
+            if empty:
+                tag = re.sub(rb'\s*/>$', b'>', tag)
+            self.root_tag = tag
+        elif self._activity_start is not None:
+            self._extract(name, attributes)
+            if self._paths:
+                self._stack.append(name)
+                self._collect(tuple(self._stack), attributes)
+        elif self._depth == 1 and name == 'iati-activity':
+            self._activity_start = pos
+            self._activity_end, self._activity_empty = self._tag_end(pos)
+            self._record = ActivityRecord()
+            if attributes.get('humanitarian') == '1':
+                self._record.humanitarian = True
+            if self._paths:
+                self._collect((), attributes)
+        self._depth += 1
+
+    def _end_element(self, name):
+        self._depth -= 1
+        pos = self._parser.CurrentByteIndex
+        if self._depth == 1 and self._activity_start is not None:
+            if not self._activity_empty:
+                self._activity_end, _ = self._tag_end(pos)
+            if self._spool is None:
+                data = bytes(self._buffer[self._activity_start - self._buffer_base:self._activity_end - self._buffer_base])
+            else:
+                self._spool_bytes(self._buffer_base, self._activity_end)
+                self._spool.flush()
+                data = SpooledData(self._spool, 0, self._spooled)
+                self._spool = None
+                self._update_text_handler()
+            self._pending.append(Activity(data, self._activity_start, self._record))
+            self._activity_start = None
+            self._record = None
+            self._mark = self._activity_end
+        else:
+            self._mark = max(self._mark, pos)
+            if self._text is not None and name == 'iati-identifier':
+                self._record.identifier = ''.join(self._text)
+                self._text = None
+                self._update_text_handler()
+            elif self._value_text is not None and name == 'value':
+                self._transaction[2] = ''.join(self._value_text).strip()
+                self._value_text = None
+                self._update_text_handler()
+            elif self._transaction is not None and name == 'transaction':
+                self._end_transaction()
+            if self._stack:
+                while self._collectors and self._collectors[-1][0] == len(self._stack):
+                    depth, path, parts = self._collectors.pop()
+                    self._record.values[path].append(''.join(parts).strip())
+                    self._update_text_handler()
+                self._stack.pop()
+
+    def _collect(self, elements, attributes):
+        """Collect filter-expression values for an element.
+        @param elements: the element path relative to iati-activity.
+        @param attributes: the element's attributes.
+        """
+        for path, attribute in self._paths.get(elements, ()):
+            values = self._record.values.setdefault(path, [])
+            if attribute is None:
+                self._collectors.append([len(self._stack), path, []])
+                self._update_text_handler()
+            elif attribute in attributes:
+                values.append(attributes[attribute])
+
+    def _characters(self, data):
+        if self._text is not None:
+            self._text.append(data)
+        if self._value_text is not None:
+            self._value_text.append(data)
+        for collector in self._collectors:
+            collector[2].append(data)
+
+    def _spooled_characters(self, data):
+        # text before this point is final, so a long text node can be spooled as it streams in
+        self._mark = self._parser.CurrentByteIndex
+        self._characters(data)
+
+    def _update_text_handler(self):
+        """Listen for character data only while some element's text is wanted (or a large activity is being spooled)."""
+        if self._spool is not None:
+            self._parser.CharacterDataHandler = self._spooled_characters
+        elif self._text is not None or self._value_text is not None or self._collectors:
+            self._parser.CharacterDataHandler = self._characters
+        else:
+            self._parser.CharacterDataHandler = None
+
+    def _extract(self, name, attributes):
+        """Record any fields that the filters need from an element inside an activity."""
+        record = self._record
+        if name == 'iati-identifier':
+            if self._depth == 2 and record.identifier is None:
+                self._text = []
+                self._update_text_handler()
+        elif name == 'activity-date' and self._want_dates:
+            date_type = attributes.get('type')
+            iso_date = attributes.get('iso-date')
+            if iso_date is None:
+                logger.error("@iso_date attribute missing")
+            elif date_type not in ACTIVITY_DATE_TYPE_CODES:
+                logger.error("Unrecognised activity-date/@type %s", date_type)
+            else:
+                record.activity_dates[ACTIVITY_DATE_TYPE_CODES[date_type]] = iso_date
+        elif name == 'transaction':
+            if self._want_transactions:
+                self._transaction = [None, None, None, None]
+            if self._want_humanitarian and attributes.get('humanitarian') == '1':
+                record.humanitarian = True
+        elif self._transaction is not None:
+            if name == 'transaction-type':
+                if self._transaction[0] is None:
+                    self._transaction[0] = attributes.get('code')
+            elif name == 'transaction-date':
+                if self._transaction[1] is None:
+                    self._transaction[1] = attributes.get('iso-date')
+            elif name == 'value' and self._want_transaction_values:
+                if self._transaction[2] is None and self._depth == 3:
+                    self._transaction[3] = attributes.get('currency')
+                    self._value_text = []
+                    self._update_text_handler()
+
+    def _end_transaction(self):
+        """Add the completed transaction to the record, if it's usable."""
+        transaction_type, transaction_date, value, currency = self._transaction
+        self._transaction = None
+        if transaction_type is None:
+            logger.error("Type missing for transaction in activity %s", self._record.identifier)
+        elif transaction_date is None:
+            logger.error("Date missing for transaction in activity %s", self._record.identifier)
+        else:
+            self._record.transactions.append((transaction_type, transaction_date, value, currency))
+
+    def _tag_end(self, pos):
+        """Find the end of the tag starting at an input offset.
+        @param pos: the input offset of the tag's opening "<".
+        @returns: a tuple of the input offset just past the tag, and True if it's an empty-element tag.
+        """
+        result = TAG_END_PATTERN.match(self._buffer, pos - self._buffer_base)
+        end = result.end()
+        return end + self._buffer_base, self._buffer[end - 2] == 0x2f # "/"
+
+    def _trim(self):
+        """Discard buffered bytes that can no longer be part of an activity (spooling them first if the activity is large)."""
+        if self._activity_start is None:
+            keep = self._mark
+        elif self._spool is None and (
+                self.large_activity_size is None or self._buffer_base + len(self._buffer) - self._activity_start <= self.large_activity_size
+        ):
+            keep = self._activity_start
+        else:
+            if self._spool is None:
+                logger.info(
+                    "Activity at input offset %d is over %d bytes; spooling it to a temporary file", self._activity_start, self.large_activity_size
+                )
+                import tempfile
+                self._spool = tempfile.TemporaryFile()
+                self._spooled = 0
+                self._update_text_handler()
+            # everything before the last tag or text seen is final; the end tag is looked up in the buffer later
+            self._spool_bytes(max(self._activity_start, self._buffer_base), self._mark)
+            keep = self._mark
+        if keep > self._buffer_base:
+            del self._buffer[:keep - self._buffer_base]
+            self._buffer_base = keep
+
+    def _spool_bytes(self, start, end):
+        """Append a range of buffered input bytes to the spool.
+        @param start: the input offset of the first byte.
+        @param end: the input offset just past the last byte.
+        """
+        self._spool.write(self._buffer[start - self._buffer_base:end - self._buffer_base])
+        self._spooled += end - start
+
+
+# end of module
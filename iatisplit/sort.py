@@ -0,0 +1,244 @@
+"""Sort activities by a key, with bounded memory (an external merge sort).
+
+The sort key is "identifier" (the iati-identifier), "last-updated" (the
+last-updated-datetime), "start-date" (the actual, or else planned,
+start date), or any filter-expression path (see iatisplit.expressions),
+using the first value found. Keys compare as strings, which puts ISO
+dates in date order; activities without a key go last, and activities
+with the same key keep their input order.
+
+The ExternalSorter buffers activities, with their keys and
+ActivityRecords, until they reach about three quarters of the memory
+budget, then sorts them and spills them to a temporary file as a sorted
+run. Runs are as big as the budget allows, so that there are as few of
+them as possible to merge. At the end, heapq.merge() does a k-way merge
+of the runs and the last (in-memory) buffer, reading each run through a
+buffer carved from the rest of the budget; with MAX_MERGE_RUNS runs or
+more, the oldest ones are first merged into bigger runs, so that the
+number of open files stays bounded. Activities that were too large to
+hold in memory (see iatisplit.scanner.SpooledData) are copied once to a
+separate temporary file, and only their position is buffered and
+spilled.
+
+A buffered activity counts as its size plus an average overhead (for
+its key, its record and the tuple around them), measured with
+sys.getsizeof() on a sample of the items and the objects they hold.
+That's approximate, but errs on the high side, since objects shared
+between items are counted with each one.
+
+The temporary files go in the usual temporary directory (set TMPDIR to
+change it), and need about as much space as the sorted activities.
+
+License: Public Domain
+"""
+
+import heapq, logging, pickle, sys, tempfile
+from iatisplit.expressions import LAST_UPDATED_PATH, parse_path
+from iatisplit.scanner import ActivityRecord, SpooledData, iter_chunks
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+IDENTIFIER = 'identifier'
+"""Sort key for the iati-identifier."""
+
+LAST_UPDATED = 'last-updated'
+"""Sort key for the last-updated-datetime."""
+
+START_DATE = 'start-date'
+"""Sort key for the actual (or else planned) start date."""
+
+SORT_MEMORY = 0x10000000
+"""Default memory budget for sorting, in bytes (256 MiB)."""
+
+MAX_MERGE_RUNS = 64
+"""Maximum number of runs to merge at once."""
+
+MIN_RUN_BUFFER_SIZE = 0x10000
+"""Smallest read/write buffer for a run file, in bytes."""
+
+MAX_RUN_BUFFER_SIZE = 0x100000
+"""Largest read/write buffer for a run file, in bytes (bigger buffers don't read any faster)."""
+
+LIST_ENTRY_SIZE = 8
+"""Memory use of one entry in the buffer list (a pointer)."""
+
+SAMPLE_INTERVAL = 64
+"""Measure the memory use of every this many buffered activities (the others get the average overhead so far)."""
+
+
+class SortKey:
+    """Callable that gets the sort key from an ActivityRecord."""
+
+    def __init__(self, spec):
+        """Set up a key.
+        @param spec: IDENTIFIER, LAST_UPDATED, START_DATE, or a filter-expression path.
+        @raises ValueError: if the path is malformed.
+        """
+        self.spec = spec
+        if spec == IDENTIFIER:
+            self.fields = set()
+            self.paths = set()
+        elif spec == START_DATE:
+            self.fields = {'activity_dates'}
+            self.paths = set()
+        else:
+            self.path = LAST_UPDATED_PATH if spec == LAST_UPDATED else spec
+            parse_path(self.path)
+            self.fields = {'values'}
+            self.paths = {self.path}
+        """The ActivityRecord fields and filter-expression paths the key needs."""
+
+    def __call__(self, record):
+        """Get the sort key for an activity.
+        @param record: the ActivityRecord.
+        @returns: a tuple that sorts activities without a value after all of the others.
+        """
+        if self.spec == IDENTIFIER:
+            value = record.identifier
+        elif self.spec == START_DATE:
+            value = record.activity_dates.get('start_actual') or record.activity_dates.get('start_planned')
+        else:
+            values = record.values.get(self.path)
+            value = values[0] if values else None
+        value = value.strip() if value is not None else ""
+        return (0, value) if value else (1, "")
+
+
+class ExternalSorter:
+    """Sort activities by key, spilling sorted runs to temporary files when they don't fit in memory."""
+
+    def __init__(self, memory=SORT_MEMORY, max_runs=MAX_MERGE_RUNS):
+        """Set up an empty sorter.
+        @param memory: the approximate memory budget in bytes.
+        @param max_runs: the maximum number of runs to merge at once (at least 2).
+        """
+        self.memory = memory
+        self.max_runs = max_runs
+        self.spill_size = memory * 3 // 4
+        """Buffered bytes that trigger a spill (the rest of the budget is for merge buffers)."""
+        self.buffer_size = min(MAX_RUN_BUFFER_SIZE, max(MIN_RUN_BUFFER_SIZE, (memory - self.spill_size) // max_runs))
+        """Read/write buffer size for each run file."""
+        self.count = 0
+        """Number of activities added."""
+        self.runs = [] # temporary files holding the sorted runs spilled so far
+        self.spilled = 0
+        """Number of runs spilled (including intermediate merges)."""
+        self._items = [] # buffered (key, sequence number, data, record) tuples
+        self._buffered = 0 # estimated memory use of _items
+        self._overhead = 0 # average memory use of a buffered item beyond its data, from the samples so far
+        self._samples = 0
+        self._large = None # temporary file holding the data of large activities
+
+    def add(self, key, data, record):
+        """Add an activity.
+        @param key: the sort key (any value that compares with the other keys).
+        @param data: the bytes of the activity, or a SpooledData object (copied, so its file can be closed afterwards).
+        @param record: the ActivityRecord, returned with the activity.
+        """
+        if isinstance(data, SpooledData):
+            if self._large is None:
+                self._large = tempfile.TemporaryFile(prefix="iatisplit-sort-")
+            offset = self._large.seek(0, 2)
+            for chunk in iter_chunks(data):
+                self._large.write(chunk)
+            self._large.flush()
+            data = SpooledData(self._large, offset, len(data))
+        item = (key, self.count, data, record)
+        size = 0 if isinstance(data, SpooledData) else len(data)
+        if self.count % SAMPLE_INTERVAL == 0:
+            self._samples += 1
+            self._overhead += (_estimate_size(item) + LIST_ENTRY_SIZE - size - self._overhead) / self._samples
+        self._buffered += size + self._overhead
+        self._items.append(item)
+        self.count += 1
+        if self._buffered >= self.spill_size:
+            self._spill()
+
+    def __iter__(self):
+        """Iterate through the activities in key order (call only once, after the last add()).
+        @returns: an iterator of (key, data, record) tuples.
+        """
+        self._items.sort()
+        if self.runs:
+            logger.info("Merging %d sorted runs of %d activities", len(self.runs) + 1, self.count)
+            while len(self.runs) >= self.max_runs:
+                self._merge_runs()
+            items = heapq.merge(*[self._read_run(run) for run in self.runs], self._items)
+        else:
+            items = self._items
+        for key, n, data, record in items:
+            yield key, data, record
+
+    def close(self):
+        """Remove the temporary files."""
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self._items = []
+        if self._large is not None:
+            self._large.close()
+            self._large = None
+
+    def _spill(self):
+        """Sort the buffered activities, and write them to a new run."""
+        self._items.sort()
+        logger.debug("Spilling a sorted run of %d activities (%d bytes)", len(self._items), self._buffered)
+        self.runs.append(self._write_run(self._items))
+        self._items = []
+        self._buffered = 0
+
+    def _merge_runs(self):
+        """Merge the oldest max_runs runs into one."""
+        runs, self.runs = self.runs[:self.max_runs], self.runs[self.max_runs:]
+        self.runs.append(self._write_run(heapq.merge(*[self._read_run(run) for run in runs])))
+        for run in runs:
+            run.close()
+
+    def _write_run(self, items):
+        """Write sorted items to a new run file.
+        @param items: an iterable of (key, sequence number, data, record) tuples, in order.
+        @returns: the run file, ready to read from the start.
+        """
+        run = tempfile.TemporaryFile(prefix="iatisplit-sort-", buffering=self.buffer_size)
+        for key, n, data, record in items:
+            # large activities are already in a file, so write only their position
+            pickle.dump((key, n, (data.offset, data.length) if isinstance(data, SpooledData) else data, record), run, pickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self.spilled += 1
+        return run
+
+    def _read_run(self, run):
+        """Read the items back from a run file.
+        @param run: the run file.
+        @returns: an iterator of (key, sequence number, data, record) tuples.
+        """
+        while True:
+            try:
+                key, n, data, record = pickle.load(run)
+            except EOFError:
+                return
+            if isinstance(data, tuple):
+                data = SpooledData(self._large, data[0], data[1])
+            yield key, n, data, record
+
+
+def _estimate_size(value):
+    """Estimate the memory use of a buffered item, with the objects it holds.
+    @param value: the item, or any part of it (containers and ActivityRecords are followed; a SpooledData object counts only itself).
+    @returns: the approximate size in bytes.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list,)):
+        size += sum(_estimate_size(item) for item in value)
+    elif isinstance(value, dict):
+        # the keys are field names and paths, shared by every record
+        size += sum(_estimate_size(item) for item in value.values())
+    elif isinstance(value, ActivityRecord):
+        size += sum(_estimate_size(getattr(value, name)) for name in ActivityRecord.__slots__)
+    return size
+
+
+# end of module
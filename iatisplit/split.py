@@ -5,32 +5,45 @@ October 2018
 License: Public Domain
 """
 
-import logging, os, re, requests, xml.dom.pulldom
-from iatisplit.requests_wrapper import RequestsResponseIOWrapper
+import logging, os, re, sys
+from iatisplit.checkpoint import CHECKPOINT_BYTES, Checkpointer, get_validators, load_checkpoint, make_checkpoint_filename, truncate_output
+from iatisplit.compression import EXTENSIONS, decompress_input, is_compressed_file
+from iatisplit.expressions import LAST_UPDATED_PATH
+from iatisplit.flatten import FLAT_FIELDS, FLAT_PATHS, FlatWriter
+from iatisplit.filters import check_dates_in_range, compile_filters
+from iatisplit.index import ActivityIndex, load_index
+from iatisplit.output import FSYNC_POLICIES, OutputFile
+from iatisplit.partition import MAX_OPEN_FILES, PartitionKey, PartitionWriter
+from iatisplit.scanner import ACTIVITY_DATE_TYPE_CODES, LARGE_ACTIVITY_SIZE, ActivityRecord, ActivityScanner, SpooledData, iter_chunks
+from iatisplit.stats import TimedFilter, TimedInput
 
 
 logger = logging.getLogger(__name__)
 """Logger for this module"""
 
 
-ACTIVITY_DATE_TYPE_CODES = {
-    '1': 'start_planned',
-    '2': 'start_actual',
-    '3': 'end_planned',
-    '4': 'end_actual',
-}
-"""Embed this IATI codelist, since it's critical for operations."""
+FOOTER = b"</iati-activities>\n"
+"""The end of every output document."""
+
+STDIN = "-"
+"""The input name for standard input."""
 
 
 def split(
-        file_or_url, max, output_dir=".", output_stub=None, start_date=None, end_date=None, humanitarian_only=False,
-        transaction_type=None, transaction_start_date=None, transaction_end_date=None
+        file_or_url, max=None, output_dir=".", output_stub=None, start_date=None, end_date=None, humanitarian_only=False,
+        transaction_type=None, transaction_start_date=None, transaction_end_date=None, workers=1,
+        cache_dir=None, incremental=False, compression=None, compression_level=None, max_bytes=None,
+        filters=(), use_index=True, dedup=None, partition_by=None, max_open_files=MAX_OPEN_FILES, flatten=False,
+        stats=None, fsync='none', checkpoint=False, resume=False, checkpoint_interval=CHECKPOINT_BYTES, connections=1,
+        large_activity_size=LARGE_ACTIVITY_SIZE, sort_by=None, sort_memory=None
 ):
     """Split an IATI activity report into multiple output documents.
     Start/end date filters use actual dates if present, then fall back to planned dates.
-    Uses PullDOM so that it will not exhaust memory with large input documents.
-    @param file_or_url: the file path or web URL of the IATI activity report.
-    @param max: the maximum number of IATI activities to include in each output document.
+    Activities are copied byte-for-byte from the input, so that the output preserves the
+    original markup; only one activity at a time is held in memory, and an activity
+    bigger than large_activity_size is streamed through a temporary file instead.
+    @param file_or_url: the file path or web URL of the IATI activity report, or "-" for standard input.
+    @param max: the maximum number of IATI activities to include in each output document, or None for no limit (defaults to None).
     @param output_dir: the path to the output directory (defaults to ".").
     @param start_date: if present, include only activities with a start date on or after this date. Requires ISO format YYYY-MM-DD (e.g. "2018-12-01") (defaults to None).
     @param end_date: if present, include only activities with an end date on or before this date. Requires ISO format YYYY-MM-DD (e.g. "2019-11-30") (defaults to None).
@@ -38,101 +51,607 @@ def split(
     @param transaction_start_date: if present, include only activities with a transaction on or after or after this date. Requires ISO format YYYY-MM-DD (e.g. "2018-12-01") (defaults to None).
     @param transaction_end_date: if present, include only activities with a transaction on or before this date. Requires ISO format YYYY-MM-DD (e.g. "2019-11-30") (defaults to None).
     @param humanitarian_only: if True, include only IATI activities that contain a humanitarian marker (defaults to False).
+    @param filters: a list of filter expressions (see iatisplit.expressions); include only activities that match all of them (defaults to no expressions).
+    @param workers: the number of processes to use for parsing and filtering a local file (defaults to 1). The output is the same as for a single process.
+    @param cache_dir: if present, cache URL downloads in this directory and revalidate them with conditional GETs; if neither the input nor the options have changed since the last split, skip the split (defaults to None).
+    @param incremental: if True, keep a manifest of activity hashes next to the output files, and replace only the output files whose content changed since the last run (defaults to False).
+    @param compression: if present, compress the output files ("gzip", "xz" or "bz2") in a background thread. Compressed input is always detected automatically (defaults to None).
+    @param compression_level: the compression level for the output files, or None for the default (defaults to None).
+    @param max_bytes: if present, the maximum size of each (uncompressed) output document in bytes; can be combined with max. An activity too big to fit on its own still gets a document to itself (defaults to None).
+    @param use_index: if True, and there's an up-to-date index for a local file (see iatisplit.index) that covers the filters, evaluate the filters from the index and read only the matching activities, without parsing (defaults to True).
+    @param dedup: if present, an iatisplit.dedup.Deduplicator shared by all the splits that should drop duplicate iati-identifiers (keeping the newest copy); call its finish() method after the last split (defaults to None).
+    @param partition_by: if present, a filter-expression path (e.g. "recipient-country/@code") or "start-year"; each activity goes to the subdirectory of output_dir named after its key, with its own series of output documents and limits (defaults to None).
+    @param max_open_files: the maximum number of output files (counting the flattened outputs) to keep open with partition_by, though always enough for one key; others are reopened in append mode as needed (defaults to MAX_OPEN_FILES).
+    @param flatten: if True, also write a JSON Lines file of activity summaries (STUB.NNNN.jsonl) and a CSV file of transactions (STUB.NNNN.transactions.csv) for each output document, in the same pass (defaults to False).
+    @param stats: if present, an iatisplit.stats.Stats object to reset and update with throughput, filter counts and stage times as the split runs (defaults to None).
+    @param fsync: when to flush output files to disk: "none", "file" (each file before it's renamed from STUB.NNNN.xml.tmp to its final name), or "full" (also the directory after the rename) (defaults to "none").
+    @param checkpoint: if True, save a checkpoint (STUB.checkpoint.json in output_dir) every checkpoint_interval bytes of input, for resume (defaults to False).
+    @param resume: if True, carry on from the checkpoint left by an interrupted split with the same input and options, reusing the output documents it finished (and keep saving checkpoints); without a usable checkpoint, start from the beginning (defaults to False).
+    @param checkpoint_interval: the number of input bytes between checkpoints (defaults to CHECKPOINT_BYTES).
+    @param connections: the number of concurrent HTTP Range requests for downloading a URL, if the server supports them; 1 for a single streaming request (defaults to 1).
+    @param large_activity_size: the size in bytes past which an activity is spooled to a temporary file and copied to the output in pieces, instead of being held in memory; None to hold every activity in memory (defaults to LARGE_ACTIVITY_SIZE).
+    @param sort_by: if present, "identifier", "last-updated", "start-date" or a filter-expression path; write the activities in order of this key instead of input order, with an external merge sort that spills sorted runs to temporary files (see iatisplit.sort) (defaults to None).
+    @param sort_memory: the memory budget in bytes for sort_by, or None for iatisplit.sort.SORT_MEMORY (defaults to None).
+    @returns: a summary dict with the input, the output stub, and the number of activities and files written (and, for incremental splits, lists of the changed and removed files; for partitioned splits, the activity count for each key; for resumed splits, the input offset it resumed from; with stats, the statistics as a dict).
     """
 
-    doc_counter = 0 # count output documents
-    activity_counter = max # force a new output file for the first activity
+    # compile the filters into a plan (which can also run in worker processes)
+    filter_options = dict(
+        start_date=start_date,
+        end_date=end_date,
+        humanitarian_only=humanitarian_only,
+        transaction_type=transaction_type,
+        transaction_start_date=transaction_start_date,
+        transaction_end_date=transaction_end_date,
+        expressions=list(filters)
+    )
+    plan = compile_filters(**filter_options)
+    if fsync not in FSYNC_POLICIES:
+        raise ValueError("Unknown fsync policy: {}".format(fsync))
+    if dedup is not None:
+        if incremental:
+            raise ValueError("Deduplication can't be combined with incremental splits")
+        # the scanner also needs to collect the last-updated-datetime
+        plan.fields.add('values')
+        plan.paths.add(LAST_UPDATED_PATH)
+    if flatten:
+        if incremental or dedup is not None:
+            raise ValueError("Flattened outputs can't be combined with incremental splits or deduplication")
+        # the scanner also needs to collect the fields for the flattened outputs
+        plan.fields.update(FLAT_FIELDS)
+        plan.paths.update(FLAT_PATHS)
+    partition = PartitionKey(partition_by) if partition_by else None
+    if partition is not None:
+        if incremental:
+            raise ValueError("Partitioned splits can't be combined with incremental splits")
+        # the scanner also needs to collect the partition key
+        plan.fields.update(partition.fields)
+        plan.paths.update(partition.paths)
+    sort_key = None
+    if sort_by:
+        from iatisplit.sort import SortKey
+        sort_key = SortKey(sort_by)
+        # the scanner also needs to collect the sort key
+        plan.fields.update(sort_key.fields)
+        plan.paths.update(sort_key.paths)
+
+    # figure out the filename stub
+    output_stub = make_stub(output_stub, file_or_url)
+
+    # the options that must be the same to skip an unchanged input, or to resume from a checkpoint
+    options = {
+        "max": max,
+        "max_bytes": max_bytes,
+        "output_dir": os.path.abspath(output_dir),
+        "output_stub": output_stub,
+        "filters": filter_options,
+        "compression": compression,
+        "partition_by": partition_by,
+        "flatten": flatten,
+        "sort_by": sort_by,
+    }
+
+    # set up checkpoints, and find the one to resume from, if requested
+    checkpointer = None
+    start = None
+    if checkpoint or resume:
+        if incremental or dedup is not None or partition is not None or sort_key is not None:
+            raise ValueError("Checkpoints can't be combined with incremental, deduplicated, partitioned or sorted splits")
+        if file_or_url == STDIN:
+            raise ValueError("Can't checkpoint or resume standard input")
+        checkpoint_filename = make_checkpoint_filename(output_dir, output_stub)
+        validators = get_validators(file_or_url)
+        if resume:
+            start = load_checkpoint(checkpoint_filename, file_or_url, options, validators)
+        checkpointer = Checkpointer(checkpoint_filename, file_or_url, options, validators, checkpoint_interval, fsync != 'none')
+        if start is not None:
+            checkpointer.offset = start["offset"]
+        else:
+            # a stale checkpoint would no longer match the output files
+            checkpointer.remove()
+
+    # open the input and start reading activities
+    cache = open_cache(cache_dir, file_or_url)
+    if stats is not None:
+        stats.reset(file_or_url)
+        stats.plan = plan
+    stream = ActivityStream(file_or_url, plan, workers, cache, use_index, stats, start, connections, large_activity_size)
+    if cache is not None:
+
+        # skip the whole split if nothing has changed since last time
+        last_split = cache.get_split(file_or_url)
+        if stream.unchanged and dedup is None and last_split and last_split["options"] == options and all(
+                os.path.exists(make_filename(output_dir, output_stub, n, compression)) for n in range(1, last_split["summary"]["files"] + 1)
+        ):
+            stream.close()
+            logger.info("Skipping %s (unchanged since the last split)", file_or_url)
+            return dict(last_split["summary"], skipped=True)
+
+    # load the manifest from the last run, if requested
+    manifest = None
+    if incremental:
+        from iatisplit.manifest import Manifest
+        manifest = Manifest(make_manifest_filename(output_dir, output_stub))
+
+    def start_writer(root_tag, encoding, doctype):
+        if partition is not None:
+            return PartitionWriter(
+                lambda key: ChunkWriter(
+                    os.path.join(output_dir, key), output_stub, root_tag, encoding,
+                    max, max_bytes, None, compression, compression_level, flatten, fsync, doctype
+                ),
+                output_dir, max_open_files
+            )
+        else:
+            return ChunkWriter(
+                output_dir, output_stub, root_tag, encoding, max, max_bytes, manifest,
+                compression, compression_level, flatten, fsync, doctype
+            )
+
+    # the writer for the output documents (started with the first activity, once the root tag is known,
+    # or right away when resuming, to pick up the document in progress at the checkpoint)
+    writer = None
+
+    # with sort_by, the activities go through an external sorter before they're written
+    sorter = None
+    if sort_key is not None:
+        from iatisplit.sort import SORT_MEMORY, ExternalSorter
+        sorter = ExternalSorter(sort_memory or SORT_MEMORY)
+
+    def write_activity(data, record):
+        nonlocal writer
+
+        # skip the activity if a copy at least as new was already written
+        if dedup is not None:
+            last_updated = record.values.get(LAST_UPDATED_PATH, [None])[0]
+            if not dedup.check(record.identifier, last_updated):
+                return
+
+        if stats is not None:
+            stats.start('write')
+
+        entry = b"  " + data + b"\n"
+
+        if writer is None:
+            writer = start_writer(stream.root_tag, stream.encoding, stream.doctype)
+
+        # copy the original activity bytes to the current output file (for the partition)
+        if partition is not None:
+            filename, offset = writer.write(partition(record), entry, record)
+        else:
+            filename, offset = writer.write(entry, record)
+        if dedup is not None:
+            dedup.add(record.identifier, last_updated, filename, offset, len(entry))
+        if manifest is not None:
+            manifest.add_activity(record.identifier, data, writer.doc_counter)
+
+        if stats is not None:
+            stats.stop()
+
+    def save_checkpoint(offset):
+        nonlocal writer
+        if checkpointer.due(offset):
+            if writer is None:
+                writer = start_writer(stream.root_tag, stream.encoding, stream.doctype)
+            checkpointer.save(offset, writer.root_tag, writer.encoding, stream.compression, writer.checkpoint(), writer.doctype)
+
+    # check for checkpoints at rejected activities too, so that a heavily filtered input doesn't go long without one
+    if checkpointer is not None:
+        stream.on_rejected = save_checkpoint
+
+    completed = False
+    try:
+
+        if start is not None:
+            writer = start_writer(start["root_tag"], start["encoding"], start["doctype"])
+            writer.restore(start["writer"])
+
+        # iterate through the activities that pass the filters;
+        # unless sorting, we never hold more than one activity in memory at once.
+        for activity in stream:
+
+            if sorter is not None:
+                if stats is not None:
+                    stats.start('sort')
+                sorter.add(sort_key(activity.record), activity.data, activity.record)
+                if stats is not None:
+                    stats.stop()
+                continue
 
-    # pointer to the top-level iati-activities node
-    # (will be reproduced in each output file)
-    activities_node = None
+            write_activity(activity.data, activity.record)
 
-    # pointer to the current output stream
-    current_output = None
+            # save a checkpoint every so often
+            if checkpointer is not None:
+                save_checkpoint(activity.offset + len(activity.data))
 
-    # Start the XML parser
-    if re.match(r'^https?://', file_or_url, flags=re.IGNORECASE):
-        # kludgey test for a URL
+        # write the sorted activities (with dedup, duplicates are checked in sorted order)
+        if sorter is not None:
+            if stats is not None:
+                stats.start('sort')
+            for key, data, record in sorter:
+                write_activity(data, record)
+            if stats is not None:
+                stats.stop()
+        completed = True
+
+    finally:
+        # if there's an output file in progress, always close it, but publish it only if the whole input was handled
+        if writer is not None:
+            writer.close(publish=completed)
+        if sorter is not None:
+            sorter.close()
+        stream.close()
+
+    if checkpointer is not None:
+        checkpointer.remove()
+
+    total_activities = writer.total_activities if writer is not None else 0
+    doc_counter = writer.doc_counter if writer is not None else 0
+    plan.log_counts()
+    logger.info("Wrote %d activities to %d files from %s", total_activities, doc_counter, file_or_url)
+    summary = {
+        "input": file_or_url,
+        "stub": output_stub,
+        "activities": total_activities,
+        "files": doc_counter,
+        "rejected": plan.rejections,
+    }
+    if partition is not None:
+        summary["partitions"] = writer.partition_counts() if writer is not None else {}
+    if start is not None:
+        summary["resumed_at"] = start["offset"]
+    if manifest is not None:
+        manifest.save()
+        summary["changed"] = manifest.changed
+        summary["removed"] = manifest.removed
+        logger.info("%d files changed and %d removed in %s", len(manifest.changed), len(manifest.removed), output_dir)
+    if stats is not None:
+        stats.activities = total_activities
+        stats.files = doc_counter
+        stats.finish()
+        summary["stats"] = stats.to_dict()
+    if cache is not None:
+        cache.record_split(file_or_url, options, summary)
+    return summary
+
+
+def iter_activities(
+        file_or_url, start_date=None, end_date=None, humanitarian_only=False,
+        transaction_type=None, transaction_start_date=None, transaction_end_date=None, filters=(),
+        workers=1, cache_dir=None, use_index=True, fields=(), paths=(), connections=1, large_activity_size=LARGE_ACTIVITY_SIZE
+):
+    """Iterate lazily through the IATI activities in a report that pass the filters.
+    See split() for the filter and input parameters.
+    @param file_or_url: the file path or web URL of the IATI activity report, or "-" for standard input.
+    @param fields: extra ActivityRecord fields to fill in (see iatisplit.scanner), beyond what the filters need.
+    @param paths: extra filter-expression paths to collect into ActivityRecord.values.
+    @returns: a generator of iatisplit.scanner.Activity objects, each with the raw bytes of the iati-activity element (data), its byte offset in the input (offset), and its ActivityRecord (record); the data of an activity bigger than large_activity_size is an iatisplit.scanner.SpooledData object, readable until the generator moves on or closes.
+    """
+    plan = compile_filters(
+        start_date=start_date,
+        end_date=end_date,
+        humanitarian_only=humanitarian_only,
+        transaction_type=transaction_type,
+        transaction_start_date=transaction_start_date,
+        transaction_end_date=transaction_end_date,
+        expressions=list(filters)
+    )
+    plan.fields.update(fields)
+    plan.paths.update(paths)
+    cache = open_cache(cache_dir, file_or_url)
+    stream = ActivityStream(file_or_url, plan, workers, cache, use_index, connections=connections, large_activity_size=large_activity_size)
+    try:
+        yield from stream
+    finally:
+        stream.close()
+
+
+def filter_document(
+        file_or_url, output, start_date=None, end_date=None, humanitarian_only=False,
+        transaction_type=None, transaction_start_date=None, transaction_end_date=None, filters=(),
+        workers=1, cache_dir=None, use_index=True, connections=1, large_activity_size=LARGE_ACTIVITY_SIZE
+):
+    """Write the IATI activities in a report that pass the filters to a single output document.
+    See split() for the filter and input parameters.
+    @param file_or_url: the file path or web URL of the IATI activity report, or "-" for standard input.
+    @param output: a binary stream for the output document (e.g. sys.stdout.buffer); not closed.
+    @returns: a summary dict with the input, and the numbers of activities written and rejected.
+    """
+    plan = compile_filters(
+        start_date=start_date,
+        end_date=end_date,
+        humanitarian_only=humanitarian_only,
+        transaction_type=transaction_type,
+        transaction_start_date=transaction_start_date,
+        transaction_end_date=transaction_end_date,
+        expressions=list(filters)
+    )
+    cache = open_cache(cache_dir, file_or_url)
+    stream = ActivityStream(file_or_url, plan, workers, cache, use_index, connections=connections, large_activity_size=large_activity_size)
+    total_activities = 0
+    try:
+        for activity in stream:
+            if total_activities == 0:
+                output.write(make_header(stream.root_tag, stream.encoding, stream.doctype))
+            for chunk in iter_chunks(b"  " + activity.data + b"\n"):
+                output.write(chunk)
+            total_activities += 1
+        if total_activities == 0 and stream.root_tag is not None:
+            output.write(make_header(stream.root_tag, stream.encoding, stream.doctype))
+        if stream.root_tag is not None:
+            output.write(FOOTER)
+    finally:
+        stream.close()
+    plan.log_counts()
+    return {
+        "input": file_or_url,
+        "activities": total_activities,
+        "rejected": plan.rejections,
+    }
+
+
+class ActivityStream:
+    """The activities in an IATI activity report that pass a filter plan.
+    Reads the input in the cheapest way available: from an up-to-date index,
+    with parallel workers, or with a single streaming parser. Has the same
+    root_tag, encoding and doctype properties as iatisplit.scanner.ActivityScanner.
+    """
+
+    def __init__(
+            self, file_or_url, plan, workers=1, cache=None, use_index=True, stats=None, start=None, connections=1,
+            large_activity_size=LARGE_ACTIVITY_SIZE
+    ):
+        """Open the input.
+        @param file_or_url: the file path or web URL of the IATI activity report, or "-" for standard input.
+        @param plan: the iatisplit.filters.FilterPlan.
+        @param workers: the number of processes to use for a local file.
+        @param cache: an iatisplit.cache.HTTPCache for a URL, or None.
+        @param use_index: if True, use an up-to-date index that covers the plan (see iatisplit.index).
+        @param stats: an iatisplit.stats.Stats object to update with bytes read and stage times, or None.
+        @param start: a checkpoint state dict (see iatisplit.checkpoint) to start from its input offset, or None to start from the beginning.
+        @param connections: the number of concurrent HTTP Range requests for a URL (see iatisplit.download); not used with a cache.
+        @param large_activity_size: the size in bytes past which an activity's data is a SpooledData object instead of bytes (see iatisplit.scanner), or None for no limit.
+        """
+        self.file_or_url = file_or_url
+        self.plan = plan
+        self.stats = stats
+        keep = plan if stats is None else TimedFilter(plan, stats)
+        self.unchanged = False
+        """True if the input came from the cache and hasn't changed since it was cached."""
+        self.compression = start["compression"] if start is not None else None
+        """The compression type of the input, or None (known only for a single streaming parser)."""
+        self.on_rejected = None
+        """A function to call with the input offset just past each activity that the filters reject (single streaming parser only), or None."""
+        self._input = None
+        local = not is_url(file_or_url) and file_or_url != STDIN
+
+        index = load_index(file_or_url) if use_index and local else None
+        if index is not None and not index.covers(plan):
+            logger.info("Index for %s doesn't cover the filters; parsing the file instead", file_or_url)
+            index.close()
+            index = None
+        if workers > 1 and not local:
+            logger.warning("Parallel workers are supported only for local files; using a single process")
+            workers = 1
+        if workers > 1 and is_compressed_file(file_or_url):
+            logger.warning("Parallel workers are not supported for compressed files; using a single process")
+            workers = 1
+
+        if index is not None:
+            logger.info("Using the index for %s", file_or_url)
+            self._input = index
+            self._scanner = index
+            self._activities = index.scan(keep, large_activity_size)
+        elif workers > 1:
+            # the workers read the whole file
+            if stats is not None:
+                stats.bytes_read = os.path.getsize(file_or_url)
+            from iatisplit.parallel import ParallelScanner
+            self._scanner = ParallelScanner(file_or_url, workers, plan, large_activity_size=large_activity_size)
+            self._activities = self._scanner
+        elif start is not None:
+            # pick up from a checkpoint, with the original XML declaration and root start tag in front
+            self._input = open_input_at(file_or_url, start["offset"], start["compression"], start["validators"])
+            header = make_header(start["root_tag"], start["encoding"], start["doctype"])
+            input = _PrefixedInput(header, self._input)
+            self._scanner = ActivityScanner(
+                input if stats is None else TimedInput(input, stats), fields=plan.fields, paths=plan.paths,
+                large_activity_size=large_activity_size
+            )
+            self._activities = self._filter(keep, start["offset"] - len(header))
+        else:
+            if cache is not None:
+                input, self.unchanged = cache.open(file_or_url)
+            else:
+                input = open_input(file_or_url, connections)
+            self._input = decompress_input(input, file_or_url)
+            self.compression = getattr(self._input, 'compression', None)
+            self._scanner = ActivityScanner(
+                self._input if stats is None else TimedInput(self._input, stats), fields=plan.fields, paths=plan.paths,
+                large_activity_size=large_activity_size
+            )
+            self._activities = self._filter(keep)
+        if start is not None and not isinstance(self._scanner, ActivityScanner):
+            # the index and the parallel workers start from the beginning, so skip what came before the checkpoint
+            self._activities = (activity for activity in self._activities if activity.offset >= start["offset"])
+
+    @property
+    def root_tag(self):
+        return self._scanner.root_tag
+
+    @property
+    def encoding(self):
+        return self._scanner.encoding
+
+    @property
+    def doctype(self):
+        return self._scanner.doctype
+
+    def __iter__(self):
+        if self.stats is None:
+            return iter(self._activities)
+        else:
+            return self._timed_activities()
+
+    def _filter(self, keep, shift=0):
+        """Pass on the activities that the filters keep, and report the others to on_rejected.
+        @param keep: the filter plan (or a TimedFilter around it).
+        @param shift: the difference between scanner offsets and input offsets.
+        """
+        for activity in self._scanner:
+            if keep(activity.record):
+                activity.offset += shift
+                yield activity
+            elif self.on_rejected is not None:
+                self.on_rejected(activity.offset + shift + len(activity.data))
+
+    def _timed_activities(self):
+        """Iterate through the activities, timing the scanner and reporting progress."""
+        stats = self.stats
+        activities = iter(self._activities)
+        count_bytes = isinstance(self._scanner, ActivityIndex) # only the activities are read from an indexed file
+        while True:
+            stats.start('parse')
+            try:
+                activity = next(activities)
+            except StopIteration:
+                return
+            finally:
+                stats.stop()
+            if count_bytes:
+                stats.bytes_read += len(activity.data)
+            if isinstance(activity.data, SpooledData):
+                stats.large_activities += 1
+            stats.check_progress()
+            yield activity
+
+    def close(self):
+        """Close the input."""
+        if self._input is not None:
+            self._input.close()
+            self._input = None
+
+
+def is_url(file_or_url):
+    """Check whether an input looks like a web URL rather than a local file.
+    @param file_or_url: the file path or web URL of the IATI activity report.
+    @returns: True if it's a URL.
+    """
+    # kludgey test for a URL
+    return re.match(r'^https?://', file_or_url, flags=re.IGNORECASE) is not None
+
+
+def open_cache(cache_dir, file_or_url):
+    """Open the download cache for an input, if there is one.
+    The HTTP stack (requests, and the modules that use it) is imported only
+    when a URL is actually opened, so that splitting local files starts fast.
+    @param cache_dir: the path to the cache directory, or None for no cache.
+    @param file_or_url: the file path or web URL of the IATI activity report.
+    @returns: an iatisplit.cache.HTTPCache for a URL with a cache directory, or None.
+    """
+    if cache_dir is None or not is_url(file_or_url):
+        return None
+    from iatisplit.cache import HTTPCache
+    return HTTPCache(cache_dir)
+
+
+def open_input(file_or_url, connections=1):
+    """Open an IATI activity report as a binary stream.
+    @param file_or_url: the file path or web URL of the IATI activity report, or "-" for standard input.
+    @param connections: for a URL, the number of concurrent HTTP Range requests to download it with, if the server supports them (defaults to 1).
+    @returns: a binary file-like object.
+    """
+    if file_or_url == STDIN:
+        # a separate reader, so that closing it leaves sys.stdin alone
+        return open(sys.stdin.fileno(), 'rb', closefd=False)
+    elif is_url(file_or_url) and connections > 1:
+        from iatisplit.download import open_url
+        return open_url(file_or_url, connections)
+    elif is_url(file_or_url):
+        import requests
+        from iatisplit.requests_wrapper import RequestsResponseIOWrapper
         response = requests.get(file_or_url, stream=True)
         # we do this so that we don't have to load the whole thing as a string
         # (in case it's big)
-        input = RequestsResponseIOWrapper(response)
-        events = xml.dom.pulldom.parse(input)
+        return RequestsResponseIOWrapper(response)
     else:
         # just a local file
-        # xml.dom.pulldom.parse won't close the file resource, so expect a warning
-        events = xml.dom.pulldom.parse(file_or_url)
+        return open(file_or_url, 'rb')
 
-    # figure out the filename stub
-    output_stub = make_stub(output_stub, file_or_url)
 
+def open_input_at(file_or_url, offset, compression=None, validators=None):
+    """Open an IATI activity report (decompressed, if needed) at a byte offset.
+    A local file is read from the offset directly, and a URL with an HTTP
+    Range request; a compressed input, or a server that ignores the Range
+    header, is read from the beginning and the bytes before the offset
+    are thrown away.
+    @param file_or_url: the file path or web URL of the IATI activity report.
+    @param offset: the byte offset in the (uncompressed) input.
+    @param compression: the compression type of the input, or None.
+    @param validators: for a URL, the validators from iatisplit.checkpoint.get_validators(), for an If-Range header.
+    @returns: a binary file-like object, positioned at the offset.
+    """
+    if compression is None:
+        if not is_url(file_or_url):
+            input = open(file_or_url, 'rb')
+            input.seek(offset)
+            return input
+        import requests
+        from iatisplit.requests_wrapper import RequestsResponseIOWrapper
+        # the offset counts decoded bytes, so the range mustn't be content-encoded
+        headers = {"Range": "bytes={}-".format(offset), "Accept-Encoding": "identity"}
+        validator = (validators or {}).get("etag") or (validators or {}).get("last_modified")
+        if validator:
+            # if the resource changed, get all of it instead of a range of the new version
+            headers["If-Range"] = validator
+        response = requests.get(file_or_url, stream=True, headers=headers)
+        if response.status_code == 206 and response.headers.get("Content-Range", "").startswith("bytes {}-".format(offset)):
+            if response.headers.get("Content-Encoding", "identity").lower() != "identity":
+                response.close()
+                raise ValueError("{} sent a content-encoded range, so the split can't resume from the checkpoint".format(file_or_url))
+            return RequestsResponseIOWrapper(response)
+        response.raise_for_status()
+        logger.info("%s doesn't support Range requests; skipping %d bytes", file_or_url, offset)
+        input = RequestsResponseIOWrapper(response)
+    else:
+        input = decompress_input(open_input(file_or_url), file_or_url)
     try:
+        skip_bytes(input, offset)
+    except:
+        input.close()
+        raise
+    return input
+
+
+def skip_bytes(input, count):
+    """Read and discard bytes from a stream.
+    @param input: a binary file-like object.
+    @param count: the number of bytes to discard.
+    @raises ValueError: if the stream ends first.
+    """
+    while count > 0:
+        data = input.read(min(count, 0x100000))
+        if not data:
+            raise ValueError("Input ended before the checkpoint offset")
+        count -= len(data)
 
-        # iterate through the document, stopping on every iati-activity element
-        for event, node in events:
 
-            # if it's not the start of an element, we don't care
-            if event != xml.dom.pulldom.START_ELEMENT:
-                continue
-
-            # if it's the top-level iati-activities node, save a copy
-            if node.tagName == 'iati-activities':
-                activities_node = node
-                continue
+class _PrefixedInput:
+    """Read some bytes, then the rest of a stream."""
 
-            # this is where the fun happens
-            # we want to parse all of the iati-activity into a single DOM branch,
-            # and then print it out to the current file if appropriate; that way,
-            # we never hold more than one activity in memory at once.
-            elif node.tagName == 'iati-activity':
-
-                # read the rest of this iati-activity element
-                events.expandNode(node)
-
-                # get the iati-identifier (for logging)
-                iati_id = get_identifier(node)
-                if iati_id is None:
-                    logger.error("Skipping activity with no iati-identifier")
-                    continue
-                logger.debug("Checking activity %s", iati_id)
-
-                # filter out non-humanitarian activities (if requested)
-                if humanitarian_only and not is_humanitarian(node):
-                    logger.debug("Skipping activity %s (no humanitarian marker)", iati_id)
-                    continue
-
-                # filter out activities not in the date range (if requested)
-                if not check_dates_in_range(get_activity_dates(node), start_date, end_date):
-                    logger.debug("Skipping activity %s (dates out of range)", iati_id)
-                    continue
-
-                # filter out activities without a transaction matching the filter provided (if any)
-                if not check_transaction_date_in_range(get_transaction_dates(node), transaction_type, transaction_start_date, transaction_end_date):
-                    logger.debug("Skipping activity %s (no matching transactions)", iati_id)
-                    continue
-
-                # SUCCESS! if we make it to here, then we want to include the activity in our output
-
-                # if the current output document is maxed out, start a new one;
-                # otherwise, advance the counter
-                if activity_counter >= max:
-                    activity_counter = 0
-                    doc_counter += 1
-                    current_output = end_file(current_output)
-                    current_output = start_file(output_dir, output_stub, doc_counter, activities_node)
-                else:
-                    activity_counter += 1
-
-                # write the activity XML to the current output file and continue
-                # XXX Kludge alert! Combining XML output and string appending
-                # (to keep indentation neat)
-                current_output.write("  " + node.toxml() + "\n")
+    def __init__(self, prefix, input):
+        self.prefix = prefix
+        self.input = input
 
-                continue
+    def read(self, size=-1):
+        if self.prefix:
+            data = self.prefix if size is None or size < 0 else self.prefix[:size]
+            self.prefix = self.prefix[len(data):]
+            return data
+        return self.input.read(size)
 
-    finally:
-        # if there's an output file in progress, always close it (even after an exception)
-        current_output = end_file(current_output)
+    def close(self):
+        self.input.close()
 
 
 def make_stub(output_stub, file_or_url):
@@ -145,13 +664,17 @@ def make_stub(output_stub, file_or_url):
     if output_stub:
         return output_stub
 
-    # if the file part seems to end with an .xml extension, strip it then go
-    result = re.search(r'([^\\/]+)(\.[xX][mM][lL])(\?.*)?$', file_or_url)
+    # standard input has no name
+    if file_or_url == STDIN:
+        return "iatiout"
+
+    # if the file part seems to end with an .xml extension (maybe compressed), strip it then go
+    result = re.search(r'([^\\/]+)(\.[xX][mM][lL])(\.(gz|xz|bz2))?(\?.*)?$', file_or_url)
     if result:
         return result.group(1)
 
-    # take what looks like the file part
-    result = re.search(r'([^\\/]+)(\?.*)?$', file_or_url)
+    # take what looks like the file part (without any compression extension)
+    result = re.search(r'([^\\/]+?)(\.(gz|xz|bz2))?(\?.*)?$', file_or_url)
     if result:
         return result.group(1)
 
@@ -159,54 +682,264 @@ def make_stub(output_stub, file_or_url):
     return "iatiout"
 
 
-def start_file(output_dir, output_stub, doc_counter, activities_node):
+def make_filename(output_dir, output_stub, doc_counter, compression=None, suffix="xml"):
+    """Construct the filename for an output document.
+    @param output_dir: path to the output directory
+    @param output_stub: the filename stub for each file (e.g. "iatiout")
+    @param doc_counter: the output document counter (1-based)
+    @param compression: the output compression type (adds an extension), or None
+    @param suffix: the filename extension (before any compression extension), for flattened outputs (defaults to "xml")
+    @returns: the path to the output file
+    """
+    extension = EXTENSIONS[compression] if compression else ""
+    return os.path.join(output_dir, "{}.{:04d}.{}{}".format(output_stub, doc_counter, suffix, extension))
+
+
+def make_manifest_filename(output_dir, output_stub):
+    """Construct the filename for the manifest of an incremental split.
+    @param output_dir: path to the output directory
+    @param output_stub: the filename stub for each file (e.g. "iatiout")
+    @returns: the path to the manifest file
+    """
+    return os.path.join(output_dir, "{}.manifest.json".format(output_stub))
+
+
+def start_file(
+        output_dir, output_stub, doc_counter, root_tag, encoding=None, manifest=None, compression=None, compression_level=None, fsync='none',
+        doctype=None
+):
     """Start a new output file.
     Will open a new XML document and add the start of the iati-activities element.
     @param output_dir: path to the output directory
     @param output_stub: the filename stub for each file (e.g. "iatiout")
     @param doc_counter: current value of the output document counter (1-based)
-    @param activities_node: the top-level iati-activities node, for reproduction in each output file
-    @returns: a pointer to the open file (for writing individual activities)
+    @param root_tag: the raw start tag of the top-level iati-activities element, for reproduction in each output file
+    @param encoding: the encoding of the input document (activities are copied unchanged), or None for UTF-8
+    @param manifest: an iatisplit.manifest.Manifest, to replace the file only if its content changes (defaults to None)
+    @param compression: if present, compress the file ("gzip", "xz" or "bz2") in a background thread (defaults to None)
+    @param compression_level: the compression level, or None for the default
+    @param fsync: one of iatisplit.output.FSYNC_POLICIES (defaults to 'none')
+    @param doctype: the raw document type declaration of the input document, or None
+    @returns: an iatisplit.output.OutputFile (for writing individual activities)
     """
     # construct the new filename
-    filename = os.path.join(output_dir, "{}.{:04d}.xml".format(output_stub, doc_counter))
+    filename = make_filename(output_dir, output_stub, doc_counter, compression)
 
     # start the file
     logger.info("Starting output file %s", filename)
-    output = open(filename, 'w')
+    output = OutputFile(filename, doc_counter, manifest, compression, compression_level, fsync=fsync)
 
-    # write the XML declaration
-    output.write("<?xml version=\"1.0\" encoding=\"utf-8\"?>\n")
-
-    # write the iati-activities start tag
-    # XXX Kludge alert! Changing an empty element to a start tag by string replacement (blech!).
-    # If the Python DOM string representation of an empty element changes in the future,
-    # this could break.
-    output.write(re.sub(r'/>$', ">\n", activities_node.toxml()))
+    # write the XML declaration, any document type declaration, and the original iati-activities start tag
+    header = make_header(root_tag, encoding, doctype)
+    if manifest is not None:
+        manifest.start_chunk(doc_counter, header)
+    output.write(header)
 
     # return the new file pointer for writing
     return output
 
 
+def make_header(root_tag, encoding=None, doctype=None):
+    """Make the start of an output document.
+    @param root_tag: the raw start tag of the top-level iati-activities element
+    @param encoding: the encoding of the input document (activities are copied unchanged), or None for UTF-8
+    @param doctype: the raw document type declaration of the input document (copied, so that entities it declares still resolve), or None
+    @returns: the bytes of the XML declaration, the document type declaration and the root start tag
+    """
+    header = "<?xml version=\"1.0\" encoding=\"{}\"?>\n".format(encoding or "utf-8").encode('ascii')
+    if doctype is not None:
+        header += doctype + b"\n"
+    return header + root_tag + b"\n"
+
+
 def end_file(current_output):
-    """End an output file.
+    """End an output file, and rename it from its temporary name to its final name.
     This is smart enough to do nothing if current_output is None.
     @param current_output: the current file output (or None).
     @returns: None, to represent the closed stream.
     """
     if current_output:
         # write the iati-activities end tag
-        current_output.write("</iati-activities>\n")
+        current_output.write(FOOTER)
         # close the output
         current_output.close()
     return None
 
 
+class ChunkWriter:
+    """Write activities to a numbered series of output documents (STUB.0001.xml, STUB.0002.xml, ...).
+    Starts a new document whenever the current one reaches max activities or max_bytes.
+    """
+
+    def __init__(
+            self, output_dir, output_stub, root_tag, encoding=None, max=None, max_bytes=None, manifest=None,
+            compression=None, compression_level=None, flatten=False, fsync='none', doctype=None
+    ):
+        """Set up a series (no file is opened until the first activity).
+        See split() and start_file() for the parameters.
+        """
+        self.output_dir = output_dir
+        self.output_stub = output_stub
+        self.root_tag = root_tag
+        self.encoding = encoding
+        self.doctype = doctype
+        self.max = max
+        self.max_bytes = max_bytes
+        self.manifest = manifest
+        self.compression = compression
+        self.compression_level = compression_level
+        self.flatten = flatten
+        self.fsync = fsync
+        self.doc_counter = 0
+        """Number of output documents started."""
+        self.activity_counter = 0 # count activities in the current output document
+        self.total_activities = 0
+        """Number of activities written."""
+        self.current_output = None
+        self.flat_output = None
+        """The iatisplit.flatten.FlatWriter for the current document, if flattening."""
+        self._suspended_at = None # bytes in the current document (and flattened outputs) while its files are suspended
+
+    def write(self, entry, record=None):
+        """Write an activity entry, starting a new output document first if needed.
+        @param entry: the bytes to write (the indented activity).
+        @param record: the ActivityRecord (for logging, and for the flattened outputs).
+        @returns: a tuple of the output filename and the (uncompressed) byte offset of the entry in it.
+        """
+        if self._suspended_at is not None:
+            self.resume()
+
+        # if the current output document is maxed out (by activities or by bytes),
+        # start a new one; otherwise, advance the counter
+        if self.current_output is None or (self.max is not None and self.activity_counter >= self.max) or (
+                self.max_bytes is not None and self.current_output.bytes_written + len(entry) + len(FOOTER) > self.max_bytes
+        ):
+            self.activity_counter = 0
+            self.doc_counter += 1
+            self._end_document()
+            self.current_output = start_file(
+                self.output_dir, self.output_stub, self.doc_counter, self.root_tag, self.encoding,
+                self.manifest, self.compression, self.compression_level, self.fsync, self.doctype
+            )
+            if self.flatten:
+                self.flat_output = self._open_flat_output()
+            if self.max_bytes is not None and self.current_output.bytes_written + len(entry) + len(FOOTER) > self.max_bytes:
+                logger.warning("Activity %s is too big for --max-bytes, so it gets a file to itself", record.identifier if record else None)
+        else:
+            self.activity_counter += 1
+
+        offset = self.current_output.bytes_written
+        self.current_output.write(entry)
+        if self.flat_output is not None:
+            self.flat_output.write(record)
+        self.total_activities += 1
+        return self.current_output.filename, offset
+
+    @property
+    def open_files(self):
+        """Number of files open for the current document (the XML, plus any flattened outputs), each with its own background writer thread."""
+        if self.current_output is None or self._suspended_at is not None:
+            return 0
+        return 1 + (self.flat_output.open_files if self.flat_output is not None else 0)
+
+    def suspend(self):
+        """Close the current file without ending (or renaming) the document, to free its handle.
+        The next write() reopens it in append mode. Not supported with a manifest.
+        """
+        if self.current_output is not None and self._suspended_at is None:
+            self._suspended_at = (self.current_output.bytes_written, self.flat_output.sizes if self.flat_output else None)
+            self.current_output.close(publish=False)
+            if self.flat_output is not None:
+                self.flat_output.close(publish=False)
+
+    def resume(self):
+        """Reopen the current files after suspend() or restore()."""
+        bytes_written, flat_sizes = self._suspended_at
+        self.current_output = OutputFile(
+            make_filename(self.output_dir, self.output_stub, self.doc_counter, self.compression),
+            compression=self.compression, compression_level=self.compression_level, append_at=bytes_written, fsync=self.fsync
+        )
+        if flat_sizes is not None:
+            self.flat_output = self._open_flat_output(flat_sizes)
+        self._suspended_at = None
+
+    def checkpoint(self):
+        """Flush the document in progress to disk (under its temporary name), and get the state needed to carry on from here later.
+        Not supported with a manifest.
+        @returns: a JSON-friendly dict for restore().
+        """
+        state = {
+            "doc_counter": self.doc_counter,
+            "activity_counter": self.activity_counter,
+            "total_activities": self.total_activities,
+            "open": None,
+        }
+        if self.current_output is not None:
+            self.suspend()
+            bytes_written, flat_sizes = self._suspended_at
+            state["open"] = {
+                "bytes_written": bytes_written,
+                "size": os.path.getsize(self.current_output.temp_filename),
+                "flat": None if flat_sizes is None else [
+                    [flat_sizes[0], os.path.getsize(self.flat_output.summaries.temp_filename)],
+                    [flat_sizes[1], os.path.getsize(self.flat_output.transactions.temp_filename)],
+                ],
+            }
+        return state
+
+    def restore(self, state):
+        """Carry on from a checkpoint, cutting the document in progress back to its size at the time.
+        @param state: the dict from checkpoint().
+        @raises ValueError: if the document in progress doesn't match the checkpoint.
+        """
+        self.doc_counter = state["doc_counter"]
+        self.activity_counter = state["activity_counter"]
+        self.total_activities = state["total_activities"]
+        current = state["open"]
+        if current is not None:
+            truncate_output(make_filename(self.output_dir, self.output_stub, self.doc_counter, self.compression), current["size"])
+            flat_sizes = None
+            if current["flat"] is not None:
+                (summary_bytes, summary_size), (transaction_bytes, transaction_size) = current["flat"]
+                truncate_output(make_filename(self.output_dir, self.output_stub, self.doc_counter, self.compression, "jsonl"), summary_size)
+                truncate_output(make_filename(self.output_dir, self.output_stub, self.doc_counter, self.compression, "transactions.csv"), transaction_size)
+                flat_sizes = (summary_bytes, transaction_bytes)
+            self._suspended_at = (current["bytes_written"], flat_sizes)
+
+    def close(self, publish=True):
+        """End the current output document, if any.
+        @param publish: if False (after a failure), close the current document's files without ending it, and leave them under their temporary names, so that a cut-short document is never mistaken for a finished one (a resumed split picks it up from the checkpoint).
+        """
+        if not publish:
+            self.suspend()
+            return
+        if self._suspended_at is not None:
+            self.resume()
+        self._end_document()
+
+    def _end_document(self):
+        try:
+            self.current_output = end_file(self.current_output)
+        finally:
+            if self.flat_output is not None:
+                self.flat_output.close()
+                self.flat_output = None
+
+    def _open_flat_output(self, append_at=None):
+        return FlatWriter(
+            make_filename(self.output_dir, self.output_stub, self.doc_counter, self.compression, "jsonl"),
+            make_filename(self.output_dir, self.output_stub, self.doc_counter, self.compression, "transactions.csv"),
+            self.compression, self.compression_level, append_at, self.fsync
+        )
+
+
 def get_identifier(activity_node):
     """Get the IATI identifier for an activity.
-    @param activity_node: the DOM node containing the activity.
+    @param activity_node: the DOM node containing the activity, or an ActivityRecord.
     @returns: the identifier, or None if the element doesn't exist
     """
+    if isinstance(activity_node, ActivityRecord):
+        return activity_node.identifier
     node = get_first_child(activity_node, "iati-identifier")
     if node is None:
         return None
@@ -216,9 +949,11 @@ def get_identifier(activity_node):
 
 def is_humanitarian(activity_node):
     """Check if an activity is flagged as humanitarian.
-    @param activity_node: the iati-activity DOM element node.
+    @param activity_node: the iati-activity DOM element node, or an ActivityRecord.
     @returns: True if the humanitarian marker is set on the iati-activity element or any transaction child.
     """
+    if isinstance(activity_node, ActivityRecord):
+        return activity_node.humanitarian
     # first try the iati-activity element
     if get_attribute(activity_node, "humanitarian") == "1":
         return True
@@ -230,32 +965,6 @@ def is_humanitarian(activity_node):
     return False
 
 
-def check_dates_in_range(activity_dates, start_date=None, end_date=None):
-    """Check that an activity's dates fall into the allowed range.
-    Prefers the planned date over the actual date when available.
-    If the activity dates are missing, returns True
-    @param activity_dates: the parsed activity dates.
-    @param start_date: the start date in ISO 8601 format (YYYY-MM-DD), or None for no start limit.
-    @param end_date: the end date in ISO 8601 format (YYYY-MM-DD), or None for no end limit.
-    @returns: True if the activity is in range (or can't be determined).
-    """
-    if start_date:
-        if "end_actual" in activity_dates:
-            if start_date is None or activity_dates["end_actual"] <= start_date:
-                return False
-        elif "end_planned" in activity_dates:
-            if start_date is None or activity_dates["end_planned"] <= start_date:
-                return False
-    if end_date:
-        if "start_actual" in activity_dates:
-            if end_date is None or activity_dates["start_actual"] >= end_date:
-                return False
-        elif "start_planned" in activity_dates:
-            if end_date is None or activity_dates["start_planned"] >= end_date:
-                return False
-    return True
-
-
 def check_transaction_date_in_range(transaction_dates, transaction_type=None, start_date=None, end_date=None):
     """Check that an activity has at least one transaction in the specified date range.
     If the transaction_type is provided, then only transactions of that type will be checked.
@@ -289,9 +998,11 @@ def check_transaction_date_in_range(transaction_dates, transaction_type=None, st
 
 def get_activity_dates(activity_node):
     """Extract all of the dates in an IATI activity element node.
-    @param activity_node: the iati-activity DOM element node.
+    @param activity_node: the iati-activity DOM element node, or an ActivityRecord.
     @returns: a dict of dates found.
     """
+    if isinstance(activity_node, ActivityRecord):
+        return activity_node.activity_dates
     activity_dates = {}
     date_nodes = activity_node.getElementsByTagName('activity-date')
     for node in date_nodes:
@@ -309,10 +1020,14 @@ def get_activity_dates(activity_node):
 
 def get_transaction_dates(activity_node):
     """Extract all of the transaction dates in an IATI activity element node.
-    @param activity_node: the iati-activity DOM element node.
+    @param activity_node: the iati-activity DOM element node, or an ActivityRecord.
     @returns: a dict of dates found.
     """
     transaction_dates = {}
+    if isinstance(activity_node, ActivityRecord):
+        for transaction_type, transaction_date, value, currency in activity_node.transactions:
+            transaction_dates.setdefault(transaction_type, []).append(transaction_date)
+        return transaction_dates
     transaction_nodes = activity_node.getElementsByTagName('transaction')
     for transaction_node in transaction_nodes:
         node = get_first_child(transaction_node, "transaction-type")
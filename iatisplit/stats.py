@@ -0,0 +1,240 @@
+"""Throughput and stage-timing statistics for a split.
+
+A Stats object passed to iatisplit.split.split() is updated as the
+split runs: bytes read, activities seen, kept and rejected by each
+filter stage, activities and files written, and the time spent in each
+stage:
+
+    read    reading (and decompressing) the input
+    parse   finding the activities and extracting their fields
+    filter  applying the filter plan
+    sort    buffering, spilling and merging activities for --sort-by
+    write   writing the output files
+
+The statistics also report how many activities were too large to hold
+in memory (see iatisplit.scanner.SpooledData), and the peak resident
+memory of the process.
+
+Stage times are exclusive (time reading is not counted as parsing).
+With parallel workers, filtering happens inside the workers, so it's
+counted as parsing.
+
+An optional callback gets the Stats object every so many activities,
+for progress reporting. With profile=True, each stage also gets its own
+cProfile.Profile, enabled only while that stage runs.
+
+Without a Stats object, split() skips all of this.
+
+License: Public Domain
+"""
+
+import logging, os, sys, time
+
+
+logger = logging.getLogger(__name__)
+"""Logger for this module"""
+
+
+STAGES = ('read', 'parse', 'filter', 'sort', 'write',)
+"""The stages of a split, in pipeline order."""
+
+PROGRESS_INTERVAL = 10000
+"""Default number of activities between progress callbacks."""
+
+
+class Stats:
+    """Statistics for a split (or several splits in a row)."""
+
+    def __init__(self, callback=None, interval=PROGRESS_INTERVAL, profile=False):
+        """Set up empty statistics.
+        @param callback: a function to call with this object every interval activities seen, and at the end of each split (or None).
+        @param interval: the number of activities between callbacks.
+        @param profile: if True, capture a cProfile.Profile for each stage.
+        """
+        self.callback = callback
+        self.interval = interval
+        if profile:
+            import cProfile # only when profiling, to keep startup fast
+        self.profiles = {stage: cProfile.Profile() for stage in STAGES} if profile else None
+        """A cProfile.Profile for each stage, or None if not profiling."""
+        self.reset()
+
+    def reset(self, input=None):
+        """Clear the counters and timers for a new split (the profiles keep accumulating).
+        @param input: the file path or URL being split.
+        """
+        self.input = input
+        self.bytes_read = 0
+        """Bytes read from the input (after decompression)."""
+        self.activities = 0
+        """Activities written."""
+        self.files = 0
+        """Output documents written."""
+        self.large_activities = 0
+        """Activities that passed the filters and were too large to hold in memory."""
+        self.times = {stage: 0.0 for stage in STAGES}
+        """Exclusive time in seconds spent in each stage."""
+        self.plan = None # the FilterPlan, for the seen/kept/rejected counts
+        self._started = time.perf_counter()
+        self._finished = None
+        self._stack = [] # stages in progress, innermost last
+        self._mark = None # time when the innermost stage last resumed
+        self._next_callback = self.interval
+
+    @property
+    def elapsed(self):
+        """Wall-clock seconds since the split started."""
+        return (self._finished or time.perf_counter()) - self._started
+
+    @property
+    def seen(self):
+        """Activities checked by the filters."""
+        return self.plan.seen if self.plan else 0
+
+    @property
+    def kept(self):
+        """Activities that passed the filters."""
+        return self.plan.kept if self.plan else 0
+
+    @property
+    def rejections(self):
+        """Activities rejected at each filter stage."""
+        return dict(self.plan.rejections) if self.plan else {}
+
+    def start(self, stage):
+        """Start (or resume) timing a stage, pausing the stage in progress.
+        @param stage: one of STAGES.
+        """
+        now = time.perf_counter()
+        if self._stack:
+            outer = self._stack[-1]
+            self.times[outer] += now - self._mark
+            if self.profiles is not None:
+                self.profiles[outer].disable()
+        self._stack.append(stage)
+        if self.profiles is not None:
+            self.profiles[stage].enable()
+        self._mark = time.perf_counter()
+
+    def stop(self):
+        """Stop timing the innermost stage, resuming the stage it interrupted."""
+        now = time.perf_counter()
+        stage = self._stack.pop()
+        self.times[stage] += now - self._mark
+        if self.profiles is not None:
+            self.profiles[stage].disable()
+            if self._stack:
+                self.profiles[self._stack[-1]].enable()
+        self._mark = time.perf_counter()
+
+    def check_progress(self):
+        """Call the callback if another interval of activities has been seen."""
+        if self.callback is not None and self.seen >= self._next_callback:
+            self._next_callback = self.seen + self.interval
+            self.callback(self)
+
+    def finish(self):
+        """Stop the clock at the end of a split, and make the final callback."""
+        self._finished = time.perf_counter()
+        if self.callback is not None:
+            self.callback(self)
+
+    def to_dict(self):
+        """Get the statistics as a JSON-friendly dict.
+        @returns: a dict.
+        """
+        elapsed = self.elapsed
+        return {
+            "input": self.input,
+            "elapsed": round(elapsed, 6),
+            "bytes_read": self.bytes_read,
+            "bytes_per_second": round(self.bytes_read / elapsed) if elapsed else None,
+            "seen": self.seen,
+            "kept": self.kept,
+            "rejected": self.rejections,
+            "activities": self.activities,
+            "files": self.files,
+            "large_activities": self.large_activities,
+            "peak_rss_kb": peak_memory_kb(),
+            "times": {stage: round(seconds, 6) for stage, seconds in self.times.items()},
+        }
+
+    def __getstate__(self):
+        # a copy sent to a worker process (e.g. by split_many()) leaves the callback and profiles behind
+        state = dict(self.__dict__)
+        state['callback'] = None
+        state['profiles'] = None
+        return state
+
+    def save_profiles(self, directory):
+        """Write each stage's profile to directory/STAGE.prof (for pstats or snakeviz).
+        @param directory: the output directory (created if needed).
+        """
+        os.makedirs(directory, exist_ok=True)
+        for stage, profile in (self.profiles or {}).items():
+            profile.dump_stats(os.path.join(directory, "{}.prof".format(stage)))
+
+
+def peak_memory_kb():
+    """Get the peak resident memory of this process so far.
+    @returns: the peak resident set size in KiB, or None if the platform doesn't report it.
+    """
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def log_progress(stats):
+    """A progress callback that logs the statistics so far.
+    @param stats: the Stats object.
+    """
+    elapsed = stats.elapsed
+    logger.info(
+        "%s: checked %d activities, kept %d, read %.1f MB (%.1f MB/s)",
+        stats.input, stats.seen, stats.kept, stats.bytes_read / 1e6, stats.bytes_read / 1e6 / elapsed if elapsed else 0.0
+    )
+
+
+class TimedInput:
+    """Wrap an input stream to count bytes and time reads for a Stats object."""
+
+    def __init__(self, input, stats):
+        self.input = input
+        self.stats = stats
+
+    def read(self, size=-1):
+        self.stats.start('read')
+        try:
+            data = self.input.read(size)
+        finally:
+            self.stats.stop()
+        self.stats.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self.input.close()
+
+
+class TimedFilter:
+    """Wrap a filter plan to time it for a Stats object."""
+
+    def __init__(self, plan, stats):
+        self.plan = plan
+        self.stats = stats
+        self.fields = plan.fields
+        self.paths = plan.paths
+
+    def __call__(self, record):
+        self.stats.start('filter')
+        try:
+            return self.plan(record)
+        finally:
+            self.stats.stop()
+
+
+# end of module
@@ -0,0 +1,54 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.batch module
+
+License: Public Domain
+"""
+
+import unittest
+import os, tempfile, shutil
+import iatisplit.__main__ as main, iatisplit.batch
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def test_expand_inputs(self):
+        list_file = os.path.join(self.output_directory, "inputs.txt")
+        with open(list_file, "w") as f:
+            f.write("# comment\n\nhttp://example.org/*.xml\n")
+        inputs = iatisplit.batch.expand_inputs([_resolve_path("iati-activities-*.xml")], list_file)
+        self.assertEqual([
+            _resolve_path("iati-activities-passthrough.xml"),
+            _resolve_path("iati-activities-simple.xml"),
+            "http://example.org/*.xml",
+        ], inputs)
+
+    def test_split_many(self):
+        inputs = [_resolve_path("iati-activities-passthrough.xml"), _resolve_path("no-such-file.xml")]
+        summaries = iatisplit.batch.split_many(inputs, 1, jobs=2, output_dir=self.output_directory)
+        self.assertEqual(3, summaries[0]["activities"])
+        self.assertEqual(2, summaries[0]["files"])
+        self.assertTrue("error" in summaries[1])
+        self.assertEqual(["iati-activities-passthrough.0001.xml", "iati-activities-passthrough.0002.xml"], sorted(os.listdir(self.output_directory)))
+
+    def test_stub_collision(self):
+        with self.assertRaises(ValueError):
+            iatisplit.batch.split_many(["a/x.xml", "b/x.xml"], 1)
+
+    def test_script(self):
+        status = main.main(["-n", "100", "-d", self.output_directory, "-j", "2", _resolve_path("iati-activities-*.xml")])
+        self.assertEqual(0, status)
+        self.assertEqual(["iati-activities-passthrough.0001.xml"], os.listdir(self.output_directory))
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
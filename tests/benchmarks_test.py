@@ -0,0 +1,86 @@
+#coding=UTF8
+"""Unit tests for the benchmarks package (synthetic corpora and baseline comparison)
+
+License: Public Domain
+"""
+
+import unittest
+import io, os, tempfile, shutil
+import iatisplit.split
+from benchmarks.corpus import generate, generate_file
+from benchmarks.run import compare
+from benchmarks.startup import compare_startup, import_timings, parse_importtime, DEFERRED_MODULES, STARTUP_MODULE
+
+
+class TestCorpus(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def test_deterministic(self):
+        first, second, other = io.BytesIO(), io.BytesIO(), io.BytesIO()
+        generate(first, activities=50, seed=1)
+        generate(second, activities=50, seed=1)
+        generate(other, activities=50, seed=2)
+        self.assertEqual(first.getvalue(), second.getvalue())
+        self.assertNotEqual(first.getvalue(), other.getvalue())
+
+    def test_split(self):
+        filename = os.path.join(self.output_directory, "corpus.xml")
+        size = generate_file(filename, activities=200, transactions=3, humanitarian_ratio=0.5)
+        self.assertEqual(os.path.getsize(filename), size)
+        summary = iatisplit.split.split(filename, 50, output_dir=self.output_directory, use_index=False)
+        self.assertEqual(200, summary["activities"])
+        self.assertEqual(4, summary["files"])
+        summary = iatisplit.split.split(filename, 50, output_dir=self.output_directory, humanitarian_only=True, use_index=False)
+        self.assertTrue(60 < summary["activities"] < 140)
+
+    def test_activity_size(self):
+        output = io.BytesIO()
+        generate(output, activities=10, activity_size=20000)
+        self.assertTrue(190000 < len(output.getvalue()) < 210000)
+
+
+class TestCompare(unittest.TestCase):
+
+    RESULT = {"mb_per_second": 10.0, "peak_rss_kb": 40000, "activities": 100, "files": 2, "output_bytes": 5000}
+
+    def test_compare(self):
+        baseline = {"results": {"a/all": dict(self.RESULT), "b/all": dict(self.RESULT)}}
+        results = {
+            "a/all": dict(self.RESULT, mb_per_second=9.0),
+            "b/all": dict(self.RESULT, mb_per_second=5.0, output_bytes=5001),
+            "c/all": dict(self.RESULT),
+        }
+        problems = compare(results, baseline, tolerance=0.2)
+        self.assertEqual(["b/all", "b/all"], [case for case, message in problems])
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_parse_importtime(self):
+        timings = parse_importtime(
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       228 |        228 |     iatisplit.version\n"
+            "import time:      4271 |      51570 | iatisplit.__main__\n"
+        )
+        self.assertEqual({"iatisplit.version": (228, 228), "iatisplit.__main__": (4271, 51570)}, timings)
+
+    def test_deferred(self):
+        """Starting the command doesn't import the modules for optional features."""
+        bare = import_timings("pass") # site packages may import some of them anyway
+        timings = import_timings("import {}".format(STARTUP_MODULE))
+        self.assertIn(STARTUP_MODULE, timings)
+        self.assertEqual([], [name for name in DEFERRED_MODULES if name in timings and name not in bare])
+
+    def test_compare(self):
+        startup = {"import_ms": 30.0, "deferred": []}
+        self.assertEqual([], compare_startup(startup, {"import_ms": 25.0}, 0.25))
+        self.assertEqual(1, len(compare_startup(startup, {"import_ms": 20.0}, 0.25)))
+        self.assertEqual(1, len(compare_startup(dict(startup, deferred=["requests"]), None, 0.25)))
+
+
+# end of module
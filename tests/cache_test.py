@@ -0,0 +1,89 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.cache module
+
+License: Public Domain
+"""
+
+import unittest
+import http.server, os, tempfile, shutil, threading
+import iatisplit.split
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Serve test files with an ETag, honouring If-None-Match."""
+
+    requests = []
+
+    def do_GET(self):
+        path = _resolve_path(os.path.basename(self.path))
+        with open(path, "rb") as f:
+            body = f.read()
+        etag = '"{}"'.format(len(body))
+        if self.headers.get("If-None-Match") == etag:
+            self.requests.append(304)
+            self.send_response(304)
+            self.end_headers()
+        else:
+            self.requests.append(200)
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+        self.cache_directory = tempfile.mkdtemp()
+        StandInHandler.requests = []
+        self.server = http.server.HTTPServer(("127.0.0.1", 0), StandInHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/iati-activities-passthrough.xml".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_directory)
+        shutil.rmtree(self.cache_directory)
+
+    def split(self, **kwargs):
+        return iatisplit.split.split(self.url, 100, output_dir=self.output_directory, cache_dir=self.cache_directory, **kwargs)
+
+    def test_revalidate_and_skip(self):
+        first = self.split()
+        self.assertEqual(3, first["activities"])
+        filename = os.path.join(self.output_directory, "iati-activities-passthrough.0001.xml")
+        mtime = os.stat(filename).st_mtime_ns
+
+        # unchanged input and options: skipped
+        second = self.split()
+        self.assertTrue(second["skipped"])
+        self.assertEqual(3, second["activities"])
+        self.assertEqual(mtime, os.stat(filename).st_mtime_ns)
+
+        # unchanged input, new options: split from the cached copy
+        third = self.split(humanitarian_only=True)
+        self.assertEqual(2, third["activities"])
+        self.assertFalse("skipped" in third)
+
+        self.assertEqual([200, 304, 304], StandInHandler.requests)
+
+    def test_missing_output(self):
+        """Redo the split if the output files have gone."""
+        self.split()
+        os.remove(os.path.join(self.output_directory, "iati-activities-passthrough.0001.xml"))
+        self.assertFalse("skipped" in self.split())
+        self.assertTrue(os.path.exists(os.path.join(self.output_directory, "iati-activities-passthrough.0001.xml")))
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
@@ -0,0 +1,175 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.checkpoint module (checkpointed and resumed splits)
+
+License: Public Domain
+"""
+
+import unittest
+import gzip, os, tempfile, shutil
+import iatisplit.split
+from benchmarks.corpus import generate_file
+from iatisplit.checkpoint import make_checkpoint_filename
+from iatisplit.dedup import Deduplicator
+from iatisplit.stats import Stats
+from tests.range_server import RangeServer
+
+
+class Interrupted(Exception):
+    pass
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.input_directory = tempfile.mkdtemp()
+        self.output_directory = tempfile.mkdtemp()
+        self.expected_directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.input_directory, "corpus.xml")
+        generate_file(self.filename, activities=300, transactions=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.input_directory)
+        shutil.rmtree(self.output_directory)
+        shutil.rmtree(self.expected_directory)
+
+    def interrupt(self, file_or_url, after, **kwargs):
+        """Start a checkpointed split, and stop it with an exception after some activities."""
+        def callback(stats):
+            if stats.seen >= after:
+                raise Interrupted()
+        with self.assertRaises(Interrupted):
+            iatisplit.split.split(
+                file_or_url, 40, output_dir=self.output_directory, output_stub="out", checkpoint=True, checkpoint_interval=20000,
+                stats=Stats(callback, interval=1), **kwargs
+            )
+        self.assertTrue(os.path.exists(make_checkpoint_filename(self.output_directory, "out")))
+
+    def resume(self, file_or_url, **kwargs):
+        return iatisplit.split.split(
+            file_or_url, 40, output_dir=self.output_directory, output_stub="out", resume=True, checkpoint_interval=20000, **kwargs
+        )
+
+    def assertSameOutput(self, compression=None):
+        iatisplit.split.split(self.filename, 40, output_dir=self.expected_directory, output_stub="out", compression=compression, flatten=True)
+        expected = sorted(os.listdir(self.expected_directory))
+        self.assertEqual(expected, sorted(os.listdir(self.output_directory)))
+        for name in expected:
+            with open(os.path.join(self.expected_directory, name), "rb") as f:
+                expected_data = f.read()
+            with open(os.path.join(self.output_directory, name), "rb") as f:
+                data = f.read()
+            if compression == "gzip":
+                # each checkpoint starts a new gzip member, so compare the content
+                expected_data, data = gzip.decompress(expected_data), gzip.decompress(data)
+            self.assertEqual(expected_data, data, name)
+
+    def test_resume(self):
+        for compression in (None, "gzip",):
+            self.interrupt(self.filename, 230, compression=compression, flatten=True)
+            first = make_output_name("out.0001.xml", compression)
+            stat = os.stat(os.path.join(self.output_directory, first))
+            summary = self.resume(self.filename, compression=compression, flatten=True)
+            self.assertGreater(summary["resumed_at"], 0)
+            self.assertEqual(300, summary["activities"])
+            self.assertFalse(os.path.exists(make_checkpoint_filename(self.output_directory, "out")))
+            # the finished documents weren't rewritten
+            self.assertEqual(stat.st_mtime_ns, os.stat(os.path.join(self.output_directory, first)).st_mtime_ns)
+            self.assertSameOutput(compression)
+            shutil.rmtree(self.output_directory)
+            shutil.rmtree(self.expected_directory)
+            os.mkdir(self.output_directory)
+            os.mkdir(self.expected_directory)
+
+    def test_resume_doctype(self):
+        """A resumed split parses the rest of the input with its document type declaration in front."""
+        with open(self.filename, "rb") as f:
+            data = f.read()
+        data = data.replace(b"<iati-activities", b'<!DOCTYPE iati-activities [<!ENTITY partners "partners">]>\n<iati-activities', 1)
+        with open(self.filename, "wb") as f:
+            f.write(data.replace(b"&amp; partners<", b"&amp; &partners;<"))
+        self.interrupt(self.filename, 230, flatten=True)
+        summary = self.resume(self.filename, flatten=True)
+        self.assertGreater(summary["resumed_at"], 0)
+        self.assertEqual(300, summary["activities"])
+        self.assertSameOutput()
+
+    def test_resume_url(self):
+        for ranges in (True, False,):
+            with RangeServer(self.input_directory, ranges) as server:
+                url = server.url("corpus.xml")
+                self.interrupt(url, 150, flatten=True)
+                del server.requests[:]
+                summary = self.resume(url, flatten=True)
+                self.assertEqual(300, summary["activities"])
+                range_requests = [request for request in server.requests if request[0] == "GET" and request[2]]
+                self.assertEqual(1, len(range_requests))
+                self.assertEqual("bytes={}-".format(summary["resumed_at"]), range_requests[0][2])
+            self.assertSameOutput()
+            shutil.rmtree(self.output_directory)
+            shutil.rmtree(self.expected_directory)
+            os.mkdir(self.output_directory)
+            os.mkdir(self.expected_directory)
+
+    def test_resume_url_encoded(self):
+        """Ranges are requested without content encoding, and a resume from an encoded range is refused."""
+        with RangeServer(self.input_directory, content_encoding="gzip") as server:
+            url = server.url("corpus.xml")
+            self.interrupt(url, 150, flatten=True)
+            del server.requests[:]
+            del server.accept_encodings[:]
+            summary = self.resume(url, flatten=True)
+            self.assertEqual(300, summary["activities"])
+            self.assertEqual(["identity"] * 2, [
+                accept_encoding for request, accept_encoding in zip(server.requests, server.accept_encodings) if request[0] == "HEAD" or request[2]
+            ])
+        self.assertSameOutput()
+        with RangeServer(self.input_directory, content_encoding="gzip", ignore_accept_encoding=True) as server:
+            url = server.url("corpus.xml")
+            shutil.rmtree(self.output_directory)
+            os.mkdir(self.output_directory)
+            self.interrupt(url, 150, flatten=True)
+            with self.assertRaises(ValueError):
+                self.resume(url, flatten=True)
+
+    def test_resume_filtered(self):
+        """Checkpoints are saved while activities are rejected, so a resume doesn't re-scan them."""
+        filters = ["iati-identifier ~ -0000029[0-9]$"]
+        self.interrupt(self.filename, 1, filters=filters)
+        summary = self.resume(self.filename, filters=filters)
+        self.assertEqual(10, summary["activities"])
+        self.assertGreater(summary["resumed_at"], os.path.getsize(self.filename) * 0.9)
+        iatisplit.split.split(self.filename, 40, output_dir=self.expected_directory, output_stub="out", filters=filters)
+        self.assertEqual(sorted(os.listdir(self.expected_directory)), sorted(os.listdir(self.output_directory)))
+        for name in os.listdir(self.expected_directory):
+            with open(os.path.join(self.expected_directory, name), "rb") as f, open(os.path.join(self.output_directory, name), "rb") as g:
+                self.assertEqual(f.read(), g.read())
+
+    def test_changed_input(self):
+        self.interrupt(self.filename, 150, flatten=True)
+        os.utime(self.filename, ns=(0, 0))
+        summary = self.resume(self.filename, flatten=True)
+        self.assertNotIn("resumed_at", summary)
+        self.assertEqual(300, summary["activities"])
+        self.assertSameOutput()
+
+    def test_changed_options(self):
+        self.interrupt(self.filename, 150)
+        summary = self.resume(self.filename, humanitarian_only=True)
+        self.assertNotIn("resumed_at", summary)
+
+    def test_unsupported(self):
+        dedup = Deduplicator()
+        try:
+            with self.assertRaises(ValueError):
+                iatisplit.split.split(self.filename, 40, output_dir=self.output_directory, checkpoint=True, dedup=dedup)
+        finally:
+            dedup.close()
+        with self.assertRaises(ValueError):
+            iatisplit.split.split(self.filename, 40, output_dir=self.output_directory, resume=True, partition_by="start-year")
+
+
+def make_output_name(name, compression):
+    return name + ".gz" if compression == "gzip" else name
+
+
+# end of module
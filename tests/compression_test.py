@@ -0,0 +1,64 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.compression module
+
+License: Public Domain
+"""
+
+import unittest
+import bz2, gzip, io, lzma, os, tempfile, shutil
+import iatisplit.compression, iatisplit.split
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+        with open(_resolve_path("iati-activities-passthrough.xml"), "rb") as f:
+            self.original = f.read()
+        iatisplit.split.split(_resolve_path("iati-activities-passthrough.xml"), 100, output_dir=self.output_directory, output_stub="plain")
+        with open(os.path.join(self.output_directory, "plain.0001.xml"), "rb") as f:
+            self.expected = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def test_detect_compression(self):
+        self.assertEqual("gzip", iatisplit.compression.detect_compression("http://example.org/x.xml.gz?y=z"))
+        self.assertEqual("xz", iatisplit.compression.detect_compression("x.XML.XZ"))
+        self.assertEqual("bz2", iatisplit.compression.detect_compression("x", b"BZh91AY"))
+        self.assertIsNone(iatisplit.compression.detect_compression("x.xml", b"<?xml"))
+
+    def test_compressed_input(self):
+        for name, compress in (("in.xml.gz", gzip.compress), ("in.xml.xz", lzma.compress), ("in-no-extension", bz2.compress)):
+            path = os.path.join(self.output_directory, name)
+            with open(path, "wb") as f:
+                f.write(compress(self.original))
+            iatisplit.split.split(path, 100, output_dir=self.output_directory, output_stub="out")
+            with open(os.path.join(self.output_directory, "out.0001.xml"), "rb") as f:
+                self.assertEqual(self.expected, f.read())
+
+    def test_compressed_output(self):
+        for compression, decompress in (("gzip", gzip.decompress), ("xz", lzma.decompress), ("bz2", bz2.decompress)):
+            iatisplit.split.split(_resolve_path("iati-activities-passthrough.xml"), 100, output_dir=self.output_directory, output_stub="out", compression=compression, compression_level=1)
+            filename = iatisplit.split.make_filename(self.output_directory, "out", 1, compression)
+            with open(filename, "rb") as f:
+                self.assertEqual(self.expected, decompress(f.read()))
+
+    def test_large_output(self):
+        """Data larger than a batch goes through the background thread intact."""
+        output = io.BytesIO()
+        output.close = lambda: None
+        writer = iatisplit.compression.CompressingWriter(output, "gzip")
+        data = os.urandom(1000) * 5000
+        for i in range(0, len(data), 7919):
+            writer.write(data[i:i+7919])
+        writer.close()
+        self.assertEqual(data, gzip.decompress(output.getvalue()))
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
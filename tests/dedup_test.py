@@ -0,0 +1,106 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.dedup module
+
+License: Public Domain
+"""
+
+import unittest
+import gzip, os, tempfile, shutil
+import iatisplit.__main__ as main, iatisplit.dedup, iatisplit.split
+
+
+class TestDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+        with open(_resolve_path("iati-activities-passthrough.xml"), "rb") as f:
+            original = f.read()
+        # a second copy where XM-EXAMPLE-0002 is newer and XM-EXAMPLE-0003 is older
+        self.inputs = [os.path.join(self.output_directory, name) for name in ("a.xml", "b.xml")]
+        with open(self.inputs[0], "wb") as f:
+            f.write(original)
+        with open(self.inputs[1], "wb") as f:
+            f.write(original.replace(b"2019-01-02T00:00:00Z", b"2019-02-01T00:00:00Z").replace(b"2019-01-03T00:00:00Z", b"2018-01-01T00:00:00Z"))
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def read(self, name):
+        with open(os.path.join(self.output_directory, name), "rb") as f:
+            return f.read()
+
+    def test_bloom_filter(self):
+        bloom = iatisplit.dedup.BloomFilter(1024, 3)
+        bloom.add("XM-EXAMPLE-0001")
+        self.assertTrue("XM-EXAMPLE-0001" in bloom)
+        self.assertFalse("XM-EXAMPLE-0002" in bloom)
+
+    def test_remove_ranges(self):
+        """Ranges are cut out of a file bigger than one read, plain or compressed."""
+        data = bytes(range(256)) * 0x4000
+        ranges = [(10, 5), (iatisplit.dedup.READ_SIZE - 3, 10), (2 * iatisplit.dedup.READ_SIZE + 7, iatisplit.dedup.READ_SIZE)]
+        expected = data[:10] + data[15:ranges[1][0]] + data[ranges[1][0] + 10:ranges[2][0]] + data[ranges[2][0] + iatisplit.dedup.READ_SIZE:]
+        for name, opener in (("out.xml", open), ("out.xml.gz", gzip.open),):
+            filename = os.path.join(self.output_directory, name)
+            with opener(filename, "wb") as f:
+                f.write(data)
+            iatisplit.dedup._remove_ranges(filename, ranges)
+            with opener(filename, "rb") as f:
+                self.assertEqual(expected, f.read())
+
+    def test_keep_newest(self):
+        status = main.main(["-q", "-n", "100", "-D", "-z", "gzip", "-d", self.output_directory] + self.inputs)
+        self.assertEqual(0, status)
+        a = gzip.decompress(self.read("a.0001.xml.gz"))
+        b = gzip.decompress(self.read("b.0001.xml.gz"))
+        self.assertTrue(b"XM-EXAMPLE-0001" in a and b"XM-EXAMPLE-0003" in a)
+        self.assertFalse(b"XM-EXAMPLE-0002" in a)
+        self.assertTrue(a.endswith(b"</iati-activity>\n</iati-activities>\n"))
+        self.assertTrue(b"2019-02-01T00:00:00Z" in b)
+        self.assertFalse(b"XM-EXAMPLE-0001" in b or b"XM-EXAMPLE-0003" in b)
+
+    def test_rewrite(self):
+        """A rewritten file keeps the compression level, and the offsets of the activities left in it are updated."""
+        dedup = iatisplit.dedup.Deduplicator(compression_level=1)
+        try:
+            for input in self.inputs:
+                iatisplit.split.split(input, 100, output_dir=self.output_directory, compression="gzip", compression_level=1, dedup=dedup)
+            self.assertEqual([os.path.join(self.output_directory, "a.0001.xml.gz")], dedup.finish())
+            data = self.read("a.0001.xml.gz")
+            self.assertEqual(4, data[8]) # the gzip header flag for the fastest level
+            content = gzip.decompress(data)
+            rows = dedup.connection.execute("select identifier, offset, length from seen where filename like '%a.0001.xml.gz'").fetchall()
+            self.assertEqual(["XM-EXAMPLE-0001", "XM-EXAMPLE-0003"], sorted(row[0] for row in rows))
+            for identifier, offset, length in rows:
+                activity = content[offset:offset + length]
+                self.assertTrue(activity.lstrip().startswith(b"<iati-activity"))
+                self.assertTrue(identifier.encode("ascii") in activity)
+        finally:
+            dedup.close()
+
+    def test_within_one_input(self):
+        dedup = iatisplit.dedup.Deduplicator(bloom_bits=64)
+        try:
+            for n in (1, 2):
+                summary = iatisplit.split.split(self.inputs[0], 100, output_dir=self.output_directory, output_stub="out{}".format(n), dedup=dedup)
+            self.assertEqual(0, summary["activities"])
+            self.assertEqual(3, dedup.duplicates)
+            self.assertEqual([], dedup.finish())
+        finally:
+            dedup.close()
+
+    def test_incremental(self):
+        dedup = iatisplit.dedup.Deduplicator()
+        try:
+            with self.assertRaises(ValueError):
+                iatisplit.split.split(self.inputs[0], 100, output_dir=self.output_directory, incremental=True, dedup=dedup)
+        finally:
+            dedup.close()
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
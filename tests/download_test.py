@@ -0,0 +1,77 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.download module
+
+License: Public Domain
+"""
+
+import unittest
+import os, tempfile, shutil
+import iatisplit.download, iatisplit.split
+from benchmarks.corpus import generate_file
+from tests.range_server import RangeServer
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.input_directory = tempfile.mkdtemp()
+        self.output_directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.input_directory, "corpus.xml")
+        generate_file(self.filename, activities=100, transactions=3)
+        with open(self.filename, "rb") as f:
+            self.data = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.input_directory)
+        shutil.rmtree(self.output_directory)
+
+    def test_segments(self):
+        with RangeServer(self.input_directory) as server:
+            input = iatisplit.download.open_url(server.url("corpus.xml"), connections=3, segment_size=10000)
+            self.assertIsInstance(input, iatisplit.download.SegmentedDownload)
+            chunks = []
+            while True:
+                self.assertLessEqual(len(input.pending), input.window)
+                data = input.read(7919)
+                if not data:
+                    break
+                chunks.append(data)
+            input.close()
+        self.assertEqual(self.data, b"".join(chunks))
+        self.assertEqual("HEAD", server.requests[0][0])
+        ranges = sorted(int(request[2][6:].split("-")[0]) for request in server.requests if request[0] == "GET")
+        self.assertEqual(list(range(0, len(self.data), 10000)), ranges)
+
+    def test_fallback(self):
+        with RangeServer(self.input_directory, ranges=False) as server:
+            input = iatisplit.download.open_url(server.url("corpus.xml"), connections=3, segment_size=10000)
+            self.assertNotIsInstance(input, iatisplit.download.SegmentedDownload)
+            data = input.read()
+            input.close()
+        self.assertEqual(self.data, data)
+        self.assertEqual([("HEAD", "/corpus.xml", None), ("GET", "/corpus.xml", None)], server.requests)
+
+    def test_changed(self):
+        """A file that changes partway through the download is an error, not a mix of versions."""
+        with RangeServer(self.input_directory) as server:
+            input = iatisplit.download.open_url(server.url("corpus.xml"), connections=2, segment_size=1000)
+            input.read(1000)
+            os.utime(self.filename, ns=(0, 0))
+            with self.assertRaises(IOError):
+                while input.read(1000):
+                    pass
+            input.close()
+
+    def test_split(self):
+        expected = iatisplit.split.split(self.filename, 30, output_dir=self.output_directory, output_stub="expected")
+        with RangeServer(self.input_directory) as server:
+            summary = iatisplit.split.split(server.url("corpus.xml"), 30, output_dir=self.output_directory, output_stub="out", connections=4)
+        self.assertEqual(expected["files"], summary["files"])
+        for n in range(1, summary["files"] + 1):
+            with open(iatisplit.split.make_filename(self.output_directory, "expected", n), "rb") as f:
+                expected_data = f.read()
+            with open(iatisplit.split.make_filename(self.output_directory, "out", n), "rb") as f:
+                self.assertEqual(expected_data, f.read())
+
+
+# end of module
@@ -0,0 +1,59 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.expressions module
+
+License: Public Domain
+"""
+
+import unittest
+import iatisplit.expressions
+
+
+class TestExpressions(unittest.TestCase):
+
+    def evaluate(self, text, values):
+        return iatisplit.expressions.compile_expression(text).evaluate(values)
+
+    def test_parse_path(self):
+        self.assertEqual((("reporting-org",), "ref"), iatisplit.expressions.parse_path("reporting-org/@ref"))
+        self.assertEqual(((), "humanitarian"), iatisplit.expressions.parse_path("@humanitarian"))
+        self.assertEqual((("title", "narrative"), None), iatisplit.expressions.parse_path("title/narrative"))
+        with self.assertRaises(ValueError):
+            iatisplit.expressions.parse_path("title//narrative")
+
+    def test_paths(self):
+        expression = iatisplit.expressions.compile_expression("(@humanitarian = 1 or sector/@code) and not budget/value > 10")
+        self.assertEqual({"@humanitarian", "sector/@code", "budget/value"}, expression.paths)
+
+    def test_compare(self):
+        values = {"reporting-org/@ref": ["XM-DAC-41114"], "budget/value": ["500", "2000"]}
+        self.assertTrue(self.evaluate("reporting-org/@ref = XM-DAC-41114", values))
+        self.assertTrue(self.evaluate("reporting-org/@ref != 'XM-DAC-1'", values))
+        self.assertTrue(self.evaluate("reporting-org/@ref ~ ^XM-DAC", values))
+        # any value matches, and numbers compare numerically
+        self.assertTrue(self.evaluate("budget/value >= 1000", values))
+        self.assertFalse(self.evaluate("budget/value > 2000", values))
+        # missing paths never match
+        self.assertFalse(self.evaluate("sector/@code = 1", values))
+
+    def test_in(self):
+        values = {"recipient-country/@code": ["SO"]}
+        self.assertTrue(self.evaluate("recipient-country/@code in (AF, SO)", values))
+        self.assertFalse(self.evaluate("recipient-country/@code in (\"AF\")", values))
+
+    def test_boolean(self):
+        values = {"@humanitarian": ["1"]}
+        self.assertTrue(self.evaluate("@humanitarian and not sector", values))
+        self.assertTrue(self.evaluate("sector or @humanitarian = 1", values))
+        self.assertFalse(self.evaluate("not (sector or @humanitarian = 1)", values))
+
+    def test_errors(self):
+        for text in ("", "@humanitarian =", "(sector", "sector in AF", "a = 1 b"):
+            with self.assertRaises(ValueError):
+                iatisplit.expressions.compile_expression(text)
+
+    def test_bad_pattern(self):
+        with self.assertRaisesRegex(ValueError, r"Bad regular expression '\(' at position 0: missing \), unterminated subpattern"):
+            iatisplit.expressions.compile_expression('title/narrative ~ "("')
+
+
+# end of module
@@ -0,0 +1,60 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.filters module
+
+License: Public Domain
+"""
+
+import unittest
+import os
+import iatisplit.filters, iatisplit.scanner
+
+
+class TestFilterPlan(unittest.TestCase):
+
+    def records(self, plan):
+        with open(_resolve_path("iati-activities-passthrough.xml"), "rb") as f:
+            return [activity.record for activity in iatisplit.scanner.ActivityScanner(f, fields=plan.fields, paths=plan.paths)]
+
+    def test_no_filters(self):
+        plan = iatisplit.filters.compile_filters()
+        self.assertEqual([], plan.stages)
+        self.assertEqual({"identifier"}, plan.fields)
+        records = self.records(plan)
+        # fields that no filter needs are not extracted
+        self.assertEqual({}, records[0].activity_dates)
+        self.assertEqual([], records[0].transactions)
+        self.assertEqual([True, True, False, True], [plan(record) for record in records])
+        self.assertEqual({"identifier": 1}, plan.rejections)
+
+    def test_stage_order(self):
+        plan = iatisplit.filters.compile_filters(
+            transaction_type="2", start_date="2017-01-01", humanitarian_only=True
+        )
+        # the humanitarian expression looks inside transactions, so it costs more than the dates
+        self.assertEqual(["activity-dates", "humanitarian", "transactions"], [stage.name for stage in plan.stages])
+
+    def test_expressions(self):
+        plan = iatisplit.filters.compile_filters(expressions=["@humanitarian = 1", "transaction/transaction-type/@code in (2, 3)"])
+        self.assertEqual(["@humanitarian = 1", "transaction/transaction-type/@code in (2, 3)"], [stage.name for stage in plan.stages])
+        self.assertEqual({"@humanitarian", "transaction/transaction-type/@code"}, plan.paths)
+        self.assertEqual([True, False, False, False], [plan(record) for record in self.records(plan)])
+        self.assertEqual(2, plan.rejections["@humanitarian = 1"])
+
+    def test_bad_expression(self):
+        with self.assertRaises(ValueError):
+            iatisplit.filters.compile_filters(expressions=["reporting-org/@ref ="])
+
+    def test_rejection_counts(self):
+        plan = iatisplit.filters.compile_filters(humanitarian_only=True, transaction_type="2")
+        self.assertEqual([False, True, False, False], [plan(record) for record in self.records(plan)])
+        self.assertEqual({"identifier": 1, "humanitarian": 1, "transactions": 1}, plan.rejections)
+        self.assertEqual(4, plan.seen)
+        self.assertEqual(1, plan.kept)
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
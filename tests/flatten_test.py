@@ -0,0 +1,66 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.flatten module
+
+License: Public Domain
+"""
+
+import unittest
+import csv, gzip, json, os, tempfile, shutil
+import iatisplit.__main__ as main, iatisplit.split
+
+
+class TestFlatten(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def test_flatten(self):
+        summary = iatisplit.split.split(_resolve_path("iati-activities-passthrough.xml"), 1, output_dir=self.output_directory, output_stub="out", flatten=True)
+        self.assertEqual(2, summary["files"])
+        self.assertEqual([
+            "out.0001.jsonl", "out.0001.transactions.csv", "out.0001.xml",
+            "out.0002.jsonl", "out.0002.transactions.csv", "out.0002.xml",
+        ], sorted(os.listdir(self.output_directory)))
+
+        # same chunk boundaries as the XML
+        with open(os.path.join(self.output_directory, "out.0001.jsonl"), "r", encoding="utf-8") as f:
+            summaries = [json.loads(line) for line in f]
+        self.assertEqual(["XM-EXAMPLE-0001", "XM-EXAMPLE-0002"], [s["iati-identifier"] for s in summaries])
+        self.assertEqual({
+            "iati-identifier": "XM-EXAMPLE-0001",
+            "last-updated-datetime": "2019-01-01T00:00:00Z",
+            "default-currency": "USD",
+            "humanitarian": True,
+            "activity-dates": {"end-planned": "2018-12-31", "start-planned": "2018-01-01"},
+            "transactions": 1,
+        }, summaries[0])
+
+        # XM-EXAMPLE-0002 has neither a value currency nor a default currency
+        with open(os.path.join(self.output_directory, "out.0001.transactions.csv"), "r", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual([
+            ["iati-identifier", "transaction-type", "transaction-date", "value", "currency"],
+            ["XM-EXAMPLE-0001", "3", "2018-03-01", "1000", "EUR"],
+            ["XM-EXAMPLE-0002", "2", "2019-02-01", "500", ""],
+        ], rows)
+        with open(os.path.join(self.output_directory, "out.0002.transactions.csv"), "r", encoding="utf-8") as f:
+            self.assertEqual(1, len(list(csv.reader(f))))
+
+    def test_partitioned_and_compressed(self):
+        status = main.main(["-q", "-n", "100", "-F", "-z", "gzip", "-P", "start-year", "--max-open-files", "1", "-d", self.output_directory, "-o", "out", _resolve_path("iati-activities-passthrough.xml")])
+        self.assertEqual(0, status)
+        with gzip.open(os.path.join(self.output_directory, "2018", "out.0001.transactions.csv.gz"), "rt", encoding="utf-8") as f:
+            self.assertEqual(2, len(list(csv.reader(f))))
+        with gzip.open(os.path.join(self.output_directory, "2015", "out.0001.jsonl.gz"), "rt", encoding="utf-8") as f:
+            self.assertEqual("XM-EXAMPLE-0003", json.loads(f.readline())["iati-identifier"])
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
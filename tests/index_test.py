@@ -0,0 +1,108 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.index module
+
+License: Public Domain
+"""
+
+import unittest, unittest.mock
+import os, tempfile, shutil, sqlite3
+import iatisplit.index, iatisplit.split
+import iatisplit.__main__ as main
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+        self.input = os.path.join(self.output_directory, "input.xml")
+        shutil.copyfile(_resolve_path("iati-activities-passthrough.xml"), self.input)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def split(self, name, use_index=True, **kwargs):
+        output_dir = os.path.join(self.output_directory, name)
+        os.mkdir(output_dir)
+        iatisplit.split.split(self.input, 1, output_dir=output_dir, output_stub="out", use_index=use_index, **kwargs)
+        result = {}
+        for filename in sorted(os.listdir(output_dir)):
+            with open(os.path.join(output_dir, filename), "rb") as f:
+                result[filename] = f.read()
+        return result
+
+    def test_build(self):
+        self.assertEqual(0, main.main(["index", "-q", "-p", "reporting-org/@ref", self.input]))
+        index = iatisplit.index.load_index(self.input)
+        self.assertIsNotNone(index)
+        self.assertEqual(iatisplit.index.DEFAULT_PATHS | {"reporting-org/@ref"}, index.paths)
+        self.assertTrue(index.root_tag.startswith(b"<iati-activities version=\"2.03\""))
+        index.close()
+
+    def test_same_as_parsing(self):
+        """Splits from the index must match splits from parsing exactly."""
+        iatisplit.index.build_index(self.input)
+        for n, options in enumerate((
+                {},
+                {"humanitarian_only": True},
+                {"start_date": "2017-01-01", "transaction_type": "2"},
+        )):
+            self.assertEqual(self.split("parsed{}".format(n), False, **options), self.split("indexed{}".format(n), **options))
+
+    def test_uncovered_paths(self):
+        """Expressions on paths that aren't in the index fall back to parsing."""
+        iatisplit.index.build_index(self.input)
+        index = iatisplit.index.load_index(self.input)
+        plan = iatisplit.filters.compile_filters(expressions=["title/narrative ~ Water"])
+        self.assertFalse(index.covers(plan))
+        index.close()
+        self.assertEqual(1, len(self.split("filtered", filters=["title/narrative ~ Water"])))
+
+    def test_invalidated(self):
+        iatisplit.index.build_index(self.input)
+        with open(self.input, "ab") as f:
+            f.write(b"\n")
+        self.assertIsNone(iatisplit.index.load_index(self.input))
+
+    def test_unreadable(self):
+        """A corrupt or old-format index is closed and ignored, and the split falls back to parsing."""
+        expected = self.split("parsed", False)
+        index_filename = iatisplit.index.make_index_filename(self.input)
+        for n, (schema, data) in enumerate((
+                (None, b"not an sqlite database" * 100),
+                ("create table activities (offset integer);", None),
+                ("create table source (version integer); insert into source values (1);", None),
+        )):
+            if os.path.exists(index_filename):
+                os.remove(index_filename)
+            if data is not None:
+                with open(index_filename, "wb") as f:
+                    f.write(data)
+            else:
+                connection = sqlite3.connect(index_filename)
+                connection.executescript(schema)
+                connection.close()
+            connections = []
+            def connect(*args, _connect=sqlite3.connect, **kwargs):
+                connections.append(_connect(*args, **kwargs))
+                return connections[-1]
+            with unittest.mock.patch("sqlite3.connect", connect), self.assertLogs("iatisplit.index", "WARNING"):
+                self.assertIsNone(iatisplit.index.load_index(self.input))
+            self.assertEqual(1, len(connections))
+            with self.assertRaises(sqlite3.ProgrammingError):
+                connections[0].execute("select 1")
+            self.assertEqual(expected, self.split("fallback{}".format(n)))
+
+    def test_compressed(self):
+        compressed = os.path.join(self.output_directory, "input.xml.gz")
+        with open(compressed, "wb") as f:
+            f.write(b"\x1f\x8b\x08\x00")
+        with self.assertRaises(ValueError):
+            iatisplit.index.build_index(compressed)
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
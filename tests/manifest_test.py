@@ -0,0 +1,73 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.manifest module
+
+License: Public Domain
+"""
+
+import unittest
+import os, tempfile, shutil
+import iatisplit.split
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+        self.input = os.path.join(self.output_directory, "input.xml")
+        with open(_resolve_path("iati-activities-passthrough.xml"), "rb") as f:
+            self.original = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def split(self, data):
+        with open(self.input, "wb") as f:
+            f.write(data)
+        return iatisplit.split.split(self.input, 0, output_dir=self.output_directory, output_stub="out", incremental=True)
+
+    def mtimes(self):
+        return {name: os.stat(os.path.join(self.output_directory, name)).st_mtime_ns for name in os.listdir(self.output_directory) if name.startswith("out.0")}
+
+    def test_unchanged(self):
+        summary = self.split(self.original)
+        self.assertEqual(3, len(summary["changed"]))
+        before = self.mtimes()
+        # a new generated-datetime doesn't count as a change
+        summary = self.split(self.original.replace(b"2019-01-04T00:00:00Z", b"2019-01-05T00:00:00Z"))
+        self.assertEqual([], summary["changed"])
+        self.assertEqual(before, self.mtimes())
+        self.assertFalse([name for name in os.listdir(self.output_directory) if name.endswith(".tmp")])
+
+    def test_changed_root(self):
+        """A change to the root start tag (other than generated-datetime) counts, even if the activities are the same."""
+        self.split(self.original)
+        summary = self.split(self.original.replace(b"version=\"2.03\"", b"version=\"2.02\""))
+        self.assertEqual(3, len(summary["changed"]))
+        with open(os.path.join(self.output_directory, "out.0001.xml"), "rb") as f:
+            self.assertTrue(b"version=\"2.02\"" in f.read())
+
+    def test_changed_activity(self):
+        self.split(self.original)
+        before = self.mtimes()
+        summary = self.split(self.original.replace(b"2019-02-01", b"2019-02-02"))
+        self.assertEqual([os.path.join(self.output_directory, "out.0002.xml")], summary["changed"])
+        after = self.mtimes()
+        self.assertEqual(before["out.0001.xml"], after["out.0001.xml"])
+        self.assertEqual(before["out.0003.xml"], after["out.0003.xml"])
+
+    def test_removed_activity(self):
+        self.split(self.original)
+        start = self.original.index(b"  <iati-activity last-updated-datetime=\"2019-01-03")
+        end = self.original.index(b"</iati-activities>")
+        summary = self.split(self.original[:start] + self.original[end:])
+        self.assertEqual([], summary["changed"])
+        self.assertEqual([os.path.join(self.output_directory, "out.0003.xml")], summary["removed"])
+        self.assertFalse(os.path.exists(os.path.join(self.output_directory, "out.0003.xml")))
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
@@ -0,0 +1,133 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.merge module
+
+License: Public Domain
+"""
+
+import unittest
+import os, tempfile, shutil, xml.dom.minidom
+import iatisplit.__main__ as main, iatisplit.merge
+from benchmarks.corpus import generate_file
+from iatisplit.dedup import Deduplicator
+from iatisplit.split import make_filename
+
+
+class TestMerge(unittest.TestCase):
+
+    def setUp(self):
+        self.input_directory = tempfile.mkdtemp()
+        self.output_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.input_directory)
+        shutil.rmtree(self.output_directory)
+
+    def make_inputs(self, sizes, version="2.03"):
+        inputs = []
+        for size in sizes:
+            filename = os.path.join(self.input_directory, "input-{}.xml".format(len(os.listdir(self.input_directory))))
+            generate_file(filename, activities=size, transactions=1, seed=len(inputs), version=version)
+            inputs.append(filename)
+        return inputs
+
+    def read_output(self, stub, n):
+        return xml.dom.minidom.parse(make_filename(self.output_directory, stub, n)).documentElement
+
+    def test_even_chunks(self):
+        inputs = self.make_inputs([3, 1, 7, 2, 5, 1, 4])
+        summary = iatisplit.merge.merge(inputs, 5, output_dir=self.output_directory)
+        self.assertEqual(23, summary["activities"])
+        self.assertEqual({}, summary["errors"])
+        self.assertEqual(["2.03"], list(summary["groups"]))
+        counts = [len(self.read_output("merged", n).getElementsByTagName("iati-activity")) for n in range(1, summary["files"] + 1)]
+        # the same counts as a split: ChunkWriter starts a new document after max + 1 activities
+        self.assertEqual([6, 6, 6, 5], counts)
+        self.assertEqual("2.03", self.read_output("merged", 1).getAttribute("version"))
+
+    def test_versions(self):
+        inputs = self.make_inputs([2, 3], "2.03") + self.make_inputs([4], "1.05") + self.make_inputs([1], "2.03")
+        summary = iatisplit.merge.merge(inputs, 10, output_dir=self.output_directory, output_stub="out")
+        self.assertEqual({
+            "2.03": {"stub": "out-2.03", "inputs": 3, "activities": 6, "files": 1},
+            "1.05": {"stub": "out-1.05", "inputs": 1, "activities": 4, "files": 1},
+        }, summary["groups"])
+        self.assertEqual("1.05", self.read_output("out-1.05", 1).getAttribute("version"))
+        self.assertEqual(6, len(self.read_output("out-2.03", 1).getElementsByTagName("iati-activity")))
+
+    def test_root_attributes(self):
+        roots = (
+            b'<iati-activities version="2.03" generated-datetime="2020-01-01T00:00:00Z" xmlns:x="http://example.org/x" linked-data-default="http://a">',
+            b"<iati-activities version='2.03' generated-datetime='2021-06-01T00:00:00Z' xmlns:y=\"http://example.org/y\">",
+            b'<iati-activities version="2.03" xmlns:x="http://example.org/other">',
+        )
+        inputs = []
+        for n, root in enumerate(roots):
+            inputs.append(os.path.join(self.input_directory, "input-{}.xml".format(n)))
+            with open(inputs[-1], "wb") as f:
+                f.write(root + b'<iati-activity><iati-identifier>A' + str(n).encode() + b'</iati-identifier></iati-activity></iati-activities>')
+        summary = iatisplit.merge.merge(inputs, 10, output_dir=self.output_directory)
+        self.assertEqual(["2.03", "2.03-2"], list(summary["groups"]))
+        with open(make_filename(self.output_directory, "merged-2.03", 1), "rb") as f:
+            self.assertIn(
+                b"<iati-activities version=\"2.03\" generated-datetime='2021-06-01T00:00:00Z' xmlns:x=\"http://example.org/x\" xmlns:y=\"http://example.org/y\">",
+                f.read()
+            )
+        self.assertEqual("http://example.org/other", self.read_output("merged-2.03-2", 1).getAttribute("xmlns:x"))
+
+    def test_filters_and_dedup(self):
+        inputs = self.make_inputs([20]) * 2
+        dedup = Deduplicator()
+        try:
+            summary = iatisplit.merge.merge(inputs, 8, output_dir=self.output_directory, humanitarian_only=True, dedup=dedup)
+            dedup.finish()
+        finally:
+            dedup.close()
+        rejected = sum(summary["rejected"].values())
+        self.assertGreater(rejected, 0)
+        counts = [len(self.read_output("merged", n).getElementsByTagName("iati-activity")) for n in range(1, summary["files"] + 1)]
+        self.assertEqual(20 - rejected // 2, sum(counts))
+
+    def test_errors(self):
+        inputs = self.make_inputs([3]) + [os.path.join(self.input_directory, "no-such-file.xml")] + self.make_inputs([2])
+        summary = iatisplit.merge.merge(inputs, 10, output_dir=self.output_directory)
+        self.assertEqual(5, summary["activities"])
+        self.assertEqual([inputs[1]], list(summary["errors"]))
+        with self.assertRaises(ValueError):
+            iatisplit.merge.merge(["-"], 10, output_dir=self.output_directory)
+
+    def test_doctype(self):
+        """Inputs with different document type declarations go into separate series, each with its own declaration."""
+        inputs = self.make_inputs([3, 2, 4])
+        for filename, name in zip(inputs[1:], (b"Org", b"Organisation",)):
+            with open(filename, "rb") as f:
+                data = f.read()
+            data = data.replace(b"<iati-activities", b'<!DOCTYPE iati-activities [<!ENTITY org "' + name + b'">]>\n<iati-activities', 1)
+            with open(filename, "wb") as f:
+                f.write(data.replace(b"<narrative>Organisation", b"<narrative>&org;"))
+        summary = iatisplit.merge.merge(inputs, 10, output_dir=self.output_directory, output_stub="out")
+        self.assertEqual({}, summary["errors"])
+        self.assertEqual({"2.03": 3, "2.03-2": 2, "2.03-3": 4}, {name: group["activities"] for name, group in summary["groups"].items()})
+        for stub, name in (("out-2.03-2", "Org"), ("out-2.03-3", "Organisation"),):
+            for narrative in self.read_output(stub, 1).getElementsByTagName("reporting-org"):
+                self.assertTrue(narrative.getElementsByTagName("narrative")[0].firstChild.data.startswith(name + " "))
+
+    def test_large_first_activity(self):
+        """The prescan doesn't read past the start of a large first activity, and the merge spools it as usual."""
+        filename = os.path.join(self.input_directory, "large.xml")
+        generate_file(filename, activities=2, activity_size=0x200000)
+        self.assertEqual(
+            (b'<iati-activities version="2.03" generated-datetime="2019-01-01T00:00:00Z">', "UTF-8", None),
+            iatisplit.merge.read_root(filename)
+        )
+        summary = iatisplit.merge.merge([filename] + self.make_inputs([3]), 10, output_dir=self.output_directory, large_activity_size=0x10000)
+        self.assertEqual(5, summary["activities"])
+        self.assertEqual(5, len(self.read_output("merged", 1).getElementsByTagName("iati-activity")))
+
+    def test_script(self):
+        inputs = self.make_inputs([3, 4])
+        status = main.main(["-q", "--merge", "-n", "5", "-d", self.output_directory, "-o", "all"] + inputs)
+        self.assertEqual(0, status)
+        self.assertEqual(["all.0001.xml", "all.0002.xml"], sorted(os.listdir(self.output_directory)))
+
+
+# end of module
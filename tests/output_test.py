@@ -0,0 +1,89 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.output and iatisplit.background modules
+
+License: Public Domain
+"""
+
+import unittest
+import io, os, tempfile, shutil
+import iatisplit.background, iatisplit.output, iatisplit.split
+
+
+class TestOutputFile(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.output_directory, "out.0001.xml")
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def test_publish_on_close(self):
+        """The file appears under its final name only once it's closed."""
+        output = iatisplit.output.OutputFile(self.filename)
+        output.write(b"<iati-activities>")
+        self.assertEqual(["out.0001.xml.tmp"], os.listdir(self.output_directory))
+        output.write(b"</iati-activities>")
+        output.close()
+        self.assertEqual(["out.0001.xml"], os.listdir(self.output_directory))
+        with open(self.filename, "rb") as f:
+            self.assertEqual(b"<iati-activities></iati-activities>", f.read())
+
+    def test_suspend(self):
+        """A file closed without publishing can be appended to later."""
+        output = iatisplit.output.OutputFile(self.filename)
+        output.write(b"abc")
+        output.close(publish=False)
+        self.assertEqual(["out.0001.xml.tmp"], os.listdir(self.output_directory))
+        output = iatisplit.output.OutputFile(self.filename, append_at=output.bytes_written)
+        output.write(b"def")
+        self.assertEqual(6, output.bytes_written)
+        output.close()
+        with open(self.filename, "rb") as f:
+            self.assertEqual(b"abcdef", f.read())
+
+    def test_fsync(self):
+        for fsync in iatisplit.output.FSYNC_POLICIES:
+            output = iatisplit.output.OutputFile(self.filename, compression="gzip", fsync=fsync)
+            output.write(b"abc")
+            output.close()
+            self.assertTrue(os.path.exists(self.filename))
+        with self.assertRaises(ValueError):
+            iatisplit.output.OutputFile(self.filename, fsync="sometimes")
+
+    def test_split(self):
+        summary = iatisplit.split.split(
+            _resolve_path("iati-activities-passthrough.xml"), 1, output_dir=self.output_directory, output_stub="out", fsync="full"
+        )
+        self.assertEqual(["out.{:04d}.xml".format(n) for n in range(1, summary["files"] + 1)], sorted(os.listdir(self.output_directory)))
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def test_large_output(self):
+        """Data larger than a batch arrives intact and in order."""
+        output = io.BytesIO()
+        output.close = lambda: None
+        writer = iatisplit.background.BackgroundWriter(output)
+        data = os.urandom(1000) * 5000
+        for i in range(0, len(data), 7919):
+            writer.write(data[i:i+7919])
+        writer.close()
+        self.assertEqual(data, output.getvalue())
+
+    def test_error(self):
+        """An error in the background thread is raised in the caller."""
+        output = io.BytesIO()
+        output.write = lambda data: 1 / 0
+        writer = iatisplit.background.BackgroundWriter(output)
+        writer.write(b"x")
+        with self.assertRaises(ZeroDivisionError):
+            writer.close()
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
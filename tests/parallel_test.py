@@ -0,0 +1,115 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.parallel module
+
+License: Public Domain
+"""
+
+import unittest
+import os, tempfile, shutil, xml.parsers.expat
+import iatisplit.parallel, iatisplit.split
+from benchmarks.corpus import generate_file
+from iatisplit.filters import compile_filters
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def test_find_segments(self):
+        filename = _resolve_path("iati-activities-passthrough.xml")
+        with open(filename, "rb") as input:
+            data = input.read()
+        header, footer, segments = iatisplit.parallel.find_segments(filename, 1000, 1)
+        self.assertEqual(4, len(segments))
+        self.assertEqual(b"</iati-activities>", footer)
+        self.assertTrue(header.endswith(b"\n  "))
+        for start, end in segments:
+            self.assertTrue(data[start:end].startswith(b"<iati-activity"))
+        self.assertEqual(b"</iati-activities>\n", data[segments[-1][1]:])
+
+    def test_same_as_serial(self):
+        """Output must match a single-process run exactly."""
+        filename = _resolve_path("iati-activities-passthrough.xml")
+        serial_dir = os.path.join(self.output_directory, "serial")
+        os.mkdir(serial_dir)
+        iatisplit.split.split(filename, 1, output_dir=serial_dir)
+        parallel_dir = os.path.join(self.output_directory, "parallel")
+        os.mkdir(parallel_dir)
+        original = iatisplit.parallel.MIN_SEGMENT_SIZE
+        iatisplit.parallel.MIN_SEGMENT_SIZE = 1
+        try:
+            iatisplit.split.split(filename, 1, output_dir=parallel_dir, workers=2)
+        finally:
+            iatisplit.parallel.MIN_SEGMENT_SIZE = original
+        self.assertEqual(sorted(os.listdir(serial_dir)), sorted(os.listdir(parallel_dir)))
+        for name in os.listdir(serial_dir):
+            with open(os.path.join(serial_dir, name), "rb") as a, open(os.path.join(parallel_dir, name), "rb") as b:
+                self.assertEqual(a.read(), b.read())
+
+    def test_filter_counts(self):
+        """Filter counts from many segments are added up once each."""
+        filename = os.path.join(self.output_directory, "corpus.xml")
+        generate_file(filename, activities=2000, transactions=2)
+        serial = compile_filters(humanitarian_only=True)
+        with open(filename, "rb") as input:
+            serial_count = sum(1 for activity in iatisplit.parallel.ActivityScanner(input, fields=serial.fields, paths=serial.paths) if serial(activity.record))
+        plan = compile_filters(humanitarian_only=True)
+        scanner = iatisplit.parallel.ParallelScanner(filename, 4, plan, min_segment_size=4096)
+        self.assertEqual(serial_count, len(list(scanner)))
+        self.assertGreater(len(iatisplit.parallel.find_segments(filename, 4 * iatisplit.parallel.SEGMENTS_PER_WORKER, 4096)[2]), 8)
+        self.assertEqual((2000, serial_count), (plan.seen, plan.kept))
+        self.assertEqual(serial.rejections, plan.rejections)
+
+    def test_markup(self):
+        """Activity tags inside comments, CDATA sections and processing instructions are never used as boundaries."""
+        filename = os.path.join(self.output_directory, "edge.xml")
+        activity = '<iati-activity><iati-identifier>XM-{}</iati-identifier><title><narrative>{}</narrative></title></iati-activity>\n'
+        with open(filename, "w") as output:
+            output.write('<?xml version="1.0"?>\n<!-- <iati-activity> in the prolog -->\n<iati-activities version="2.03">\n')
+            for n in range(200):
+                if n % 10 == 3:
+                    output.write("<!-- " + activity.format("C" + str(n), "x" * 50) + " -->\n")
+                elif n % 10 == 6:
+                    output.write(activity.format(n, "<![CDATA[" + activity.format("D" + str(n), "y" * 50) + "]]>"))
+                elif n % 10 == 8:
+                    output.write("<?note " + activity.format("P" + str(n), "z" * 50) + " ?>\n")
+                else:
+                    output.write(activity.format(n, "text"))
+            output.write("</iati-activities>\n<!-- </iati-activities> -->\n")
+        header, footer, segments = iatisplit.parallel.find_segments(filename, 20, 10)
+        self.assertGreater(len(segments), 10)
+        self.assertTrue(header.endswith(b'<iati-activities version="2.03">\n'))
+        with open(filename, "rb") as input:
+            data = input.read()
+            input.seek(0)
+            expected = [(activity.offset, activity.data) for activity in iatisplit.parallel.ActivityScanner(input)]
+        self.assertEqual(160, len(expected))
+        starts = {offset for offset, activity_data in expected}
+        for start, end in segments:
+            self.assertTrue(start in starts)
+        self.assertEqual(b"</iati-activities>\n<!-- </iati-activities> -->\n", data[segments[-1][1]:])
+        scanner = iatisplit.parallel.ParallelScanner(filename, 2, compile_filters(), min_segment_size=10)
+        self.assertEqual(expected, [(activity.offset, activity.data) for activity in scanner])
+        self.assertEqual(b'<iati-activities version="2.03">', scanner.root_tag)
+
+    def test_unsafe_to_cut(self):
+        """A file that can't be cut safely is parsed in one process, with the same result."""
+        filename = os.path.join(self.output_directory, "truncated.xml")
+        with open(filename, "wb") as output:
+            output.write(b'<iati-activities version="2.03">\n' + b'<iati-activity><iati-identifier>XM-1</iati-identifier></iati-activity>\n' * 20)
+        with self.assertRaises(ValueError):
+            iatisplit.parallel.find_segments(filename, 4, 10)
+        with self.assertLogs("iatisplit.parallel", "WARNING"), self.assertRaises(xml.parsers.expat.ExpatError):
+            list(iatisplit.parallel.ParallelScanner(filename, 2, compile_filters(), min_segment_size=10))
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
@@ -0,0 +1,91 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.partition module
+
+License: Public Domain
+"""
+
+import unittest
+import gzip, os, tempfile, shutil
+import iatisplit.__main__ as main, iatisplit.partition, iatisplit.scanner, iatisplit.split
+
+
+class TestPartition(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+        # the fixture's activities twice over, so that keys come back after they've been suspended
+        with open(_resolve_path("iati-activities-passthrough.xml"), "rb") as f:
+            original = f.read()
+        start = original.index(b"  <iati-activity ")
+        end = original.index(b"</iati-activities>")
+        self.input = os.path.join(self.output_directory, "input.xml")
+        with open(self.input, "wb") as f:
+            f.write(original[:end] + original[start:end] + original[end:])
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def test_key(self):
+        key = iatisplit.partition.PartitionKey("reporting-org/@ref")
+        self.assertEqual({"reporting-org/@ref"}, key.paths)
+        record = iatisplit.scanner.ActivityRecord()
+        self.assertEqual("none", key(record))
+        record.values["reporting-org/@ref"] = ["XM/DAC 1", "XM-2"]
+        self.assertEqual("XM_DAC_1", key(record))
+        record.values["reporting-org/@ref"] = [".."]
+        self.assertEqual("none", key(record))
+        with self.assertRaises(ValueError):
+            iatisplit.partition.PartitionKey("reporting-org//@ref")
+
+    def test_start_year(self):
+        output_dir = os.path.join(self.output_directory, "out")
+        summary = iatisplit.split.split(self.input, 0, output_dir=output_dir, output_stub="out", partition_by="start-year", max_open_files=1)
+        self.assertEqual({"2015": 2, "2018": 2, "2019": 2}, summary["partitions"])
+        # per-key counters and limits: max=0 means one activity per file (see split())
+        self.assertEqual(6, summary["files"])
+        self.assertEqual(["out.0001.xml", "out.0002.xml"], sorted(os.listdir(os.path.join(output_dir, "2018"))))
+        with open(os.path.join(output_dir, "2015", "out.0002.xml"), "rb") as f:
+            data = f.read()
+        self.assertTrue(data.startswith(b"<?xml"))
+        self.assertEqual(1, data.count(b"XM-EXAMPLE-0003"))
+        self.assertTrue(data.endswith(b"</iati-activities>\n"))
+
+    def test_append_compressed(self):
+        """Suspended files are reopened in append mode (as a new compressed stream)."""
+        output_dir = os.path.join(self.output_directory, "out")
+        status = main.main(["-q", "-n", "100", "-P", "@default-currency", "--max-open-files", "1", "-z", "gzip", "-d", output_dir, "-o", "out", self.input])
+        self.assertEqual(0, status)
+        self.assertEqual(["USD", "none"], sorted(os.listdir(output_dir)))
+        with gzip.open(os.path.join(output_dir, "none", "out.0001.xml.gz"), "rb") as f:
+            data = f.read()
+        self.assertEqual(2, data.count(b"XM-EXAMPLE-0002"))
+        self.assertEqual(1, data.count(b"<iati-activities "))
+        self.assertTrue(data.endswith(b"</iati-activity>\n</iati-activities>\n"))
+
+    def test_open_files_with_flatten(self):
+        """Each key holds three files with flattened outputs, and all of them count towards max_open."""
+        output_dir = os.path.join(self.output_directory, "out")
+        writer = iatisplit.partition.PartitionWriter(
+            lambda key: iatisplit.split.ChunkWriter(os.path.join(output_dir, key), "out", b"<iati-activities>", flatten=True),
+            output_dir, 7
+        )
+        record = iatisplit.scanner.ActivityRecord()
+        record.identifier = "XM-1"
+        try:
+            for key in ("a", "b", "c", "a", "d", "b",):
+                writer.write(key, b"  <iati-activity/>\n", record)
+                open_files = [writer.writers[key].open_files for key in sorted(writer.writers)]
+                self.assertLessEqual(sum(open_files), 7)
+                self.assertEqual(3, writer.writers[key].open_files)
+            self.assertEqual([0, 3, 0, 3], open_files)
+        finally:
+            writer.close()
+        self.assertEqual(0, sum(chunk_writer.open_files for chunk_writer in writer.writers.values()))
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
@@ -0,0 +1,89 @@
+#coding=UTF8
+"""A local HTTP server for the tests, with optional Range support
+
+License: Public Domain
+"""
+
+import gzip, http.server, os, re, threading
+
+
+class RangeServer:
+    """Serve the files in a directory on localhost, in a background thread.
+    Supports HEAD, ETag and Last-Modified headers, and single byte ranges
+    (with If-Range), unless ranges=False. With content_encoding="gzip", bodies
+    (and ranges) are gzipped for clients that accept it, or for every
+    client if ignore_accept_encoding=True.
+    """
+
+    def __init__(self, directory, ranges=True, content_encoding=None, ignore_accept_encoding=False):
+        self.directory = directory
+        self.ranges = ranges
+        self.content_encoding = content_encoding
+        self.ignore_accept_encoding = ignore_accept_encoding
+        self.requests = []
+        """(method, path, Range header) for each request received."""
+        self.accept_encodings = []
+        """The Accept-Encoding header for each request received."""
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_HEAD(self):
+                self._respond(False)
+
+            def do_GET(self):
+                self._respond(True)
+
+            def _respond(self, body):
+                server.requests.append((self.command, self.path, self.headers.get("Range")))
+                server.accept_encodings.append(self.headers.get("Accept-Encoding"))
+                path = os.path.join(server.directory, self.path.lstrip("/"))
+                if not os.path.isfile(path):
+                    self.send_error(404)
+                    return
+                with open(path, "rb") as f:
+                    data = f.read()
+                stat = os.stat(path)
+                etag = '"{}-{}"'.format(stat.st_size, stat.st_mtime_ns)
+                start, end = 0, len(data)
+                match = re.match(r'^bytes=(\d+)-(\d*)$', self.headers.get("Range") or "")
+                if server.ranges and match and self.headers.get("If-Range", etag) == etag:
+                    start = int(match.group(1))
+                    end = int(match.group(2)) + 1 if match.group(2) else len(data)
+                    self.send_response(206)
+                    self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end - 1, len(data)))
+                else:
+                    self.send_response(200)
+                if server.ranges:
+                    self.send_header("Accept-Ranges", "bytes")
+                data = data[start:end]
+                if server.content_encoding and (server.ignore_accept_encoding or "gzip" in (self.headers.get("Accept-Encoding") or "")):
+                    data = gzip.compress(data)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", self.date_time_string(int(stat.st_mtime)))
+                self.end_headers()
+                if body:
+                    self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def url(self, filename):
+        """Get the URL for a file in the directory."""
+        return "http://127.0.0.1:{}/{}".format(self.httpd.server_address[1], filename)
+
+
+# end of module
@@ -0,0 +1,74 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.requests_wrapper module
+
+License: Public Domain
+"""
+
+import unittest
+from iatisplit.requests_wrapper import RequestsResponseIOWrapper
+
+
+class FakeResponse:
+    """Stand-in for a streaming requests response."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.headers = {}
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+CHUNKS = [b"abcde", b"", b"fgh", b"ijklmnopqrstuvwxyz"]
+
+class TestWrapper(unittest.TestCase):
+
+    def test_read(self):
+        wrapper = RequestsResponseIOWrapper(FakeResponse(CHUNKS))
+        result = []
+        while True:
+            data = wrapper.read(4)
+            if not data:
+                break
+            self.assertTrue(len(data) <= 4)
+            result.append(data)
+        self.assertEqual(b"abcdefghijklmnopqrstuvwxyz", b"".join(result))
+
+    def test_read_whole_chunk(self):
+        """A whole chunk is returned without copying."""
+        wrapper = RequestsResponseIOWrapper(FakeResponse(CHUNKS))
+        self.assertIs(CHUNKS[0], wrapper.read(100))
+
+    def test_readall(self):
+        wrapper = RequestsResponseIOWrapper(FakeResponse(CHUNKS))
+        self.assertEqual(b"ab", wrapper.read(2))
+        self.assertEqual(b"cdefghijklmnopqrstuvwxyz", wrapper.read())
+
+    def test_readinto(self):
+        wrapper = RequestsResponseIOWrapper(FakeResponse(CHUNKS))
+        buffer = bytearray(10)
+        self.assertEqual(10, wrapper.readinto(buffer))
+        self.assertEqual(b"abcdefghij", buffer)
+        self.assertEqual(10, wrapper.readinto(buffer))
+        self.assertEqual(b"klmnopqrst", buffer)
+        self.assertEqual(6, wrapper.readinto(buffer))
+        self.assertEqual(b"uvwxyz", buffer[:6])
+        self.assertEqual(0, wrapper.readinto(buffer))
+
+    def test_buffered(self):
+        """Works underneath a standard BufferedReader."""
+        import io
+        wrapper = io.BufferedReader(RequestsResponseIOWrapper(FakeResponse(CHUNKS)), 7)
+        self.assertEqual(b"abcdefghijklmnopqrstuvwxyz", wrapper.read())
+
+    def test_close(self):
+        response = FakeResponse(CHUNKS)
+        RequestsResponseIOWrapper(response).close()
+        self.assertTrue(response.closed)
+
+
+# end of module
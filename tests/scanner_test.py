@@ -0,0 +1,118 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.scanner module
+
+License: Public Domain
+"""
+
+import unittest
+import io, os, tempfile, xml.dom.minidom
+import iatisplit.scanner, iatisplit.split
+
+
+SAMPLE = b'''<?xml version="1.0" encoding="UTF-8"?>
+<iati-activities version="2.03" xmlns:usg="http://example.org/usg">
+  <iati-activity humanitarian="1"   last-updated-datetime='2019-01-01'>
+    <iati-identifier>XM-1</iati-identifier>
+    <title><narrative>A &amp; B</narrative></title>
+  </iati-activity >
+  <iati-activity><iati-identifier>XM-2</iati-identifier><usg:x a=">"/></iati-activity>
+  <iati-activity/>
+</iati-activities>
+'''
+
+
+class TestScanner(unittest.TestCase):
+
+    def scan(self, data, read_size=iatisplit.scanner.READ_SIZE):
+        scanner = iatisplit.scanner.ActivityScanner(io.BytesIO(data), read_size)
+        return scanner, list(scanner)
+
+    def test_exact_bytes(self):
+        scanner, activities = self.scan(SAMPLE)
+        self.assertEqual(3, len(activities))
+        for activity in activities:
+            self.assertEqual(activity.data, SAMPLE[activity.offset:activity.offset+len(activity.data)])
+        self.assertTrue(activities[0].data.startswith(b'<iati-activity humanitarian="1"   last-updated'))
+        self.assertTrue(activities[0].data.endswith(b'</iati-activity >'))
+        self.assertEqual(b'<iati-activity/>', activities[2].data)
+
+    def test_root_tag(self):
+        scanner, activities = self.scan(SAMPLE)
+        self.assertEqual(b'<iati-activities version="2.03" xmlns:usg="http://example.org/usg">', scanner.root_tag)
+        self.assertEqual("UTF-8", scanner.encoding)
+
+    def test_doctype(self):
+        doctype = b'<!DOCTYPE iati-activities [\n  <!ENTITY org "Org">\n]>'
+        data = SAMPLE.replace(b"<iati-activities", doctype + b"\n<iati-activities", 1)
+        for read_size in (1, 7, iatisplit.scanner.READ_SIZE):
+            scanner, activities = self.scan(data, read_size)
+            self.assertEqual(doctype, scanner.doctype)
+        self.assertIsNone(self.scan(SAMPLE)[0].doctype)
+
+    def test_small_reads(self):
+        """Activities must come out the same however the input is chunked."""
+        expected = [activity.data for activity in self.scan(SAMPLE)[1]]
+        for read_size in (1, 7, 64):
+            self.assertEqual(expected, [activity.data for activity in self.scan(SAMPLE, read_size)[1]])
+
+    def test_read_root(self):
+        """read_root() stops within a block of the root start tag, however big the first activity is."""
+        data = SAMPLE.replace(b"<title>", b"<title>" + b"x" * 0x100000, 1)
+        input = io.BytesIO(data)
+        scanner = iatisplit.scanner.ActivityScanner(input, 1024)
+        self.assertEqual(b'<iati-activities version="2.03" xmlns:usg="http://example.org/usg">', scanner.read_root())
+        self.assertEqual("UTF-8", scanner.encoding)
+        self.assertLessEqual(input.tell(), 1024)
+
+    def test_large_activities(self):
+        """Large activities are spooled to a temporary file, with the same bytes and records."""
+        expected = self.scan(SAMPLE)[1]
+        for read_size in (7, 64):
+            scanner = iatisplit.scanner.ActivityScanner(io.BytesIO(SAMPLE), read_size, large_activity_size=20)
+            activities = list(scanner)
+            self.assertIsInstance(activities[0].data, iatisplit.scanner.SpooledData)
+            self.assertEqual([activity.data for activity in expected], [bytes(activity.data) for activity in activities])
+            self.assertEqual([activity.offset for activity in expected], [activity.offset for activity in activities])
+            self.assertEqual([activity.record.identifier for activity in expected], [activity.record.identifier for activity in activities])
+            self.assertEqual(scanner.root_tag, self.scan(SAMPLE)[0].root_tag)
+
+    def test_spooled_data(self):
+        with tempfile.TemporaryFile() as f:
+            f.write(b"..<iati-activity/>..")
+            f.flush()
+            data = iatisplit.scanner.SpooledData(f, 2, 16)
+            entry = b"  " + data + b"\n"
+            self.assertEqual(19, len(entry))
+            self.assertEqual(b"  <iati-activity/>\n", b"".join(iatisplit.scanner.iter_chunks(entry)))
+            self.assertEqual([b"  ", b"<iati", b"-acti", b"vity/", b">", b"\n"], list(entry.chunks(5)))
+            self.assertEqual(b"<iati-activity/>", bytes(data))
+        self.assertEqual([b"abc"], list(iatisplit.scanner.iter_chunks(b"abc")))
+
+    def test_record(self):
+        activities = self.scan(open(_resolve_path("iati-activities-passthrough.xml"), "rb").read())[1]
+        record = activities[0].record
+        self.assertEqual("XM-EXAMPLE-0001", record.identifier)
+        self.assertTrue(record.humanitarian)
+        self.assertEqual({"start_planned": "2018-01-01", "end_planned": "2018-12-31"}, record.activity_dates)
+        self.assertEqual([("3", "2018-03-01", "1000", "EUR")], record.transactions)
+        self.assertEqual([("2", "2019-02-01", "500", None)], activities[1].record.transactions)
+        # humanitarian marker on a transaction
+        self.assertTrue(activities[1].record.humanitarian)
+        # no identifier
+        self.assertIsNone(activities[2].record.identifier)
+        self.assertFalse(activities[3].record.humanitarian)
+
+    def test_record_matches_dom(self):
+        """The record gives the same results as the DOM-based filter functions."""
+        activity = self.scan(open(_resolve_path("iati-activities-simple.xml"), "rb").read())[1][0]
+        node = xml.dom.minidom.parseString(activity.data).documentElement
+        for f in (iatisplit.split.get_identifier, iatisplit.split.is_humanitarian, iatisplit.split.get_activity_dates, iatisplit.split.get_transaction_dates):
+            self.assertEqual(f(node), f(activity.record))
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module
@@ -0,0 +1,147 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.sort module (sorted splits and merges)
+
+License: Public Domain
+"""
+
+import unittest
+import gc, os, tempfile, shutil, tracemalloc, xml.dom.minidom
+import iatisplit.__main__ as main, iatisplit.merge, iatisplit.split
+from benchmarks.corpus import generate_file
+from iatisplit.expressions import LAST_UPDATED_PATH
+from iatisplit.scanner import ActivityRecord, SpooledData, iter_chunks
+from iatisplit.sort import ExternalSorter, SortKey
+from iatisplit.stats import Stats
+
+
+class TestSort(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.output_directory, "corpus.xml")
+        generate_file(self.filename, activities=200, transactions=2, seed=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def read_identifiers(self, stub, files):
+        identifiers = []
+        for n in range(1, files + 1):
+            document = xml.dom.minidom.parse(iatisplit.split.make_filename(self.output_directory, stub, n))
+            identifiers += [node.firstChild.data for node in document.getElementsByTagName("iati-identifier")]
+        return identifiers
+
+    def test_sort_key(self):
+        record = ActivityRecord()
+        record.identifier = " XM-1 "
+        record.activity_dates = {"start_planned": "2019-01-01", "start_actual": "2018-06-01"}
+        record.values = {LAST_UPDATED_PATH: ["2020-01-01T00:00:00"]}
+        self.assertEqual((0, "XM-1"), SortKey("identifier")(record))
+        self.assertEqual((0, "2018-06-01"), SortKey("start-date")(record))
+        self.assertEqual((0, "2020-01-01T00:00:00"), SortKey("last-updated")(record))
+        self.assertEqual((1, ""), SortKey("recipient-country/@code")(record))
+        self.assertLess(SortKey("identifier")(record), SortKey("recipient-country/@code")(record))
+        with self.assertRaises(ValueError):
+            SortKey("recipient-country/@")
+
+    def test_external_sorter(self):
+        """Small memory budgets spill many runs (and merge them in several passes), with the same order as an in-memory sort."""
+        keys = [(0, "{:03d}".format((n * 37) % 100)) for n in range(500)]
+        with tempfile.TemporaryFile() as large:
+            large.write(b"<iati-activity>large</iati-activity>")
+            large.flush()
+            for memory, max_runs in ((None, 64), (0x4000, 64), (0x4000, 3),):
+                sorter = ExternalSorter(memory, max_runs) if memory else ExternalSorter()
+                try:
+                    for n, key in enumerate(keys):
+                        data = SpooledData(large, 0, 36) if n % 50 == 0 else "<iati-activity>{}</iati-activity>".format(n).encode()
+                        sorter.add(key, data, n)
+                    # spooled data can be read only until the sorter is closed
+                    result = [(key, b"".join(iter_chunks(data)), record) for key, data, record in sorter]
+                finally:
+                    sorter.close()
+                self.assertEqual(sorted(keys), [key for key, data, record in result])
+                # equal keys keep their input order
+                self.assertEqual(sorted(range(500), key=lambda n: keys[n]), [record for key, data, record in result])
+                for key, data, record in result:
+                    if record % 50 == 0:
+                        self.assertEqual(b"<iati-activity>large</iati-activity>", data)
+                    else:
+                        self.assertEqual("<iati-activity>{}</iati-activity>".format(record).encode(), data)
+                if memory:
+                    self.assertGreater(sorter.spilled, 10)
+
+    def test_memory_estimate(self):
+        """The buffered size is close to (and not under) the memory that the buffered activities really use."""
+        key = SortKey("start-date")
+        activities = lambda: iatisplit.split.iter_activities(self.filename, fields=["transactions"], filters=["recipient-country/@code"])
+        # a first pass, so that the modules it imports aren't counted
+        for activity in activities():
+            pass
+        sorter = ExternalSorter(0x10000000)
+        try:
+            tracemalloc.start()
+            try:
+                for activity in activities():
+                    sorter.add(key(activity.record), activity.data, activity.record)
+                # the finished parser is only freed with its reference cycles
+                gc.collect()
+                used = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(0, sorter.spilled)
+            # shared objects are counted with every item, so the estimate errs on the high side
+            self.assertGreater(sorter._buffered, used * 0.9)
+            self.assertLess(sorter._buffered, used * 1.5)
+        finally:
+            sorter.close()
+        # a budget just over the buffered size doesn't spill, and one just under it does
+        for margin, spilled in ((0x100, 0), (-0x100, 1),):
+            sorter = ExternalSorter((sorter._buffered + margin) * 4 // 3)
+            try:
+                for activity in activities():
+                    sorter.add(key(activity.record), activity.data, activity.record)
+                self.assertEqual(spilled, sorter.spilled)
+            finally:
+                sorter.close()
+
+    def test_sorted_split(self):
+        expected = iatisplit.split.split(self.filename, 30, output_dir=self.output_directory, output_stub="unsorted")
+        identifiers = sorted(self.read_identifiers("unsorted", expected["files"]))
+        for workers, memory in ((1, None), (1, 0x4000), (2, 0x4000),):
+            stats = Stats()
+            summary = iatisplit.split.split(
+                self.filename, 30, output_dir=self.output_directory, output_stub="sorted", workers=workers,
+                sort_by="identifier", sort_memory=memory, stats=stats
+            )
+            self.assertEqual(expected["files"], summary["files"])
+            self.assertEqual(identifiers, self.read_identifiers("sorted", summary["files"]))
+            self.assertGreater(summary["stats"]["times"]["sort"], 0)
+
+    def test_sorted_by_date(self):
+        summary = iatisplit.split.split(self.filename, 1000, output_dir=self.output_directory, output_stub="sorted", sort_by="start-date", sort_memory=0x4000)
+        document = xml.dom.minidom.parse(iatisplit.split.make_filename(self.output_directory, "sorted", 1))
+        dates = []
+        for activity in document.getElementsByTagName("iati-activity"):
+            found = {node.getAttribute("type"): node.getAttribute("iso-date") for node in activity.getElementsByTagName("activity-date")}
+            dates.append(found.get("2") or found.get("1"))
+        self.assertEqual(200, len(dates))
+        self.assertEqual(sorted(dates), dates)
+
+    def test_sorted_merge(self):
+        other = os.path.join(self.output_directory, "other.xml")
+        generate_file(other, activities=50, transactions=1, seed=4, version="1.05")
+        summary = iatisplit.merge.merge([self.filename, other], 1000, output_dir=self.output_directory, sort_by="identifier", sort_memory=0x4000)
+        self.assertEqual({"2.03": 200, "1.05": 50}, {name: group["activities"] for name, group in summary["groups"].items()})
+        for name in ("2.03", "1.05",):
+            identifiers = self.read_identifiers("merged-" + name, 1)
+            self.assertEqual(sorted(identifiers), identifiers)
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            iatisplit.split.split(self.filename, 30, output_dir=self.output_directory, checkpoint=True, sort_by="identifier")
+        with self.assertRaises(SystemExit):
+            main.main(["-q", "--stdout", "--sort-by", "identifier", self.filename])
+
+
+# end of module
@@ -7,11 +7,14 @@ License: Public Domain
 """
 
 import unittest
-import os, tempfile, shutil
-import iatisplit.__main__ as main, iatisplit.split
+import contextlib, io, os, re, subprocess, sys, tempfile, shutil
+import iatisplit.__main__ as main, iatisplit.parallel, iatisplit.split
+from benchmarks.corpus import generate_file
+from iatisplit.index import build_index
+from iatisplit.stats import Stats
 
 import os
-import xml.dom.minidom
+import xml.dom.minidom, xml.parsers.expat
 
 
 class TestScript(unittest.TestCase):
@@ -48,6 +51,164 @@ class TestScript(unittest.TestCase):
         self.assertFalse("iati-activities-Afghanistan.0011.xml" in os.listdir(self.output_directory))
 
 
+class TestSplit(unittest.TestCase):
+    """Tests for the split function itself."""
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def test_passthrough(self):
+        """Activities are copied without being re-serialised."""
+        iatisplit.split.split(_resolve_path("iati-activities-passthrough.xml"), 10, output_dir=self.output_directory)
+        with open(_resolve_path("iati-activities-passthrough.xml"), "rb") as input:
+            original = input.read()
+        with open(os.path.join(self.output_directory, "iati-activities-passthrough.0001.xml"), "rb") as output:
+            result = output.read()
+        start = original.index(b"<iati-activity ")
+        end = original.index(b"</iati-activity>") + len(b"</iati-activity>")
+        self.assertTrue(original[start:end] in result)
+        self.assertTrue(original.splitlines()[1] in result)
+        self.assertFalse(b"No identifier" in result)
+        self.assertTrue(result.endswith(b"</iati-activities>\n"))
+
+    def test_max_bytes(self):
+        """Roll over to a new file before --max-bytes would be exceeded."""
+        filename = _resolve_path("iati-activities-passthrough.xml")
+        sizes = {}
+        for max_bytes in (600, 1200):
+            output_dir = os.path.join(self.output_directory, str(max_bytes))
+            os.mkdir(output_dir)
+            main.main(["-b", str(max_bytes), "-d", output_dir, "-o", "out", filename])
+            sizes[max_bytes] = [os.path.getsize(os.path.join(output_dir, name)) for name in sorted(os.listdir(output_dir))]
+        # the first activity is too big for 600 bytes on its own
+        self.assertEqual(3, len(sizes[600]))
+        self.assertTrue(sizes[600][0] > 600)
+        self.assertTrue(all(size <= 600 for size in sizes[600][1:]))
+        self.assertEqual(2, len(sizes[1200]))
+        self.assertTrue(all(size <= 1200 for size in sizes[1200]))
+
+    def test_max_bytes_and_activities(self):
+        summary = iatisplit.split.split(_resolve_path("iati-activities-passthrough.xml"), 0, output_dir=self.output_directory, max_bytes=100000)
+        self.assertEqual(3, summary["files"])
+
+    def test_iter_activities(self):
+        activities = iatisplit.split.iter_activities(_resolve_path("iati-activities-passthrough.xml"), humanitarian_only=True, fields=["transaction_values"])
+        activity = next(activities)
+        self.assertEqual("XM-EXAMPLE-0001", activity.record.identifier)
+        self.assertTrue(activity.data.startswith(b"<iati-activity "))
+        self.assertEqual([("3", "2018-03-01", "1000", "EUR")], activity.record.transactions)
+        self.assertEqual(["XM-EXAMPLE-0002"], [activity.record.identifier for activity in activities])
+
+    def test_filter_document(self):
+        output = io.BytesIO()
+        summary = iatisplit.split.filter_document(_resolve_path("iati-activities-passthrough.xml"), output, start_date="2017-01-01")
+        self.assertEqual(2, summary["activities"])
+        result = output.getvalue()
+        self.assertTrue(result.startswith(b"<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<iati-activities "))
+        self.assertTrue(result.endswith(b"</iati-activity>\n</iati-activities>\n"))
+        # nothing passes: still a complete document
+        output = io.BytesIO()
+        iatisplit.split.filter_document(_resolve_path("iati-activities-passthrough.xml"), output, filters=["@no-such-attribute"])
+        self.assertTrue(output.getvalue().endswith(b"usg\">\n</iati-activities>\n"))
+
+    def test_pipeline(self):
+        """Read from standard input and write to standard output."""
+        with open(_resolve_path("iati-activities-passthrough.xml"), "rb") as f:
+            data = f.read()
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        result = subprocess.run([sys.executable, "-m", "iatisplit", "-q", "--stdout", "-H", "-"], input=data, stdout=subprocess.PIPE, env=env, check=True)
+        self.assertTrue(b"XM-EXAMPLE-0002" in result.stdout)
+        self.assertFalse(b"XM-EXAMPLE-0003" in result.stdout)
+        self.assertTrue(result.stdout.endswith(b"</iati-activities>\n"))
+
+    def test_stdout_rejects_options(self):
+        """--stdout doesn't silently ignore options it can't honour."""
+        filename = _resolve_path("iati-activities-passthrough.xml")
+        for options in (["-m"], ["--stats", os.path.join(self.output_directory, "stats.json")], ["--progress"], ["--profile", self.output_directory],):
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                main.main(["-q", "--stdout"] + options + [filename])
+        self.assertEqual([], os.listdir(self.output_directory))
+
+    def test_filter_expressions(self):
+        filename = _resolve_path("iati-activities-passthrough.xml")
+        main.main(["-n", "10", "-d", self.output_directory, "-o", "out", "-f", "title/narrative ~ sanitation or transaction/value < 600", filename])
+        with open(os.path.join(self.output_directory, "out.0001.xml"), "rb") as output:
+            result = output.read()
+        self.assertTrue(b"XM-EXAMPLE-0001" in result)
+        self.assertTrue(b"XM-EXAMPLE-0002" in result)
+        self.assertFalse(b"XM-EXAMPLE-0003" in result)
+
+    def test_large_activities(self):
+        """Activities over large_activity_size go through a temporary file, with the same output."""
+        filename = os.path.join(self.output_directory, "large.xml")
+        generate_file(filename, activities=6, activity_size=0x180000)
+        expected = iatisplit.split.split(filename, 4, output_dir=self.output_directory, output_stub="expected", large_activity_size=None)
+        for workers, use_index in ((1, False), (2, False), (1, True),):
+            if use_index:
+                build_index(filename)
+            stats = Stats()
+            summary = iatisplit.split.split(
+                filename, 4, output_dir=self.output_directory, output_stub="large", workers=workers, use_index=use_index,
+                stats=stats, large_activity_size=0x10000
+            )
+            self.assertEqual(6, summary["stats"]["large_activities"])
+            self.assertEqual(expected["files"], summary["files"])
+            for n in range(1, summary["files"] + 1):
+                with open(iatisplit.split.make_filename(self.output_directory, "expected", n), "rb") as f:
+                    expected_data = f.read()
+                with open(iatisplit.split.make_filename(self.output_directory, "large", n), "rb") as f:
+                    self.assertEqual(expected_data, f.read())
+        output = io.BytesIO()
+        iatisplit.split.filter_document(filename, output, large_activity_size=0x10000)
+        with open(filename, "rb") as f:
+            self.assertEqual(len(f.read()), len(output.getvalue()))
+
+    def test_doctype(self):
+        """A document type declaration is copied into every output, so entities that it declares still resolve."""
+        filename = os.path.join(self.output_directory, "doctype.xml")
+        generate_file(filename, activities=12, transactions=1)
+        with open(filename, "rb") as f:
+            data = f.read()
+        data = data.replace(b"<iati-activities", b'<!DOCTYPE iati-activities [\n  <!ENTITY org "Org &#38;amp; partners">\n]>\n<iati-activities', 1)
+        data = re.sub(rb"<narrative>Organisation [0-9]+ &amp; partners</narrative>", b"<narrative>&org;</narrative>", data)
+        with open(filename, "wb") as f:
+            f.write(data)
+        original = iatisplit.parallel.MIN_SEGMENT_SIZE
+        iatisplit.parallel.MIN_SEGMENT_SIZE = 1
+        try:
+            for workers, use_index in ((1, False), (2, False), (1, True),):
+                if use_index:
+                    build_index(filename)
+                summary = iatisplit.split.split(filename, 4, output_dir=self.output_directory, output_stub="out", workers=workers, use_index=use_index)
+                self.assertEqual(3, summary["files"])
+                for n in range(1, 4):
+                    document = xml.dom.minidom.parse(iatisplit.split.make_filename(self.output_directory, "out", n))
+                    names = [node.firstChild.data for node in document.getElementsByTagName("reporting-org")[0].getElementsByTagName("narrative")]
+                    self.assertEqual(["Org & partners"], names)
+        finally:
+            iatisplit.parallel.MIN_SEGMENT_SIZE = original
+        output = io.BytesIO()
+        iatisplit.split.filter_document(filename, output)
+        self.assertEqual(12, len(xml.dom.minidom.parseString(output.getvalue()).getElementsByTagName("iati-activity")))
+
+    def test_truncated_input(self):
+        """After a parse error, the document in progress stays under its temporary name instead of being published."""
+        filename = os.path.join(self.output_directory, "broken.xml")
+        generate_file(filename, activities=12)
+        with open(filename, "rb") as f:
+            data = f.read()
+        with open(filename, "wb") as f:
+            f.write(data[:len(data) // 2])
+        with self.assertRaises(xml.parsers.expat.ExpatError):
+            iatisplit.split.split(filename, 4, output_dir=self.output_directory, output_stub="broken")
+        self.assertTrue(os.path.exists(iatisplit.split.make_filename(self.output_directory, "broken", 1)))
+        self.assertFalse(os.path.exists(iatisplit.split.make_filename(self.output_directory, "broken", 2)))
+        self.assertTrue(os.path.exists(iatisplit.split.make_filename(self.output_directory, "broken", 2) + ".tmp"))
+
+
 class TestFunctions(unittest.TestCase):
     """Low-level functional tests."""
 
@@ -0,0 +1,91 @@
+#coding=UTF8
+"""Unit tests for the iatisplit.stats module
+
+License: Public Domain
+"""
+
+import unittest
+import json, os, pickle, tempfile, shutil
+import iatisplit.__main__ as main, iatisplit.split
+from iatisplit.stats import STAGES, Stats
+
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        self.output_directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_directory)
+
+    def test_stats(self):
+        filename = _resolve_path("iati-activities-passthrough.xml")
+        stats = Stats()
+        summary = iatisplit.split.split(
+            filename, 1, output_dir=self.output_directory, humanitarian_only=True, use_index=False, stats=stats
+        )
+        result = summary["stats"]
+        self.assertEqual([
+            "input", "elapsed", "bytes_read", "bytes_per_second", "seen", "kept", "rejected", "activities", "files",
+            "large_activities", "peak_rss_kb", "times",
+        ], list(result))
+        self.assertEqual(filename, result["input"])
+        self.assertEqual(os.path.getsize(filename), result["bytes_read"])
+        self.assertEqual(stats.seen, result["seen"])
+        self.assertEqual(summary["activities"], result["activities"])
+        self.assertEqual(summary["files"], result["files"])
+        self.assertEqual(result["seen"] - result["kept"], sum(result["rejected"].values()))
+        self.assertEqual(list(STAGES), list(result["times"]))
+        for seconds in result["times"].values():
+            self.assertGreaterEqual(seconds, 0)
+        self.assertLessEqual(sum(result["times"].values()), result["elapsed"])
+        json.dumps(result)
+
+    def test_reset(self):
+        stats = Stats()
+        filename = _resolve_path("iati-activities-simple.xml")
+        iatisplit.split.split(filename, 1, output_dir=self.output_directory, use_index=False, stats=stats)
+        first = stats.to_dict()
+        iatisplit.split.split(filename, 1, output_dir=self.output_directory, use_index=False, stats=stats)
+        self.assertEqual(first["seen"], stats.seen)
+        self.assertEqual(first["bytes_read"], stats.bytes_read)
+
+    def test_callback(self):
+        calls = []
+        stats = Stats(callback=lambda stats: calls.append(stats.seen), interval=1)
+        iatisplit.split.split(_resolve_path("iati-activities-passthrough.xml"), 1, output_dir=self.output_directory, use_index=False, stats=stats)
+        # during the split, then once at the end
+        self.assertGreater(len(calls), 2)
+        self.assertEqual(sorted(calls), calls)
+        self.assertEqual(stats.seen, calls[-1])
+
+    def test_profile(self):
+        profile_directory = os.path.join(self.output_directory, "profile")
+        stats = Stats(profile=True)
+        iatisplit.split.split(_resolve_path("iati-activities-passthrough.xml"), 1, output_dir=self.output_directory, use_index=False, stats=stats)
+        stats.save_profiles(profile_directory)
+        self.assertEqual(sorted("{}.prof".format(stage) for stage in STAGES), sorted(os.listdir(profile_directory)))
+
+    def test_pickle(self):
+        stats = pickle.loads(pickle.dumps(Stats(callback=print, profile=True)))
+        self.assertIsNone(stats.callback)
+        self.assertIsNone(stats.profiles)
+
+    def test_script(self):
+        stats_filename = os.path.join(self.output_directory, "stats.json")
+        main.main([
+            "-n", "1", "-d", self.output_directory, "-q", "--no-index", "--stats", stats_filename,
+            _resolve_path("iati-activities-passthrough.xml")
+        ])
+        with open(stats_filename, "r") as f:
+            result = json.load(f)
+        self.assertEqual(1, len(result))
+        self.assertEqual(_resolve_path("iati-activities-passthrough.xml"), result[0]["input"])
+
+
+def _resolve_path(filename):
+    """Resolve a pathname for a test input file."""
+    return os.path.join(os.path.dirname(__file__), "files", filename)
+
+
+# end of module